@@ -0,0 +1,48 @@
+from tortoise import fields
+
+from .db import Model
+
+# 默认账号，就是Config表里配置的那个
+DEFAULT_ACCOUNT = "default"
+
+
+class Account(Model):
+    """账号池中额外的Poe账号"""
+
+    name = fields.TextField(pk=True)  # 账号名称
+    p_b = fields.TextField()
+    p_lat = fields.TextField()
+    formkey = fields.TextField()
+
+    class Meta:
+        table = "account"
+
+    @classmethod
+    async def add_account(cls, name: str, p_b: str, p_lat: str, formkey: str):
+        """添加或更新账号"""
+        await cls.update_or_create(
+            name=name, defaults={"p_b": p_b, "p_lat": p_lat, "formkey": formkey}
+        )
+
+    @classmethod
+    async def account_exist(cls, name: str) -> bool:
+        """账号是否存在"""
+        return await cls.filter(name=name).limit(1).exists()
+
+    @classmethod
+    async def get_account(cls, name: str) -> tuple[str, str, str] | None:
+        """获取账号凭证(p_b, p_lat, formkey)，不存在返回None"""
+        _rows = (
+            await cls.filter(name=name).limit(1).values_list("p_b", "p_lat", "formkey")
+        )
+        return _rows[0] if _rows else None
+
+    @classmethod
+    async def remove_account(cls, name: str):
+        """删除账号"""
+        await cls.filter(name=name).limit(1).delete()
+
+    @classmethod
+    async def list_account(cls) -> list[tuple[str, str, str, str]]:
+        """列出所有账号"""
+        return await cls.all().values_list("name", "p_b", "p_lat", "formkey")
@@ -9,7 +9,8 @@ class Bot(Model):
     img_url = fields.TextField()  # 模型头像链接
     bot_type = fields.TextField()  # 模型类型  官方  自定义   第三方
     bot_handle = fields.TextField()  # Bot handle
-    bot_id = fields.IntField()  # Bot id，某些时候用
+    bot_id = fields.BigIntField()  # Bot id，某些时候用
+    account = fields.TextField(default="default")  # 创建或添加该bot的Poe账号
 
     class Meta:
         table = "bot"
@@ -23,6 +24,7 @@ class Bot(Model):
         bot_type: str,
         bot_handle: str,
         bot_id: int,
+        account: str = "default",
     ):
         """添加模型"""
         if not (await cls.filter(user=user, bot_handle=bot_handle).limit(1).exists()):
@@ -33,6 +35,7 @@ class Bot(Model):
                 bot_type=bot_type,
                 bot_handle=bot_handle,
                 bot_id=bot_id,
+                account=account,
             )
 
     @classmethod
@@ -48,10 +51,12 @@ class Bot(Model):
         )
 
     @classmethod
-    async def get_bot_info(cls, user: str, bot_handle: str) -> tuple[str, str, int]:
+    async def get_bot_info(
+        cls, user: str, bot_handle: str
+    ) -> tuple[str, str, int, str]:
         """获取bot信息"""
         _bot = await cls.get(user=user, bot_handle=bot_handle)
-        return _bot.bot_type, _bot.bot_name, _bot.bot_id
+        return _bot.bot_type, _bot.bot_name, _bot.bot_id, _bot.account
 
     @classmethod
     async def remove_bot(cls, user: str, bot_handle: str = ""):
@@ -64,10 +69,15 @@ class Bot(Model):
             await cls.filter(user=user).delete()
 
     @classmethod
-    async def get_user_bot(cls, user: str) -> list[tuple[str, str, str, int, str]]:
+    async def remove_bots(cls, user: str, bot_handles: list[str]):
+        """删除多个模型"""
+        await cls.filter(user=user, bot_handle__in=bot_handles).delete()
+
+    @classmethod
+    async def get_user_bot(cls, user: str) -> list[tuple[str, str, str, int, str, str]]:
         """获取用户模型列表"""
         return await cls.filter(user=user).values_list(
-            "bot_name", "img_url", "bot_type", "bot_id", "bot_handle"
+            "bot_name", "img_url", "bot_type", "bot_id", "bot_handle", "account"
         )
 
     @classmethod
@@ -1,20 +1,51 @@
+from asyncio import CancelledError, Task, create_task, sleep
+from contextlib import suppress
 from time import time
 
+from pypika_tortoise.terms import Function as SqlFunction
 from tortoise import fields
+from tortoise.expressions import Q
+from tortoise.functions import Function
+from tortoise.transactions import in_transaction
+from utils.tool_util import logger
 
 from .db import Model
+from .message_db import Message
+
+# 会话最后对话时间和内容合并写入的间隔（秒）
+WRITE_INTERVAL = 1
+# 会话列表里最后对话内容只返回前面这么多字
+PREVIEW_LENGTH = 100
+
+
+class SqlSubstr(SqlFunction):
+    def __init__(self, term, start, length, alias=None):
+        super().__init__("SUBSTR", term, start, length, alias=alias)
+
+
+class Substr(Function):
+    """截取字符串，sqlite和postgres都支持SUBSTR"""
+
+    database_func = SqlSubstr
 
 
 class Chat(Model):
     code = fields.TextField(pk=True)
-    chat_id = fields.IntField()
+    chat_id = fields.BigIntField()
     user = fields.TextField()
     title = fields.TextField()
     bot_name = fields.TextField()
     bot_handle = fields.TextField()
     img_url = fields.TextField()
-    last_talk_time = fields.IntField()
+    last_talk_time = fields.BigIntField()
     last_content = fields.TextField()
+    account = fields.TextField(default="default")  # 会话所属的Poe账号
+    # 本地聊天记录从这条消息开始到最新都是连续的，0为还没同步过
+    history_start = fields.BigIntField(default=0)
+    # 本地聊天记录是否已经同步到第一条消息
+    history_complete = fields.IntField(default=0)
+    # 本地可能缺了这条消息及之后的（回答没存下来），0为本地是最新的
+    history_dirty = fields.BigIntField(default=0)
 
     @classmethod
     async def new_chat(
@@ -26,6 +57,7 @@ class Chat(Model):
         bot_name: str,
         bot_handle: str,
         img_url: str,
+        account: str,
     ):
         """新会话"""
         current_timestamp = int(time() * 1000)
@@ -39,13 +71,22 @@ class Chat(Model):
             img_url=img_url,
             last_content="",
             last_talk_time=current_timestamp,
+            account=account,
         )
 
     @classmethod
-    async def get_chat_info(cls, user: str, code: str) -> tuple[str, str, int, str]:
+    async def get_chat_info(
+        cls, user: str, code: str
+    ) -> tuple[str, str, int, str, str]:
         """获取chat信息"""
         _chat = await cls.get(user=user, code=code)
-        return _chat.bot_name, _chat.bot_handle, _chat.chat_id, _chat.title
+        return (
+            _chat.bot_name,
+            _chat.bot_handle,
+            _chat.chat_id,
+            _chat.title,
+            _chat.account,
+        )
 
     @classmethod
     async def chat_exist(cls, user: str, chat_code: str) -> bool:
@@ -55,7 +96,7 @@ class Chat(Model):
     @classmethod
     async def get_user_chat(
         cls, user: str, bot_handle: str = ""
-    ) -> list[tuple[str, str, str, str, str, int, str, int]]:
+    ) -> list[tuple[str, str, str, str, str, int, str, int, str]]:
         """获取用户的所有会话"""
         # 指定bot
         if bot_handle:
@@ -68,6 +109,7 @@ class Chat(Model):
                 "last_talk_time",
                 "last_content",
                 "chat_id",
+                "account",
             )
 
         return await cls.filter(user=user).values_list(
@@ -79,6 +121,49 @@ class Chat(Model):
             "last_talk_time",
             "last_content",
             "chat_id",
+            "account",
+        )
+
+    @classmethod
+    async def list_user_chat(
+        cls,
+        user: str,
+        bot_handle: str = "",
+        before: tuple[int, str] | None = None,
+        limit: int = 50,
+    ) -> list[tuple[str, str, str, str, str, int, str]]:
+        """
+        按最后对话时间倒序分页获取用户的会话，最后对话内容只取开头一段
+
+        参数:
+        - user
+        - bot_handle  指定bot，不传就是所有
+        - before  上一页最后一个会话的(最后对话时间, code)，不传就是第一页
+        - limit  数量
+        """
+        query = cls.filter(user=user)
+        if bot_handle:
+            query = query.filter(bot_handle=bot_handle)
+        if before:
+            last_talk_time, code = before
+            query = query.filter(
+                Q(last_talk_time__lt=last_talk_time)
+                | Q(last_talk_time=last_talk_time, code__lt=code)
+            )
+        # 在数据库里截取，不用把完整的最后对话内容读出来
+        return (
+            await query.annotate(preview=Substr("last_content", 1, PREVIEW_LENGTH))
+            .order_by("-last_talk_time", "-code")
+            .limit(limit)
+            .values_list(
+                "code",
+                "title",
+                "bot_name",
+                "bot_handle",
+                "img_url",
+                "last_talk_time",
+                "preview",
+            )
         )
 
     @classmethod
@@ -90,29 +175,155 @@ class Chat(Model):
         else:
             # 某用户的所有模型
             await cls.filter(user=user).delete()
+        await Message.delete_messages(user, code)
 
     @classmethod
-    async def update_title(cls, user: str, code: str, title: str):
-        """更新会话标题"""
-        await cls.filter(user=user, code=code).limit(1).update(title=title)
+    async def delete_chats(cls, user: str, codes: list[str]):
+        """在一个事务里删除多个会话和它们的消息"""
+        async with in_transaction() as conn:
+            await cls.filter(user=user, code__in=codes).using_db(conn).delete()
+            await (
+                Message.filter(user=user, chat_code__in=codes).using_db(conn).delete()
+            )
 
     @classmethod
-    async def update_last_talk_time(cls, user: str, code: str):
-        """更新最后使用时间"""
+    async def get_history_range(cls, user: str, code: str) -> tuple[int, int, int]:
+        """
+        获取本地聊天记录的同步范围
+        (连续的第一条消息id, 是否同步到第一条消息, 可能缺失的第一条消息id)
+        """
+        _chat = await cls.get(user=user, code=code)
+        return _chat.history_start, _chat.history_complete, _chat.history_dirty
+
+    @classmethod
+    async def update_history_range(
+        cls,
+        user: str,
+        code: str,
+        history_start: int,
+        history_complete: int,
+        synced_latest: bool = False,
+    ):
+        """更新本地聊天记录的同步范围，synced_latest为True时表示最新的消息也同步过了"""
+        values = {"history_start": history_start, "history_complete": history_complete}
+        if synced_latest:
+            values["history_dirty"] = 0
+        await cls.filter(user=user, code=code).limit(1).update(**values)
+
+    @classmethod
+    async def mark_history_dirty(cls, user: str, code: str, message_id: int):
+        """回答没存到本地，标记从这条消息开始可能缺失，下次打开会话时从Poe同步"""
         await (
             cls.filter(user=user, code=code)
+            .filter(Q(history_dirty=0) | Q(history_dirty__gt=message_id))
             .limit(1)
-            .update(last_talk_time=int(time() * 1000))
+            .update(history_dirty=message_id)
         )
 
     @classmethod
-    async def update_last_content(cls, user: str, code: str, last_content: str):
-        """更新最后对话内容"""
-        await (
-            cls.filter(user=user, code=code).limit(1).update(last_content=last_content)
-        )
+    async def update_title(cls, user: str, code: str, title: str):
+        """更新会话标题"""
+        await cls.filter(user=user, code=code).limit(1).update(title=title)
+
+    @classmethod
+    def update_last_talk_time(cls, user: str, code: str):
+        """更新最后使用时间，稍后合并写入"""
+        chat_write_buffer.update(user, code, last_talk_time=int(time() * 1000))
+
+    @classmethod
+    def update_last_content(cls, user: str, code: str, last_content: str):
+        """更新最后对话内容，稍后合并写入"""
+        chat_write_buffer.update(user, code, last_content=last_content)
 
     @classmethod
     async def disable_chat(cls, user: str, code: str):
         """禁用会话"""
         await cls.filter(user=user, code=code).limit(1).update(disable=1)
+
+
+class Chat_Write_Buffer:
+    """
+    会话字段的合并写入
+
+    - 每次对话都要更新最后对话时间和内容，先放在内存里，同一会话同一字段只保留最新的值
+    - 隔interval秒在一个事务里写入，一秒内的多次更新只落盘一次
+    - 写入失败的放回去，隔interval秒再试，退出时要调用close写完剩下的
+    """
+
+    def __init__(self, interval: float = WRITE_INTERVAL):
+        self.interval = interval
+        # (用户, 会话code) -> 要更新的字段
+        self.pending: dict[tuple[str, str], dict] = {}
+        self.flush_task: Task | None = None
+        self.closed = False
+        # 正在写入时关闭要等写完，还在等间隔的直接取消
+        self.flushing = False
+        self.flushed_times = 0
+        self.written_rows = 0
+        self.coalesced_times = 0
+
+    def update(self, user: str, code: str, **values):
+        if (key := (user, code)) in self.pending:
+            self.pending[key].update(values)
+            self.coalesced_times += 1
+        else:
+            self.pending[key] = values
+
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = create_task(self._delay_flush())
+
+    async def _delay_flush(self):
+        await sleep(self.interval)
+        await self.flush()
+
+    async def flush(self):
+        """把暂存的更新一次写入"""
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, {}
+        self.flushing = True
+        try:
+            async with in_transaction() as conn:
+                for (user, code), values in pending.items():
+                    await (
+                        Chat.filter(user=user, code=code)
+                        .using_db(conn)
+                        .limit(1)
+                        .update(**values)
+                    )
+        except Exception as e:
+            logger.error(f"写入会话更新出错 {repr(e)}")
+            # 放回去，期间新来的值优先
+            for key, values in pending.items():
+                self.pending[key] = values | self.pending.get(key, {})
+            # 之后没有新的更新也要再试
+            if not self.closed:
+                self.flush_task = create_task(self._delay_flush())
+            return
+        finally:
+            self.flushing = False
+
+        self.flushed_times += 1
+        self.written_rows += len(pending)
+
+    async def close(self):
+        """不用等间隔，正在进行的写入完成后马上写入剩下的"""
+        self.closed = True
+        if self.flush_task and not self.flush_task.done():
+            if not self.flushing:
+                self.flush_task.cancel()
+            with suppress(CancelledError):
+                await self.flush_task
+        await self.flush()
+
+    def get_stats(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "flushedTimes": self.flushed_times,
+            "writtenRows": self.written_rows,
+            "coalescedTimes": self.coalesced_times,
+        }
+
+
+chat_write_buffer = Chat_Write_Buffer()
@@ -0,0 +1,67 @@
+from dataclasses import dataclass
+from time import time
+
+from tortoise.connection import connections
+
+from .db import raw_sql
+
+# 用户、bot、会话一次查出来
+TALK_CONTEXT_SQL = """
+SELECT u.remain_points, u.expire_date,
+    b.bot_type, b.bot_name, b.bot_id, b.account,
+    c.bot_name, c.bot_handle, c.chat_id, c.title, c.account
+FROM "user" AS u
+LEFT JOIN bot AS b ON b."user" = u."user" AND b.bot_handle = ?
+LEFT JOIN chat AS c ON c."user" = u."user" AND c.code = ?
+WHERE u."user" = ?
+LIMIT 1
+"""
+
+
+@dataclass(slots=True)
+class Talk_Context:
+    """
+    对话需要的用户、bot和会话数据，一次请求只查一次库
+
+    bot或会话不存在时对应字段为None
+    """
+
+    user: str
+    remain_points: int
+    expire_date: int
+    # 用户添加的bot
+    bot_type: str | None
+    bot_name: str | None
+    bot_id: int | None
+    bot_account: str | None
+    # 会话，新会话都是None
+    chat_bot_name: str | None
+    chat_bot_handle: str | None
+    chat_id: int | None
+    chat_title: str | None
+    chat_account: str | None
+
+    @classmethod
+    async def load(
+        cls, user: str, bot_handle: str, chat_code: str = "0"
+    ) -> "Talk_Context | None":
+        """加载对话数据，用户不存在返回None"""
+        _, rows = await connections.get("default").execute_query(
+            raw_sql(TALK_CONTEXT_SQL), [bot_handle, chat_code, user]
+        )
+        if not rows:
+            return None
+        return cls(user, *tuple(rows[0]))
+
+    @property
+    def bot_exist(self) -> bool:
+        return self.bot_type is not None
+
+    @property
+    def chat_exist(self) -> bool:
+        return self.chat_id is not None
+
+    @property
+    def is_outdate(self) -> bool:
+        """判断是否过期"""
+        return self.expire_date < int(time() * 1000)
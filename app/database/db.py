@@ -1,9 +1,48 @@
+from functools import cache
+
 from tortoise import Tortoise
+from tortoise.backends.base.config_generator import expand_db_url
 from tortoise.connection import connections
 from tortoise.models import Model as Model_
+from utils.env_util import gv
 
 MODELS: list[str] = []
 
+# 旧数据库缺少的字段，启动时自动补上：(表名, 字段名, 字段定义)
+COLUMN_MIGRATIONS: list[tuple[str, str, str]] = [
+    ("chat", "account", "TEXT NOT NULL DEFAULT 'default'"),
+    ("bot", "account", "TEXT NOT NULL DEFAULT 'default'"),
+    ("chat", "history_start", "BIGINT NOT NULL DEFAULT 0"),
+    ("chat", "history_complete", "INT NOT NULL DEFAULT 0"),
+    ("chat", "history_dirty", "BIGINT NOT NULL DEFAULT 0"),
+]
+
+# 常用查询的索引，新旧数据库启动时都会补上：(索引名, 表名, 字段)
+INDEX_MIGRATIONS: list[tuple[str, str, str]] = [
+    ("idx_bot_user_handle", "bot", '"user", bot_handle'),
+    ("idx_chat_user_talk_time", "chat", '"user", last_talk_time'),
+    ("idx_chat_user_handle", "chat", '"user", bot_handle'),
+    ("idx_points_ledger_state", "points_ledger", "state, create_time"),
+]
+
+# sqlite连接参数，连接时逐个执行PRAGMA
+SQLITE_PROFILES: dict[str, dict[str, str | int]] = {
+    # 回滚日志，每次提交都同步落盘，最安全也最慢
+    "safe": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+    },
+    # WAL模式读写不互相阻塞，NORMAL只在checkpoint时同步，断电最多丢最近的提交
+    "performance": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "temp_store": "MEMORY",
+        "cache_size": -gv.SQLITE_CACHE_MB * 1024,
+        "mmap_size": gv.SQLITE_MMAP_MB * 1024 * 1024,
+    },
+}
+
 
 class Model(Model_):
     """
@@ -16,13 +55,74 @@ class Model(Model_):
         MODELS.append(cls.__module__)
 
 
+def get_db_config() -> dict:
+    """
+    数据库配置，sqlite带上DB_PROFILE的参数，postgres带上连接池参数
+    """
+    connection = expand_db_url(gv.DB_URL)
+    credentials = connection["credentials"]
+    if connection["engine"] == "tortoise.backends.sqlite":
+        try:
+            credentials.update(SQLITE_PROFILES[gv.DB_PROFILE])
+        except KeyError:
+            raise Exception(f"DB_PROFILE只能是{'、'.join(SQLITE_PROFILES)}")
+    else:
+        credentials.update(
+            minsize=gv.DB_POOL_MIN,
+            maxsize=gv.DB_POOL_MAX,
+            statement_cache_size=gv.DB_STATEMENT_CACHE,
+        )
+    return {
+        "connections": {"default": connection},
+        "apps": {"models": {"models": MODELS, "default_connection": "default"}},
+    }
+
+
+def is_postgres() -> bool:
+    return connections.get("default").capabilities.dialect == "postgres"
+
+
+@cache
+def raw_sql(query: str) -> str:
+    """
+    原生sql统一用?做占位符，postgres换成$1 $2 ...
+    """
+    if not is_postgres():
+        return query
+    parts = query.split("?")
+    return parts[0] + "".join(
+        f"${index}{part}" for index, part in enumerate(parts[1:], 1)
+    )
+
+
 async def db_init():
     try:
-        await Tortoise.init(db_url="sqlite://data.db", modules={"models": MODELS})
+        await Tortoise.init(config=get_db_config())
         await Tortoise.generate_schemas()
+        await db_migrate()
     except Exception as e:
         raise Exception(f"database error: {repr(e)}")
 
 
+async def db_migrate():
+    """给旧数据库补上新增的字段和索引"""
+    conn = connections.get("default")
+    for table, column, definition in COLUMN_MIGRATIONS:
+        if is_postgres():
+            await conn.execute_script(
+                f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS {column} {definition}'
+            )
+            continue
+        rows = await conn.execute_query_dict(f"PRAGMA table_info({table})")
+        if column not in [row["name"] for row in rows]:
+            await conn.execute_script(
+                f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+            )
+    for name, table, columns in INDEX_MIGRATIONS:
+        await conn.execute_script(
+            f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"
+        )
+
+
 async def db_close():
     await connections.close_all()
@@ -0,0 +1,101 @@
+from tortoise import fields
+
+from .db import Model
+
+
+class Message(Model):
+    """本地保存的聊天记录，和Poe上的记录同步"""
+
+    user = fields.TextField()  # 所属用户
+    chat_code = fields.TextField()  # 所属会话，(chat_code, message_id)的唯一索引也用来按会话查
+    message_id = fields.BigIntField()  # 消息id
+    creation_time = fields.BigIntField()  # 创建时间
+    text = fields.TextField()  # 消息内容
+    attachments = fields.JSONField(default=list)  # 附件列表
+    author = fields.TextField()  # 作者 human bot chat_break
+
+    class Meta:
+        table = "message"
+        unique_together = (("chat_code", "message_id"),)
+
+    @classmethod
+    async def save_messages(cls, user: str, chat_code: str, nodes: list[dict]):
+        """保存消息节点，已存在的更新内容"""
+        for node in nodes:
+            await cls.update_or_create(
+                chat_code=chat_code,
+                message_id=node["messageId"],
+                defaults={
+                    "user": user,
+                    "creation_time": node["creationTime"],
+                    "text": node["text"],
+                    "attachments": node["attachments"],
+                    "author": node["author"],
+                },
+            )
+
+    @classmethod
+    async def message_exist(cls, chat_code: str, message_id: int) -> bool:
+        """消息是否已保存"""
+        return (
+            await cls.filter(chat_code=chat_code, message_id=message_id)
+            .limit(1)
+            .exists()
+        )
+
+    @classmethod
+    async def get_last_message_id(cls, chat_code: str) -> int:
+        """最新一条消息的id，没有返回0"""
+        _ids = (
+            await cls.filter(chat_code=chat_code)
+            .order_by("-message_id")
+            .limit(1)
+            .values_list("message_id", flat=True)
+        )
+        return _ids[0] if _ids else 0
+
+    @classmethod
+    async def get_history(
+        cls, chat_code: str, before_id: int, count: int
+    ) -> list[dict]:
+        """获取比before_id旧的count条消息，按时间顺序排列"""
+        _rows = (
+            await cls.filter(chat_code=chat_code, message_id__lt=before_id)
+            .order_by("-message_id")
+            .limit(count)
+            .values_list(
+                "message_id", "creation_time", "text", "attachments", "author"
+            )
+        )
+        return [
+            {
+                "messageId": row[0],
+                "creationTime": row[1],
+                "text": row[2],
+                "attachments": row[3],
+                "author": row[4],
+            }
+            for row in reversed(_rows)
+        ]
+
+    @classmethod
+    async def count_between(cls, chat_code: str, start_id: int, before_id: int) -> int:
+        """id在[start_id, before_id)之间的消息数量"""
+        return await cls.filter(
+            chat_code=chat_code, message_id__gte=start_id, message_id__lt=before_id
+        ).count()
+
+    @classmethod
+    async def delete_bot_messages(cls, chat_code: str, from_id: int):
+        """删除from_id及之后的bot消息，重新回答时用"""
+        await cls.filter(
+            chat_code=chat_code, message_id__gte=from_id, author="bot"
+        ).delete()
+
+    @classmethod
+    async def delete_messages(cls, user: str, chat_code: str = ""):
+        """删除会话的消息，不指定会话就删除用户的所有消息"""
+        if chat_code:
+            await cls.filter(user=user, chat_code=chat_code).delete()
+        else:
+            await cls.filter(user=user).delete()
@@ -0,0 +1,214 @@
+from datetime import datetime
+from time import time
+
+from tortoise import fields
+from tortoise.connection import connections
+from tortoise.expressions import F
+from tortoise.transactions import in_transaction
+from utils.tool_util import logger
+
+from .db import Model, raw_sql
+from .user_db import User
+
+# 预扣超过这么多秒还没结算的，当作进程退出时丢下的，启动时退回
+STALE_RESERVATION_TTL = 3600
+
+# 累加当天的使用量，没有记录就新建
+ADD_USAGE_SQL = """
+INSERT INTO points_usage ("user", bot_handle, date, points, times)
+VALUES (?, ?, ?, ?, 1)
+ON CONFLICT ("user", bot_handle, date)
+DO UPDATE SET points = points_usage.points + excluded.points,
+    times = points_usage.times + 1
+"""
+
+
+class Points_Usage(Model):
+    """积分使用统计，按用户、bot、日期汇总"""
+
+    user = fields.TextField()  # 用户名
+    bot_handle = fields.TextField()  # Bot handle
+    date = fields.TextField()  # 日期 YYYY-MM-DD
+    points = fields.IntField(default=0)  # 花费的积分
+    times = fields.IntField(default=0)  # 对话次数
+
+    class Meta:
+        table = "points_usage"
+        unique_together = (("user", "bot_handle", "date"),)
+
+    @classmethod
+    async def add_usage(cls, user: str, bot_handle: str, points: int):
+        """记录一次花费"""
+        await connections.get("default").execute_query(
+            raw_sql(ADD_USAGE_SQL),
+            [user, bot_handle, datetime.now().strftime("%Y-%m-%d"), points],
+        )
+
+    @classmethod
+    async def list_usage(
+        cls, user: str = "", start_date: str = "", end_date: str = ""
+    ) -> list[tuple[str, str, str, int, int]]:
+        """查询使用统计，日期格式 YYYY-MM-DD，不传就是不限"""
+        query = cls.all()
+        if user:
+            query = query.filter(user=user)
+        if start_date:
+            query = query.filter(date__gte=start_date)
+        if end_date:
+            query = query.filter(date__lte=end_date)
+        return await query.order_by("-date", "user", "bot_handle").values_list(
+            "user", "bot_handle", "date", "points", "times"
+        )
+
+
+class Points_Ledger(Model):
+    """
+    积分预扣流水，一次回答一条
+
+    预扣时新建，结算或退回时改状态，和积分的增减在同一个事务里，
+    进程退出时还在预扣中的，下次启动时退回
+
+    状态: open 预扣中  settled 已结算  released 已退回
+    """
+
+    user = fields.TextField()  # 用户名
+    bot_handle = fields.TextField()  # Bot handle
+    points = fields.IntField(default=0)  # 预扣的积分
+    price = fields.IntField(default=0)  # 结算的积分
+    state = fields.TextField(default="open")  # 状态 open/settled/released
+    create_time = fields.BigIntField()  # 预扣时间
+    update_time = fields.BigIntField()  # 结算或退回的时间
+
+    class Meta:
+        table = "points_ledger"
+
+    @classmethod
+    async def add(
+        cls, user: str, bot_handle: str, points: int, price: int, state: str
+    ) -> int:
+        """新建一条流水，返回id"""
+        current_timestamp = int(time() * 1000)
+        ledger = await cls.create(
+            user=user,
+            bot_handle=bot_handle,
+            points=points,
+            price=price,
+            state=state,
+            create_time=current_timestamp,
+            update_time=current_timestamp,
+        )
+        return ledger.id
+
+    @classmethod
+    async def finish(cls, ledger_id: int, state: str, price: int = 0) -> bool:
+        """预扣中的改成已结算或已退回，返回是否改了，没改就是已经被退回了"""
+        return bool(
+            await cls.filter(id=ledger_id, state="open").update(
+                state=state, price=price, update_time=int(time() * 1000)
+            )
+        )
+
+    @classmethod
+    async def add_price(cls, ledger_id: int, price: int):
+        """已结算的又收到花费，累加上"""
+        await cls.filter(id=ledger_id).update(
+            price=F("price") + price, update_time=int(time() * 1000)
+        )
+
+    @classmethod
+    async def release_stale(cls, ttl: int = STALE_RESERVATION_TTL) -> int:
+        """退回预扣太久还没结算的积分，返回退回的数量"""
+        rows = await cls.filter(
+            state="open", create_time__lt=int((time() - ttl) * 1000)
+        ).values_list("id", "user", "points")
+        released = 0
+        for ledger_id, user, points in rows:
+            async with in_transaction():
+                if not await cls.finish(ledger_id, "released"):
+                    continue
+                if points:
+                    await User.add_remain_points(user, points)
+            released += 1
+            logger.info(f"退回用户{user}没结算的预扣积分 {points}")
+        return released
+
+
+class Points_Reservation:
+    """
+    一次回答预扣的积分
+
+    发送问题时按bot价格预扣，收到花费时按实际花费多退少补，
+    回答完成了却没收到花费就按bot价格结算，回答没完成就全部退回，
+    每次都记到Points_Ledger
+    """
+
+    __slots__ = ("user", "bot_handle", "points", "price", "settled", "ledger_id")
+
+    def __init__(
+        self,
+        user: str,
+        bot_handle: str,
+        points: int = 0,
+        price: int | None = None,
+        ledger_id: int | None = None,
+    ):
+        self.user = user
+        self.bot_handle = bot_handle
+        self.points = points
+        # 没收到花费时结算的积分，默认为预扣的积分
+        self.price = points if price is None else price
+        self.settled = False
+        # 没预扣的（重新回答）结算时才记流水
+        self.ledger_id = ledger_id
+
+    @classmethod
+    async def take(
+        cls, user: str, bot_handle: str, points: int
+    ) -> "Points_Reservation | None":
+        """预扣积分，积分不够返回None"""
+        async with in_transaction():
+            if points and not await User.reserve_points(user, points):
+                return None
+            ledger_id = await Points_Ledger.add(user, bot_handle, points, 0, "open")
+        return cls(user, bot_handle, points, ledger_id=ledger_id)
+
+    async def settle(self, price: int):
+        """按实际花费结算"""
+        # 已结算过的（比如多次花费）预扣为0，直接扣
+        reserved = self.points
+        settled = self.settled
+        self.settled = True
+        self.points = 0
+        async with in_transaction():
+            if settled:
+                await Points_Ledger.add_price(self.ledger_id, price)
+            elif self.ledger_id is None or not await Points_Ledger.finish(
+                self.ledger_id, "settled", price
+            ):
+                # 没预扣，或者结算得太晚，预扣的已经在启动时退回了
+                reserved = 0
+                self.ledger_id = await Points_Ledger.add(
+                    self.user, self.bot_handle, 0, price, "settled"
+                )
+            if reserved != price:
+                await User.add_remain_points(self.user, reserved - price)
+            await Points_Usage.add_usage(self.user, self.bot_handle, price)
+
+    async def settle_default(self):
+        """回答完成但没收到花费，按bot价格结算"""
+        if not self.settled:
+            await self.settle(self.price)
+
+    async def release(self):
+        """退回预扣的积分"""
+        if self.settled:
+            return
+        self.settled = True
+        points = self.points
+        self.points = 0
+        if self.ledger_id is None:
+            return
+        async with in_transaction():
+            # 已经在启动时退回过的不再退
+            if await Points_Ledger.finish(self.ledger_id, "released") and points:
+                await User.add_remain_points(self.user, points)
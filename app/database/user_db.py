@@ -1,11 +1,20 @@
 from datetime import datetime
 from time import time
+from typing import Callable
 
 from dateutil.relativedelta import relativedelta
 from tortoise import fields
+from tortoise.expressions import F
+from utils.cache_util import TTL_LRU_Cache
+from utils.env_util import gv
 
 from .db import Model
 
+# 验证过的凭证缓存，(用户名, 密码) -> (是否为管理员,)
+auth_cache = TTL_LRU_Cache(1024, gv.AUTH_CACHE_TTL)
+# 凭证缓存失效时调用，参数为用户名，多进程部署时用来通知其他进程
+auth_hooks: list[Callable[[str], None]] = []
+
 
 class User(Model):
     user = fields.TextField(pk=True)  # 用户名
@@ -13,8 +22,8 @@ class User(Model):
     remain_points = fields.IntField()  # 可用积分
     month_points = fields.IntField()  # 总积分
     admin = fields.IntField()  # 是否为管理员
-    reset_date = fields.IntField()  # 下一次重置积分日期
-    expire_date = fields.IntField()  # 授权到期日期
+    reset_date = fields.BigIntField()  # 下一次重置积分日期
+    expire_date = fields.BigIntField()  # 授权到期日期
 
     class Meta:
         table = "user"
@@ -60,11 +69,19 @@ class User(Model):
     async def delete_user(cls, user: str):
         """删除用户"""
         await (await cls.get(user=user)).delete()
+        cls.clear_auth_cache(user)
+
+    @classmethod
+    async def disable_user(cls, user: str):
+        """禁止用户登陆，凭证里带着密码，清空密码后已签发的凭证也失效，管理员重置密码可恢复"""
+        await cls.filter(user=user).limit(1).update(passwd="")
+        cls.clear_auth_cache(user)
 
     @classmethod
     async def update_passwd(cls, user: str, new_passwd: str):
         """修改用户密码"""
         await cls.filter(user=user).limit(1).update(passwd=new_passwd)
+        cls.clear_auth_cache(user)
 
     @classmethod
     async def update_reset_date(cls, user: str, last_reset_date: int):
@@ -131,6 +148,7 @@ class User(Model):
                 expire_date=expire_date,
             )
         )
+        cls.clear_auth_cache(user)
 
     @classmethod
     async def get_info(cls, user: str):
@@ -147,6 +165,36 @@ class User(Model):
         """验证账密"""
         return await cls.filter(user=user, passwd=passwd).limit(1).exists()
 
+    @classmethod
+    async def get_auth(cls, user: str, passwd: str) -> tuple[int] | None:
+        """
+        验证账密，成功返回(是否为管理员,)，失败返回None，成功的结果会缓存
+
+        授权到期由对话等接口自己查，不放在缓存里，免得用到过期的值
+        """
+        if auth := auth_cache.get((user, passwd)):
+            return auth
+
+        _auth = (
+            await cls.filter(user=user, passwd=passwd)
+            .limit(1)
+            .values_list("admin")
+        )
+        if not _auth:
+            return None
+
+        auth = _auth[0]
+        auth_cache.set((user, passwd), auth)
+        return auth
+
+    @staticmethod
+    def clear_auth_cache(user: str, notify: bool = True):
+        """用户信息变更时清掉该用户的凭证缓存，notify为False时不通知其他进程"""
+        auth_cache.discard_if(lambda key: key[0] == user)
+        if notify:
+            for hook in auth_hooks:
+                hook(user)
+
     @classmethod
     async def list_user(cls):
         """列出所有用户"""
@@ -180,3 +228,21 @@ class User(Model):
     async def update_remain_points(cls, user: str, remain_points: int):
         """更新可用积分"""
         await cls.filter(user=user).limit(1).update(remain_points=remain_points)
+
+    @classmethod
+    async def reserve_points(cls, user: str, points: int) -> bool:
+        """原子地扣除积分，积分不够不扣，返回是否扣除成功"""
+        return bool(
+            await cls.filter(user=user, remain_points__gte=points)
+            .limit(1)
+            .update(remain_points=F("remain_points") - points)
+        )
+
+    @classmethod
+    async def add_remain_points(cls, user: str, points: int):
+        """原子地增加积分，负数就是扣除"""
+        await (
+            cls.filter(user=user)
+            .limit(1)
+            .update(remain_points=F("remain_points") + points)
+        )
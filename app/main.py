@@ -1,8 +1,10 @@
 from contextlib import asynccontextmanager
 
 import models.error_resp_models as resp_models
+from database.chat_db import chat_write_buffer
 from database.config_db import Config
 from database.db import db_close, db_init
+from database.points_db import STALE_RESERVATION_TTL, Points_Ledger
 from database.user_db import User
 from fastapi import (
     FastAPI,
@@ -13,8 +15,10 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from routers.admin_routers import router as admin_router
 from routers.user_routers import router as user_router
+from services.debug_capture import debug_capture
+from services.event_broker import broker
 from services.jwt_auth import AuthFailed
-from services.poe_client import login_poe, scheduler
+from services.poe_client import close_poe, login_pool, scheduler
 from utils.env_util import gv
 from utils.tool_util import Custom404Middleware, fastapi_logger_config, logger
 from uvicorn import run
@@ -27,12 +31,21 @@ from uvicorn import run
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await db_init()
+    # 上次退出时进行中的回答没结算，预扣的积分退回
+    # 多进程时别的进程可能正在回答，只退回太久的
+    await Points_Ledger.release_stale(0 if gv.WORKERS == 1 else STALE_RESERVATION_TTL)
     await User.init_data()
     await Config.init_data()
-    await login_poe()
+    if gv.WORKERS > 1:
+        await broker.start()
+    await login_pool()
     scheduler.start()
     logger.info("启动完成")
     yield
+    await close_poe()
+    await broker.close()
+    await debug_capture.close()
+    await chat_write_buffer.close()
     await db_close()
     logger.info("程序退出")
 
@@ -98,9 +111,16 @@ app.include_router(admin_router, prefix=f"{gv.API_PATH}/admin", tags=["管理员
 ### 启动进程
 ################
 if __name__ == "__main__":
+    # SECRET_KEY默认是随机生成的，各进程不一样，别的进程签发的token会验证不过
+    if gv.WORKERS > 1 and "SECRET_KEY" not in gv.model_fields_set:
+        logger.error("多进程部署必须在config.txt里填写SECRET_KEY")
+        exit(1)
+
     try:
         run(
-            app,
+            # 多进程要用导入字符串
+            "main:app" if gv.WORKERS > 1 else app,
+            workers=gv.WORKERS,
             host=gv.HOST,
             port=gv.PORT,
             ssl_keyfile=gv.SSL_KEYFILE_PATH,
@@ -0,0 +1,82 @@
+"""
+把sqlite数据库的数据复制到DB_URL配置的数据库（一般是postgres），只需执行一次
+
+用法: python migrate_db.py [sqlite文件，默认data.db]
+
+目标数据库里已有的表会跳过，避免重复复制
+"""
+
+from asyncio import run
+from sqlite3 import OperationalError, Row, connect
+from sys import argv
+
+from database import (  # noqa: F401 导入后才会注册模型
+    account_db,
+    bot_db,
+    chat_db,
+    config_db,
+    message_db,
+    points_db,
+    user_db,
+)
+from database.db import db_close, db_init, is_postgres
+from tortoise import Tortoise
+from utils.env_util import gv
+from utils.tool_util import logger
+
+BATCH_SIZE = 500
+
+
+async def migrate(source: str):
+    if gv.DB_URL.startswith("sqlite"):
+        raise Exception("DB_URL还是sqlite，先改成目标数据库地址")
+
+    await db_init()
+    src = connect(source)
+    src.row_factory = Row
+    try:
+        for model in Tortoise.apps["models"].values():
+            table = model._meta.db_table
+            if await model.exists():
+                logger.info(f"{table}表已有数据，跳过")
+                continue
+            try:
+                rows = src.execute(f'SELECT * FROM "{table}"').fetchall()
+            except OperationalError:
+                # 旧版本的数据库没有这个表
+                continue
+
+            fields = model._meta.fields_db_projection
+            count = 0
+            for start in range(0, len(rows), BATCH_SIZE):
+                objs = []
+                for row in rows[start : start + BATCH_SIZE]:
+                    keys = row.keys()
+                    objs.append(
+                        model(
+                            **{
+                                name: row[column]
+                                for name, column in fields.items()
+                                if column in keys
+                            }
+                        )
+                    )
+                await model.bulk_create(objs)
+                count += len(objs)
+
+            # 复制了自增主键，序列要跟上
+            pk = model._meta.pk
+            if pk.generated and count and is_postgres():
+                column = model._meta.pk_db_column
+                await model._meta.db.execute_script(
+                    f"SELECT setval(pg_get_serial_sequence('\"{table}\"', '{column}'), "
+                    f'(SELECT MAX({column}) FROM "{table}"))'
+                )
+            logger.info(f"{table}表复制了{count}条数据")
+    finally:
+        src.close()
+        await db_close()
+
+
+if __name__ == "__main__":
+    run(migrate(argv[1] if len(argv) > 1 else "data.db"))
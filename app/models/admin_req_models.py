@@ -16,6 +16,21 @@ class UpdateSettingReqBody(BaseModel):
     )
 
 
+class AddAccountReqBody(BaseModel):
+    name: str = Field(
+        title="账号名称",
+    )
+    p_b: str = Field(
+        title="p-b值",
+    )
+    p_lat: str = Field(
+        title="p-lat值",
+    )
+    formkey: str = Field(
+        title="formkey值",
+    )
+
+
 class AddUserReqBody(BaseModel):
     user: str = Field(
         title="用户名",
@@ -62,3 +77,20 @@ class HashUploadReqBody(BaseModel):
     subHash: dict = Field(
         title="sub_hash hash",
     )
+
+
+class DebugCaptureReqBody(BaseModel):
+    enabled: bool = Field(
+        title="是否开启",
+    )
+    sampleRate: float = Field(
+        default=1.0,
+        title="采样率，0到1",
+        ge=0,
+        le=1,
+    )
+    maxFiles: int = Field(
+        default=200,
+        title="最多保留的文件数量",
+        ge=1,
+    )
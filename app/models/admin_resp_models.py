@@ -108,3 +108,374 @@ class AccountRespBody(BaseModel):
         title="积分重置时间",
         examples=[1693230928703],
     )
+
+
+class PoolAccountRespBody(BaseModel):
+    name: str = Field(
+        title="账号名称，默认账号为default",
+        examples=["default", "account2"],
+    )
+    loginSuccess: bool = Field(
+        title="是否登陆成功",
+    )
+    remainPoints: int = Field(
+        title="账号积分余额",
+        examples=[9999],
+    )
+    load: int = Field(
+        title="正在发送和排队的问题数量",
+        examples=[2],
+    )
+
+
+class UsageRespBody(BaseModel):
+    user: str = Field(
+        title="用户名",
+        examples=["nikiss"],
+    )
+    botHandle: str = Field(
+        title="Bot handle",
+        examples=["Claude-3-Sonnet"],
+    )
+    date: str = Field(
+        title="日期",
+        examples=["2024-01-01"],
+    )
+    points: int = Field(
+        title="花费的积分",
+        examples=[1200],
+    )
+    times: int = Field(
+        title="对话次数",
+        examples=[6],
+    )
+
+
+class HttpPoolMetrics(BaseModel):
+    openConnections: int = Field(
+        title="当前打开的连接数",
+        examples=[3],
+    )
+    idleConnections: int = Field(
+        title="空闲的连接数",
+        examples=[2],
+    )
+    createdConnections: int = Field(
+        title="累计新建连接数",
+        examples=[5],
+    )
+    reusedConnections: int = Field(
+        title="累计复用连接数",
+        examples=[1024],
+    )
+    reuseRatio: float = Field(
+        title="连接复用率",
+        examples=[0.9951],
+    )
+
+
+class SendSchedulerMetrics(BaseModel):
+    maxConcurrency: int = Field(
+        title="最大并发发送数",
+        examples=[4],
+    )
+    running: int = Field(
+        title="正在发送的数量",
+        examples=[2],
+    )
+    queueDepth: int = Field(
+        title="排队中的数量",
+        examples=[5],
+    )
+    waitingUsers: int = Field(
+        title="排队中的用户数",
+        examples=[3],
+    )
+    dispatchedTimes: int = Field(
+        title="累计放行次数",
+        examples=[1024],
+    )
+    avgWaitTime: float = Field(
+        title="平均排队时间（毫秒）",
+        examples=[12.5],
+    )
+    maxWaitTime: float = Field(
+        title="最长排队时间（毫秒）",
+        examples=[3000.0],
+    )
+    oldestWaitTime: float = Field(
+        title="当前排最久的请求已等待时间（毫秒）",
+        examples=[150.0],
+    )
+
+
+class AnswerQueueMetrics(BaseModel):
+    queues: int = Field(
+        title="回答队列数量",
+        examples=[3],
+    )
+    listeningQueues: int = Field(
+        title="正在被拉取回答的队列数量",
+        examples=[2],
+    )
+    listeners: int = Field(
+        title="正在拉取回答的监听者数量，同一会话可以有多个",
+        examples=[3],
+    )
+    bufferedItems: int = Field(
+        title="队列中缓存的数据条数",
+        examples=[5],
+    )
+    bufferedTextSize: int = Field(
+        title="队列中缓存的回答文本长度",
+        examples=[4096],
+    )
+    maxIdleTime: float = Field(
+        title="队列最长空闲时间（秒）",
+        examples=[12.5],
+    )
+    coalescedTimes: int = Field(
+        title="累计合并的未完成回答数量",
+        examples=[1024],
+    )
+    droppedTimes: int = Field(
+        title="累计因队列满丢弃的数据数量",
+        examples=[0],
+    )
+    evictedTimes: int = Field(
+        title="累计超时清理的队列数量",
+        examples=[3],
+    )
+
+
+class CacheMetrics(BaseModel):
+    size: int = Field(
+        title="缓存条数",
+        examples=[12],
+    )
+    maxSize: int = Field(
+        title="最大缓存条数",
+        examples=[1024],
+    )
+    hits: int = Field(
+        title="命中次数",
+        examples=[980],
+    )
+    misses: int = Field(
+        title="未命中次数",
+        examples=[20],
+    )
+    hitRatio: float = Field(
+        title="命中率",
+        examples=[0.98],
+    )
+
+
+class SWRCacheMetrics(CacheMetrics):
+    staleHits: int = Field(
+        title="返回旧数据并后台刷新的次数",
+        examples=[35],
+    )
+    coalescedTimes: int = Field(
+        title="合并的并发加载次数",
+        examples=[12],
+    )
+
+
+class WsChannelMetrics(BaseModel):
+    state: str = Field(
+        title="状态 connecting 连接中  live 已连上  degraded 重连中  down 连续失败",
+        examples=["live"],
+    )
+    liveChannels: int = Field(
+        title="已连上的channel数量，轮换时为2",
+        examples=[1],
+    )
+    reconnectTimes: int = Field(
+        title="累计重连次数",
+        examples=[3],
+    )
+    frameTimes: int = Field(
+        title="累计收到的帧数",
+        examples=[10240],
+    )
+    framesPerSec: float = Field(
+        title="距上次获取指标的每秒帧数",
+        examples=[12.5],
+    )
+    avgParseMs: float = Field(
+        title="每帧平均处理时间（毫秒）",
+        examples=[0.35],
+    )
+    maxParseMs: float = Field(
+        title="每帧最长处理时间（毫秒）",
+        examples=[4.2],
+    )
+    subscribedSeq: int = Field(
+        title="获取channel时的min_seq",
+        examples=[1000],
+    )
+    lastSeq: int = Field(
+        title="最近一帧的min_seq",
+        examples=[1350],
+    )
+    seqLag: int = Field(
+        title="最近一帧比获取channel时前进了多少seq",
+        examples=[350],
+    )
+    lastFrameAge: float = Field(
+        title="距最近一帧的秒数，-1为还没收到过",
+        examples=[2.5],
+    )
+
+
+class AccountMetrics(BaseModel):
+    httpPool: HttpPoolMetrics = Field(
+        title="Poe请求的http连接池",
+    )
+    sendScheduler: SendSchedulerMetrics = Field(
+        title="发送问题的调度器",
+    )
+    answerQueues: AnswerQueueMetrics = Field(
+        title="回答队列",
+    )
+    priceCache: CacheMetrics = Field(
+        title="bot所需积分缓存",
+    )
+    wsChannel: WsChannelMetrics = Field(
+        title="ws channel",
+    )
+
+
+class UserDeletionRespBody(BaseModel):
+    user: str = Field(
+        title="用户名",
+        examples=["user_name"],
+    )
+    state: str = Field(
+        title="状态 running 删除中  done 已删除  failed 有删除失败的",
+        examples=["running"],
+    )
+    totalChats: int = Field(
+        title="会话数量",
+        examples=[1200],
+    )
+    deletedChats: int = Field(
+        title="已删除的会话数量",
+        examples=[350],
+    )
+    totalBots: int = Field(
+        title="bot数量",
+        examples=[12],
+    )
+    deletedBots: int = Field(
+        title="已删除的bot数量",
+        examples=[0],
+    )
+    errors: list[str] = Field(
+        title="最近的错误信息",
+        examples=[[]],
+    )
+    startTime: int = Field(
+        title="开始时间",
+        examples=[1719676800000],
+    )
+    finishTime: int = Field(
+        title="结束时间，还没结束是0",
+        examples=[0],
+    )
+
+
+class BrokerMetrics(BaseModel):
+    enabled: bool = Field(
+        title="是否多进程部署",
+        examples=[True],
+    )
+    isOwner: bool = Field(
+        title="当前进程是否连接ws的channel owner",
+        examples=[False],
+    )
+    pid: int = Field(
+        title="当前进程id",
+        examples=[12345],
+    )
+    subscribers: int = Field(
+        title="连接的订阅进程数量，owner才有",
+        examples=[3],
+    )
+    forwardedTimes: int = Field(
+        title="累计转发事件数量",
+        examples=[0],
+    )
+    receivedTimes: int = Field(
+        title="累计收到转发事件数量",
+        examples=[1520],
+    )
+    broadcastTimes: int = Field(
+        title="累计发出的广播数量（凭证失效、账号变更、删除用户进度）",
+        examples=[4],
+    )
+
+
+class WriteBufferMetrics(BaseModel):
+    pending: int = Field(
+        title="等待写入的会话数量",
+        examples=[3],
+    )
+    flushedTimes: int = Field(
+        title="累计写入次数",
+        examples=[120],
+    )
+    writtenRows: int = Field(
+        title="累计写入的会话数量",
+        examples=[300],
+    )
+    coalescedTimes: int = Field(
+        title="累计合并的更新次数",
+        examples=[850],
+    )
+
+
+class MetricsRespBody(BaseModel):
+    accounts: dict[str, AccountMetrics] = Field(
+        title="各个Poe账号的指标，key为账号名称",
+    )
+    authCache: CacheMetrics = Field(
+        title="登陆凭证缓存",
+    )
+    botListCache: SWRCacheMetrics = Field(
+        title="探索和搜索bot的结果缓存",
+    )
+    chatWriteBuffer: WriteBufferMetrics = Field(
+        title="会话最后对话时间和内容的合并写入",
+    )
+    broker: BrokerMetrics = Field(
+        title="多进程部署时的回答事件中转，只是处理这个请求的进程的数据",
+    )
+
+
+class DebugCaptureRespBody(BaseModel):
+    enabled: bool = Field(
+        title="是否开启",
+        examples=[True],
+    )
+    sampleRate: float = Field(
+        title="采样率",
+        examples=[0.1],
+    )
+    maxFiles: int = Field(
+        title="最多保留的文件数量",
+        examples=[200],
+    )
+    pending: int = Field(
+        title="等待写入的数量",
+        examples=[0],
+    )
+    writtenTimes: int = Field(
+        title="累计写入数量",
+        examples=[35],
+    )
+    droppedTimes: int = Field(
+        title="累计因队列满丢弃的数量",
+        examples=[0],
+    )
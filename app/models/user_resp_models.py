@@ -321,11 +321,30 @@ class ChatRespBody(BaseModel):
         examples=[1719676800000],
     )
     lastContent: str = Field(
-        title="最后一次对话内容",
+        title="最后一次对话内容，只有开头一段",
         examples=["wtf"],
     )
 
 
+class ChatListPageInfo(BaseModel):
+    endCursor: str = Field(
+        title="翻页游标，拉下一页时传这个",
+        examples=["1719676800000_abc23kjkwei"],
+    )
+    hasNextPage: bool = Field(
+        title="是否有下一页",
+    )
+
+
+class ChatListRespBody(BaseModel):
+    chats: list[ChatRespBody] = Field(
+        title="会话列表，按最后对话时间倒序",
+    )
+    pageInfo: ChatListPageInfo = Field(
+        title="翻页信息",
+    )
+
+
 class BotInfo(BaseModel):
     botName: str = Field(
         title="bot名称",
@@ -468,19 +487,45 @@ class NewChat(BaseModel):
     )
 
 
+class BotMessageDelta(BaseModel):
+    messageId: int = Field(
+        title="消息id",
+        examples=[2692997857],
+    )
+    seq: int = Field(
+        title="该消息的增量序号，从0开始",
+        examples=[0],
+    )
+    offset: int = Field(
+        title="增量文本的起始位置（按字符算），即之前已收到的文本长度",
+        examples=[0],
+    )
+    delta: str = Field(
+        title="新增的文本",
+        examples=["啊？"],
+    )
+    state: State = Field(
+        title="消息状态",
+    )
+    attachments: list[Attachments] = Field(
+        title="附件列表",
+    )
+
+
 class DataType(Enum):
     newChat = "newChat"
     humanMessageAdd = "humanMessageAdd"
     botMessageAdd = "botMessageAdd"
+    botMessageDelta = "botMessageDelta"
     chatTitleUpdated = "chatTitleUpdated"
     talkError = "talkError"
 
 
 class TalkRespBody(BaseModel):
     dataType: DataType = Field(title="数据类型")
-    dataContent: NewChat | MessageNodeRespBody | ChatTitleUpdated | TalkError = Field(
-        title="数据内容"
-    )
+    dataContent: (
+        NewChat | MessageNodeRespBody | BotMessageDelta | ChatTitleUpdated | TalkError
+    ) = Field(title="数据内容")
 
 
 class TranslateRespBody(BaseModel):
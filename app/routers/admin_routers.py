@@ -1,19 +1,31 @@
 import models.admin_req_models as req_models
 import models.admin_resp_models as resp_models
-from database.bot_db import Bot
-from database.chat_db import Chat
+from database.account_db import DEFAULT_ACCOUNT, Account
+from database.chat_db import chat_write_buffer
 from database.config_db import Config
-from database.user_db import User
+from database.points_db import Points_Usage
+from database.user_db import User, auth_cache
 from fastapi import (
     APIRouter,
     Body,
     Depends,
     Path,
+    Query,
     Response,
 )
 from fastapi.responses import JSONResponse
+from services.debug_capture import debug_capture
+from services.event_broker import broker
 from services.jwt_auth import verify_admin
-from services.poe_client import login_poe, poe
+from services.poe_client import (
+    bot_list_cache,
+    get_proxy,
+    login_account,
+    login_poe,
+    poe,
+    remove_account,
+)
+from services.user_deletion import get_user_deletion, start_user_deletion
 from ujson import dump
 from utils.env_util import gv
 from utils.tool_util import generate_random_password, logger
@@ -117,8 +129,13 @@ async def _(
 @router.delete(
     "/user/{user}",
     summary="删除用户",
+    description="""在后台删除用户的会话和bot，删完再删除用户，进度用 GET /user/{user}/deletion 查看<br>
+失败了用户和没删掉的会话、bot会保留，可以再次调用重试""",
     responses={
-        200: {"description": "删除成功", "model": resp_models.BasicRespBody[None]},
+        202: {
+            "description": "开始删除",
+            "model": resp_models.BasicRespBody[resp_models.UserDeletionRespBody],
+        },
     },
 )
 async def _(
@@ -127,33 +144,25 @@ async def _(
 ):
     if not await User.user_exist(user):
         return JSONResponse({"code": 2001, "msg": "用户不存在"}, 402)
-    # 删除用户的所有会话
-    _rows = await Chat.get_user_chat(user)
-    for row in _rows:
-        try:
-            await poe.client.delete_chat(row[0], row[7])
-        except Exception as e:
-            return response_500(repr(e))
-
-    # 删除用户创建的bot
-    _rows = await Bot.get_user_bot(user)
-    for row in _rows:
-        try:
-            if row[2] == "自定义":
-                await poe.client.delete_bot(row[4], row[3])
-
-            if row[2] == "第三方":
-                await poe.client.remove_bot(row[0], row[3])
-
-        except Exception as e:
-            return response_500(repr(e))
-
-    await Chat.delete_chat(user)
-    await Bot.remove_bot(user)
-    # 把用户删掉
-    await User.delete_user(user)
 
-    return response_200()
+    return response_200(start_user_deletion(user), 202)
+
+
+@router.get(
+    "/user/{user}/deletion",
+    summary="查看删除用户的进度",
+    description="state: running 删除中  done 已删除  failed 有会话或bot删除失败",
+    responses={
+        200: {"model": resp_models.BasicRespBody[resp_models.UserDeletionRespBody]},
+    },
+)
+async def _(
+    user: str = Path(description="用户名", example="user_name"),
+    _verify: dict = Depends(verify_admin),
+):
+    if stats := get_user_deletion(user):
+        return response_200(stats)
+    return JSONResponse({"code": 2001, "msg": "没有删除该用户的任务"}, 402)
 
 
 @router.post(
@@ -263,6 +272,7 @@ async def _(
     await Config.update_setting(body.p_b, body.p_lat, body.formkey, body.proxy)
     if err_msg := await login_poe():
         return response_500(err_msg)
+    broker.broadcast("account", {"name": DEFAULT_ACCOUNT})
 
     return response_200()
 
@@ -278,6 +288,186 @@ async def _(
     return response_200(await poe.client.get_account_info())
 
 
+@router.get(
+    "/accounts",
+    summary="列出账号池中的Poe账号",
+    responses={
+        200: {"model": resp_models.BasicRespBody[list[resp_models.PoolAccountRespBody]]}
+    },
+)
+async def _(
+    _verify: dict = Depends(verify_admin),
+):
+    return response_200(
+        [
+            {
+                "name": name,
+                "loginSuccess": client.login_success,
+                "remainPoints": client.remain_points,
+                "load": client.get_load(),
+            }
+            for name, client in poe.clients.items()
+        ]
+    )
+
+
+@router.post(
+    "/account/add",
+    summary="添加Poe账号到账号池，名称相同则更新凭证",
+    description="默认账号请通过/config修改",
+    responses={
+        200: {"description": "添加成功", "model": resp_models.BasicRespBody[None]},
+    },
+)
+async def _(
+    body: req_models.AddAccountReqBody = Body(
+        examples=[
+            {
+                "name": "account2",
+                "p_b": "ABcdefz2u1baGdPgXxcWcg%3D%3D",
+                "p_lat": "ABcdefz2u1baGdPgXxcWcgY7YSQZ40dyWrO53FfQ%3D%3D",
+                "formkey": "2cf072difnsie23f7892divd0380e3f7",
+            }
+        ]
+    ),
+    _verify: dict = Depends(verify_admin),
+):
+    if body.name == DEFAULT_ACCOUNT:
+        return JSONResponse({"code": 2001, "msg": "默认账号请通过/config修改"}, 402)
+
+    if err_msg := await login_account(
+        body.name, body.p_b, body.p_lat, body.formkey, await get_proxy()
+    ):
+        return response_500(err_msg)
+
+    await Account.add_account(body.name, body.p_b, body.p_lat, body.formkey)
+    broker.broadcast("account", {"name": body.name})
+
+    return response_200()
+
+
+@router.delete(
+    "/account/{name}",
+    summary="从账号池删除Poe账号",
+    description="该账号上的会话将无法继续使用",
+    responses={
+        200: {"description": "删除成功", "model": resp_models.BasicRespBody[None]},
+    },
+)
+async def _(
+    name: str = Path(description="账号名称", examples=["account2"]),
+    _verify: dict = Depends(verify_admin),
+):
+    if name == DEFAULT_ACCOUNT:
+        return JSONResponse({"code": 2001, "msg": "不能删除默认账号"}, 402)
+
+    if not await Account.account_exist(name):
+        return JSONResponse({"code": 2001, "msg": "账号不存在"}, 402)
+
+    await Account.remove_account(name)
+    await remove_account(name)
+    broker.broadcast("account", {"name": name})
+
+    return response_200()
+
+
+@router.get(
+    "/usage",
+    summary="积分使用统计",
+    description="按用户、bot、日期汇总，日期格式YYYY-MM-DD，不传就是不限",
+    responses={
+        200: {"model": resp_models.BasicRespBody[list[resp_models.UsageRespBody]]}
+    },
+)
+async def _(
+    user: str = Query("", description="用户名"),
+    startDate: str = Query("", description="开始日期", example="2024-01-01"),
+    endDate: str = Query("", description="结束日期", example="2024-01-31"),
+    _verify: dict = Depends(verify_admin),
+):
+    _rows = await Points_Usage.list_usage(user, startDate, endDate)
+    return response_200(
+        [
+            {
+                "user": row[0],
+                "botHandle": row[1],
+                "date": row[2],
+                "points": row[3],
+                "times": row[4],
+            }
+            for row in _rows
+        ]
+    )
+
+
+@router.get(
+    "/metrics",
+    summary="获取运行指标",
+    responses={200: {"model": resp_models.BasicRespBody[resp_models.MetricsRespBody]}},
+)
+async def _(
+    _verify: dict = Depends(verify_admin),
+):
+    return response_200(
+        {
+            "accounts": {
+                name: {
+                    "httpPool": client.get_pool_stats(),
+                    "sendScheduler": client.send_scheduler.get_stats(),
+                    "answerQueues": client.answer_queues.get_stats(),
+                    "priceCache": client.bot_price_cache.get_stats(),
+                    "wsChannel": client.get_ws_stats(),
+                }
+                for name, client in poe.clients.items()
+            },
+            "authCache": auth_cache.get_stats(),
+            "botListCache": bot_list_cache.get_stats(),
+            "chatWriteBuffer": chat_write_buffer.get_stats(),
+            "broker": broker.get_stats(),
+        }
+    )
+
+
+@router.get(
+    "/debugCapture",
+    summary="获取调试抓包状态",
+    responses={
+        200: {"model": resp_models.BasicRespBody[resp_models.DebugCaptureRespBody]}
+    },
+)
+async def _(
+    _verify: dict = Depends(verify_admin),
+):
+    return response_200(debug_capture.get_stats())
+
+
+@router.post(
+    "/debugCapture",
+    summary="开关调试抓包",
+    description="开启后按采样率把聊天记录等响应数据写到debug_capture目录，只保留最新的maxFiles个文件",
+    responses={
+        200: {"model": resp_models.BasicRespBody[resp_models.DebugCaptureRespBody]}
+    },
+)
+async def _(
+    body: req_models.DebugCaptureReqBody = Body(
+        examples=[
+            {
+                "enabled": True,
+                "sampleRate": 0.1,
+                "maxFiles": 200,
+            }
+        ],
+    ),
+    _verify: dict = Depends(verify_admin),
+):
+    debug_capture.configure(body.enabled, body.sampleRate, body.maxFiles)
+    logger.info(
+        f"调试抓包{'开启' if body.enabled else '关闭'}，采样率{body.sampleRate}"
+    )
+    return response_200(debug_capture.get_stats())
+
+
 @router.post(
     "/hashUpload",
     summary="更新请求的hash（前端不用管）",
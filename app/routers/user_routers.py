@@ -1,16 +1,37 @@
-from io import BytesIO
+from hashlib import sha256
 from time import localtime, strftime
 from typing import AsyncIterable
 
 import models.user_req_models as req_models
 import models.user_resp_models as resp_models
+from database.account_db import DEFAULT_ACCOUNT
 from database.bot_db import Bot
 from database.chat_db import Chat
+from database.context_db import Talk_Context
+from database.message_db import Message
+from database.points_db import Points_Reservation
 from database.user_db import User
-from fastapi import APIRouter, Body, Depends, File, Form, Path, Response, UploadFile
+from fastapi import (
+    APIRouter,
+    Body,
+    Depends,
+    File,
+    Form,
+    Header,
+    Path,
+    Query,
+    Response,
+    UploadFile,
+)
 from fastapi.responses import JSONResponse, StreamingResponse
+from services.answer_stream import Answer_Stream, answer_streams, parse_last_event_id
+from services.chat_history import get_chat_history
+from services.debug_capture import debug_capture
+from services.event_broker import broker
 from services.jwt_auth import create_token, verify_token
-from services.poe_client import poe
+from services.poe_client import explore_bot, poe, search_bot
+from services.poe_lib.answer_queue import Answer_Queue
+from services.poe_lib.client import Poe_Client
 from services.poe_lib.type import (
     BotMessageAdd,
     ChatTitleUpdated,
@@ -20,11 +41,13 @@ from services.poe_lib.type import (
     TalkError,
     UnsupportedFileType,
 )
-from ujson import dump, dumps
 from utils.tool_util import logger, user_action
 
 router = APIRouter()
 
+# 多进程部署时旁听别的进程发起的回答，等owner补发数据的秒数
+WATCH_WAIT = 3
+
 
 def response_500(err_msg: str) -> JSONResponse:
     """500响应"""
@@ -48,24 +71,41 @@ def response_200(data=None, msg="success") -> Response:
     )
 
 
-async def reply_pre_check(user: str, chatCode: str, remain_points: int, price: int):
+def reply_pre_check(ctx: Talk_Context, chatCode: str, price: int):
     # 判断账号授权是否过期
-    if await User.is_outdate(user):
-        date_string = strftime(
-            "%Y-%m-%d %H:%M:%S", localtime(await User.get_expire_date(user) / 1000)
-        )
+    if ctx.is_outdate:
+        date_string = strftime("%Y-%m-%d %H:%M:%S", localtime(ctx.expire_date / 1000))
         return response_400(2009, f"你的账号授权已于{date_string}过期，无法对话")
 
     # 判断会话是否存在
-    if chatCode != "0" and not await Chat.chat_exist(user, chatCode):
+    if chatCode != "0" and not ctx.chat_exist:
         return response_400(2001, "会话不存在")
 
     # 判断积分够不够
-    if remain_points < price:
-        return response_400(2010, f"可用积分不足，当前可用积分: {remain_points}")
+    if ctx.remain_points < price:
+        return response_400(
+            2010, f"可用积分不足，当前可用积分: {ctx.remain_points}"
+        )
+
+
+def sse_response(content: AsyncIterable[bytes]) -> StreamingResponse:
+    """SSE响应，禁止代理缓存和缓冲"""
+    return StreamingResponse(
+        content,
+        media_type="text/event-stream",
+        status_code=200,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def use_delta_mode(stream_mode: str, accept: str | None) -> bool:
+    """是否使用增量模式，query参数streamMode=delta或者Accept头带上mode=delta"""
+    return stream_mode == "delta" or "mode=delta" in (accept or "")
 
 
 async def ai_reply(
+    client: Poe_Client,
+    queue: Answer_Queue,
     user: str,
     chatCode: str,
     chat_id: int,
@@ -74,79 +114,185 @@ async def ai_reply(
     messageId: int,
     chat_data: dict,
     new_chat: bool,
-    remain_points: int,
-) -> AsyncIterable:
-    """回答环节"""
-
-    def _yield_data(data_type: str, data: str | dict) -> bytes:
-        return BytesIO(
-            (
-                dumps(
-                    {
-                        "code": 0,
-                        "msg": "success",
-                        "data": {"dataType": data_type, "dataContent": data},
-                    }
-                )
-                + "\n"
-            ).encode("utf-8")
-        ).read()
+    reservation: Points_Reservation,
+    delta_mode: bool = False,
+) -> AsyncIterable[tuple[str, dict]]:
+    """
+    回答环节，输出(消息类型, 消息内容)
+
+    收到花费时结算预扣的积分，回答完成了却没收到就按bot价格结算，没完成就退回
+
+    增量模式下回答中的消息只发新增的文本（botMessageDelta），
+    第一次、回答结束或者文本对不上时发完整的botMessageAdd，前端可以用来校验
+    """
 
     # 新会话数据
     if new_chat:
-        yield _yield_data(
+        yield (
             "newChat",
             {"chatCode": chatCode, "botInfo": chat_data["botInfo"]},
         )
 
-    # 用户的问题元数据
-    yield _yield_data("humanMessageAdd", chat_data["messageNode"])
+    # 用户的问题元数据，重新回答没有
+    if chat_data:
+        yield ("humanMessageAdd", chat_data["messageNode"])
+
+    # 增量模式下各消息已发送的文本和增量序号
+    sent_texts: dict[int, str] = {}
+    delta_seqs: dict[int, int] = {}
+    # 回答是否存到本地聊天记录了，没存上的话本地记录就缺了这段
+    saved = False
+    # 是否收到了完成的回答
+    completed = False
+    try:
+        async for _data in client.get_answer(queue, chat_id, messageId, new_chat):
+            # AI的回答
+            if isinstance(_data, BotMessageAdd):
+                attachments = _data.attachments
+                sent_text = sent_texts.get(_data.messageId)
+                if (
+                    delta_mode
+                    and _data.state == "incomplete"
+                    and sent_text is not None
+                    and _data.text.startswith(sent_text)
+                ):
+                    delta = _data.text[len(sent_text) :]
+                    if delta or attachments:
+                        seq = delta_seqs[_data.messageId] = (
+                            delta_seqs.get(_data.messageId, -1) + 1
+                        )
+                        sent_texts[_data.messageId] = _data.text
+                        yield (
+                            "botMessageDelta",
+                            {
+                                "messageId": _data.messageId,
+                                "seq": seq,
+                                "offset": len(sent_text),
+                                "delta": delta,
+                                "state": _data.state,
+                                "attachments": attachments,
+                            },
+                        )
+                else:
+                    sent_texts[_data.messageId] = _data.text
+                    yield (
+                        "botMessageAdd",
+                        {
+                            "state": _data.state,
+                            "messageId": _data.messageId,
+                            "creationTime": _data.creationTime,
+                            "text": _data.text,
+                            "attachments": attachments,
+                            "author": "bot",
+                        },
+                    )
+
+                if _data.state != "incomplete":
+                    completed = completed or _data.state == "complete"
+                    Chat.update_last_content(user, chatCode, _data.text)
+                    # 回答完了把问题和回答存到本地聊天记录
+                    nodes = [
+                        {
+                            "messageId": _data.messageId,
+                            "creationTime": _data.creationTime,
+                            "text": _data.text,
+                            "attachments": attachments,
+                            "author": "bot",
+                        }
+                    ]
+                    if chat_data:
+                        nodes.insert(0, chat_data["messageNode"])
+                    await Message.save_messages(user, chatCode, nodes)
+                    saved = True
+                if _data.state not in ["complete", "incomplete", "cancelled"]:
+                    yield ("talkError", {"errMsg": _data.messageStateText})
+
+            # 标题更新
+            if isinstance(_data, ChatTitleUpdated):
+                await Chat.update_title(user, chatCode, _data.title)
+                yield ("chatTitleUpdated", {"title": _data.title})
+
+            # 花费更新
+            if isinstance(_data, PriceCost):
+                # 结算用户积分
+                await reservation.settle(_data.price)
+                user_action.info(
+                    f"用户 {user} 对话 {botName} ({botHandle}) chatCode {chatCode} 积分 {_data.price}"
+                )
+                yield ("chatPriceCost", {"price": _data.price})
+
+            # 出错
+            if isinstance(_data, TalkError):
+                yield ("talkError", {"errMsg": _data.errMsg})
+                logger.error(
+                    f"用户:{user}  {botName} ({botHandle})   chatCode:{chatCode}  {_data.errMsg}"
+                )
+                user_action.info(
+                    f"出错 用户:{user}  {botName} ({botHandle})   chatCode:{chatCode}  {_data.errMsg}"
+                )
+    finally:
+        if completed and not reservation.settled:
+            await reservation.settle_default()
+            user_action.info(
+                f"用户 {user} 对话 {botName} ({botHandle}) chatCode {chatCode} 没收到花费，按bot价格结算 积分 {reservation.price}"
+            )
+        elif not completed:
+            await reservation.release()
+        if not saved:
+            await Chat.mark_history_dirty(user, chatCode, messageId)
 
-    async for _data in poe.client.get_answer(chat_id, messageId, new_chat):
-        # AI的回答
+
+async def watch_reply(
+    client: Poe_Client, queue: Answer_Queue, chat_id: int
+) -> AsyncIterable[tuple[str, dict]]:
+    """旁听进行中的回答，输出(消息类型, 消息内容)，回答都发完整的botMessageAdd"""
+    async for _data in client.watch_answer(queue, chat_id):
         if isinstance(_data, BotMessageAdd):
-            yield _yield_data(
+            yield (
                 "botMessageAdd",
                 {
                     "state": _data.state,
                     "messageId": _data.messageId,
                     "creationTime": _data.creationTime,
                     "text": _data.text,
-                    "attachments": [
-                        attachment.model_dump() for attachment in _data.attachments
-                    ],
+                    "attachments": _data.attachments,
                     "author": "bot",
                 },
             )
-
-            if _data.state != "incomplete":
-                await Chat.update_last_content(user, chatCode, _data.text)
             if _data.state not in ["complete", "incomplete", "cancelled"]:
-                yield _yield_data("talkError", {"errMsg": _data.messageStateText})
+                yield ("talkError", {"errMsg": _data.messageStateText})
 
-        # 标题更新
-        if isinstance(_data, ChatTitleUpdated):
-            await Chat.update_title(user, chatCode, _data.title)
-            yield _yield_data("chatTitleUpdated", {"title": _data.title})
+        elif isinstance(_data, ChatTitleUpdated):
+            yield ("chatTitleUpdated", {"title": _data.title})
 
-        # 花费更新
-        if isinstance(_data, PriceCost):
-            # 减去用户积分
-            await User.update_remain_points(user, remain_points - _data.price)
-            user_action.info(
-                f"用户 {user} 对话 {botName} ({botHandle}) chatCode {chatCode} 积分 {_data.price}"
-            )
-            yield _yield_data("chatPriceCost", {"price": _data.price})
+        elif isinstance(_data, TalkError):
+            yield ("talkError", {"errMsg": _data.errMsg})
 
-        # 出错
-        if isinstance(_data, TalkError):
-            yield _yield_data("talkError", {"errMsg": _data.errMsg})
-            logger.error(
-                f"用户:{user}  {botName} ({botHandle})   chatCode:{chatCode}  {_data.errMsg}"
-            )
-            user_action.info(
-                f"出错 用户:{user}  {botName} ({botHandle})   chatCode:{chatCode}  {_data.errMsg}"
-            )
+
+async def watch_answer(user: str, chatCode: str) -> Answer_Stream | None:
+    """
+    本进程没有回答流时旁听进行中的回答，从当前回答的第一条开始发，没有进行中的回答返回None
+    """
+    if not await Chat.chat_exist(user, chatCode):
+        return None
+    _, _, chat_id, _, account = await Chat.get_chat_info(user, chatCode)
+    try:
+        client = poe.get_client(account)
+    except Exception:
+        return None
+
+    queue = client.answer_queues.open(chat_id, replay=True)
+    # 订阅进程本地没有数据，要等owner补发
+    first = await queue.peek(WATCH_WAIT if not broker.is_owner else 0)
+    if first is None:
+        client.answer_queues.close(chat_id, queue)
+        return None
+    return answer_streams.create(
+        user,
+        chatCode,
+        getattr(first, "messageId", None) or 0,
+        watch_reply(client, queue, chat_id),
+    )
 
 
 @router.post(
@@ -237,7 +383,7 @@ async def _(
     user_data: dict = Depends(verify_token),
 ):
     try:
-        data = await poe.client.explore_bot(category, endCursor)
+        data = await explore_bot(category, endCursor)
     except Exception as e:
         return response_500(repr(e))
 
@@ -257,7 +403,7 @@ async def _(
     user_data: dict = Depends(verify_token),
 ):
     try:
-        data = await poe.client.search_bot(keyWord, endCursor)
+        data = await search_bot(keyWord, endCursor)
     except Exception as e:
         return response_500(repr(e))
 
@@ -494,6 +640,7 @@ async def _(
         bot_info["botType"],
         bot_info["botHandle"],
         bot_info["botId"],
+        DEFAULT_ACCOUNT,
     )
     user_action.info(
         f"用户 {user} 添加自定义bot {body.botName} {bot_info['botHandle']}"
@@ -516,9 +663,11 @@ async def _(
     user = user_data["user"]
 
     try:
-        bot_type, bot_name, bot_id = await Bot.get_bot_info(user, botHandle)
+        bot_type, bot_name, bot_id, account = await Bot.get_bot_info(user, botHandle)
         # 自定义bot的时候是用bot Handle
-        edit_bot_info = await poe.client.get_edit_bot_info(bot_name, botHandle)
+        edit_bot_info = await poe.get_client(account).get_edit_bot_info(
+            bot_name, botHandle
+        )
     except Exception as e:
         return response_500(repr(e))
 
@@ -554,7 +703,7 @@ async def _(
 ):
     user = user_data["user"]
 
-    bot_type, bot_name, bot_id = await Bot.get_bot_info(user, body.botHandle)
+    bot_type, bot_name, bot_id, account = await Bot.get_bot_info(user, body.botHandle)
     if bot_type != "自定义":
         return response_400(2001, "只能修改自定义bot")
 
@@ -563,7 +712,7 @@ async def _(
 
     try:
         # 获取bot信息
-        await poe.client.edit_bot(
+        await poe.get_client(account).edit_bot(
             body.botId,
             body.botHandle,
             body.baseBotId,
@@ -596,12 +745,12 @@ async def _(
     user = user_data["user"]
 
     try:
-        bot_type, bot_name, bot_id = await Bot.get_bot_info(user, botHandle)
+        bot_type, bot_name, bot_id, account = await Bot.get_bot_info(user, botHandle)
         if bot_type == "自定义":
-            await poe.client.delete_bot(botHandle, bot_id)
+            await poe.get_client(account).delete_bot(botHandle, bot_id)
 
         if bot_type == "第三方":
-            await poe.client.remove_bot(bot_name, bot_id)
+            await poe.get_client(account).remove_bot(bot_name, bot_id)
 
     except Exception as e:
         return response_500(repr(e))
@@ -622,18 +771,24 @@ async def _(
     botName: str = Path(description="bot名称", example="ChatGPT"),
     user_data: dict = Depends(verify_token),
 ):
+    user = user_data["user"]
     try:
-        bot_info = await poe.client.get_bot_info(botName)
+        client = poe.client
+        # 自定义bot只有创建它的账号才能查到
+        if await Bot.bot_exist(user, botName):
+            client = poe.get_client((await Bot.get_bot_info(user, botName))[3])
+        bot_info = await client.get_bot_info(botName)
     except Exception as e:
         return response_500(repr(e))
 
-    user = user_data["user"]
     added = await Bot.bot_exist(user, bot_info["botHandle"])
     bot_info["added"] = added
     # 判断是否为自定义bot，如果是需要替换名称为自定义名称
     if added:
         # 如果是自定义bot，botName等于botHandle
-        bot_type, bot_name, bot_id = await Bot.get_bot_info(user, bot_info["botHandle"])
+        bot_type, bot_name, bot_id, account = await Bot.get_bot_info(
+            user, bot_info["botHandle"]
+        )
         # 如果是自定义bot，botName要改为自定义的
         if bot_type == "自定义":
             bot_info["botName"] = bot_name
@@ -646,20 +801,34 @@ async def _(
 @router.get(
     "/chats/{botHandle}",
     summary="拉取会话",
+    description="""按最后对话时间倒序分页，响应带ETag，
+请求时带上If-None-Match，这页没变化就返回304""",
     responses={
         200: {
             "description": "会话列表",
-            "model": resp_models.BasicRespBody[list[resp_models.ChatRespBody]],
+            "model": resp_models.BasicRespBody[resp_models.ChatListRespBody],
         },
     },
 )
 async def _(
     botHandle: str = Path(description="bot Handle，如果写all则拉取所有", example="all"),
+    cursor: str = Query("0", description="翻页指针，初始是0，之后是上一页的endCursor"),
+    size: int = Query(50, ge=1, le=200, description="每页数量"),
+    if_none_match: str | None = Header(None, alias="If-None-Match"),
     user_data: dict = Depends(verify_token),
 ):
     if botHandle == "all":
         botHandle = ""
-    _rows = await Chat.get_user_chat(user_data["user"], botHandle)
+    before = None
+    if cursor != "0":
+        try:
+            last_talk_time, code = cursor.split("_", 1)
+            before = (int(last_talk_time), code)
+        except ValueError:
+            return response_400(2001, "翻页指针错误", 400)
+
+    # 多拿一个判断还有没有下一页
+    _rows = await Chat.list_user_chat(user_data["user"], botHandle, before, size + 1)
     chat_list = [
         {
             "chatCode": row[0],
@@ -670,9 +839,26 @@ async def _(
             "lastTalkTime": row[5],
             "lastContent": row[6],
         }
-        for row in _rows
+        for row in _rows[:size]
     ]
-    return response_200(chat_list)
+    end_cursor = (
+        f"{chat_list[-1]['lastTalkTime']}_{chat_list[-1]['chatCode']}"
+        if chat_list
+        else cursor
+    )
+    response = response_200(
+        {
+            "chats": chat_list,
+            "pageInfo": {"endCursor": end_cursor, "hasNextPage": len(_rows) > size},
+        }
+    )
+
+    etag = f'"{sha256(response.body).hexdigest()[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return response
 
 
 @router.get(
@@ -695,21 +881,28 @@ async def _(
 ):
     user = user_data["user"]
     try:
-        bot_name, bot_handle, chat_id, title = await Chat.get_chat_info(user, chatCode)
-        chat_info = await poe.client.get_chat_info(chatCode, chat_id, cursor)
+        bot_name, bot_handle, chat_id, title, account = await Chat.get_chat_info(
+            user, chatCode
+        )
+        chat_info = await get_chat_history(
+            poe.get_client(account), user, chatCode, chat_id, bot_handle, cursor
+        )
     except Exception as e:
         return response_500(repr(e))
 
     # 判断是否为自定义bot，如果是需要替换handle为用户设置的名称
     if cursor == "0" and await Bot.bot_exist(user, bot_handle):
-        bot_type, bot_name, bot_id = await Bot.get_bot_info(user, bot_handle)
+        bot_type, bot_name, bot_id, bot_account = await Bot.get_bot_info(
+            user, bot_handle
+        )
         if bot_type == "自定义":
             chat_info["botInfo"]["botName"] = bot_name
             chat_info["botInfo"]["added"] = True
             chat_info["botInfo"]["botType"] = bot_type
 
-    with open("tmp.json", "w", encoding="utf-8") as w:
-        dump(chat_info, w, ensure_ascii=False)
+    debug_capture.capture(
+        "chat", {"user": user, "chatCode": chatCode, "cursor": cursor, **chat_info}
+    )
 
     return response_200(chat_info)
 
@@ -744,13 +937,17 @@ async def _(
     responses={
         200: {
             "description": """
-消息类型type有5种<br/>
+SSE格式，每条消息带id（断线重连用）和event（消息类型），data为下面的结构，空闲时会发心跳注释<br/>
+<br/>
+消息类型type有6种<br/>
 newChat -- 新建会话，需要跳转到对话页面 <br/>
 <br/>
 humanMessageAdd -- 问题内容 <br/>
 <br/>
 botMessageAdd -- 回答内容 <br/>
 <br/>
+botMessageDelta -- 回答新增的内容，只有增量模式才有 <br/>
+<br/>
 chatTitleUpdated -- 会话标题，只有新会话才有 <br/>
 <br/>
 talkError -- 回答出错 <br/>
@@ -765,16 +962,28 @@ async def _(
     botHandle: str = Form(description="bot handle"),
     question: str = Form(None, description="问题内容，可以只发文件不发文本"),
     files: list[UploadFile] = File(None, description="要上传的附件，不需要就不发"),
+    streamMode: str = Query(
+        "full", description="full 每次发完整回答，delta 只发新增的文本"
+    ),
+    accept: str | None = Header(None, description="带上mode=delta也是增量模式"),
     user_data: dict = Depends(verify_token),
 ):
     if not question:
         question = ""
     user = user_data["user"]
 
+    # 用户、bot、会话一次查出来
+    ctx = await Talk_Context.load(user, botHandle, chatCode)
+    if ctx is None:
+        return response_400(2001, "用户不存在")
+    # 会话不存在时后面拿不到会话信息，先检查
+    if chatCode != "0" and not ctx.chat_exist:
+        return response_400(2001, "会话不存在")
+
     #################
     ### 新会话判断是否添加了bot，如果没添加就加上（自定义bot一定已添加）
     #################
-    if not await Bot.bot_exist(user, botHandle):
+    if not ctx.bot_exist:
         try:
             bot_info = await poe.client.get_bot_info(botName)
         except Exception as e:
@@ -787,30 +996,39 @@ async def _(
             bot_info["botHandle"],
             bot_info["botId"],
         )
+        ctx.bot_type = bot_info["botType"]
+        ctx.bot_name = botName
+        ctx.bot_id = bot_info["botId"]
+        ctx.bot_account = DEFAULT_ACCOUNT
 
     #################
     ### 提问环节
     #################
-    chat_id = 0
-    if chatCode != "0":
-        bot_name, bot_handle, chat_id, title = await Chat.get_chat_info(user, chatCode)
-    # 检查是否为用户的bot，顺便拿bot type
-    bot_type, bot_name, bot_id = await Bot.get_bot_info(user, botHandle)
-
-    # 积分余额检查
-    remain_points = await User.get_remain_points(user)
+    bot_type = ctx.bot_type
+    chat_id = ctx.chat_id or 0
+    # 新会话分配账号，自定义bot只能用创建它的账号
+    if chatCode == "0":
+        account = ctx.bot_account if bot_type == "自定义" else poe.pick_account()
+    else:
+        account = ctx.chat_account
     try:
-        price = poe.client.bot_price_cache[botHandle]
-    except KeyError:
-        if bot_type == "自定义":
-            bot_info = await poe.client.get_bot_info(botHandle)
-        else:
-            bot_info = await poe.client.get_bot_info(botName)
-        price = bot_info["price"]
+        client = poe.get_client(account)
+    except Exception as e:
+        return response_500(repr(e))
+
+    # 积分余额检查，自定义bot要用handle查
+    price = await client.get_bot_price(
+        botHandle, botHandle if bot_type == "自定义" else botName
+    )
 
-    if json_response := await reply_pre_check(user, chatCode, remain_points, price):
+    if json_response := reply_pre_check(ctx, chatCode, price):
         return json_response
 
+    # 预扣积分，收到花费后多退少补
+    reservation = await Points_Reservation.take(user, botHandle, price)
+    if reservation is None:
+        return response_400(2010, "可用积分不足")
+
     # 处理附件
     file_list: list[tuple] = []
     if files:
@@ -823,10 +1041,13 @@ async def _(
                     file.filename,
                 )
             )
+    # 已有会话在发问题前就开始监听回答，新会话要拿到chatId后才能监听
+    queue = client.answer_queues.open(chat_id) if chat_id else None
+    chat_data = None
     # 发起问题请求
     try:
-        async with poe.client.send_question_lock:
-            chat_data = await poe.client.send_question(
+        async with client.send_scheduler.slot(user, chat_id or None):
+            chat_data = await client.send_question(
                 botHandle, chat_id, question, file_list
             )
     except UnsupportedFileType:
@@ -842,6 +1063,13 @@ async def _(
     except Exception as e:
         return response_500(repr(e))
 
+    finally:
+        # 发送失败就不用监听了，预扣的积分也退回
+        if chat_data is None:
+            if queue:
+                client.answer_queues.close(chat_id, queue)
+            await reservation.release()
+
     new_chat = False
     if chatCode == "0":
         # 保存新会话记录
@@ -853,9 +1081,12 @@ async def _(
             botName,
             botHandle,
             chat_data["botInfo"]["imgUrl"],
+            account,
         )
         chatCode = chat_data["chatCode"]
         chat_id = chat_data["chatId"]
+        # 认领发送期间暂存的回答
+        queue = client.answer_queues.open(chat_id)
         new_chat = True
         # 把bot类型补上
         chat_data["botType"] = bot_type
@@ -866,13 +1097,18 @@ async def _(
     # 获取消息id
     messageId = chat_data["messageNode"]["messageId"]
     # 更新最后对话时间
-    await Chat.update_last_talk_time(user, chatCode)
+    Chat.update_last_talk_time(user, chatCode)
 
     #################
     ### 回答环节
     #################
-    return StreamingResponse(
+    stream = answer_streams.create(
+        user,
+        chatCode,
+        messageId,
         ai_reply(
+            client,
+            queue,
             user,
             chatCode,
             chat_id,
@@ -881,11 +1117,11 @@ async def _(
             messageId,
             chat_data,
             new_chat,
-            remain_points,
+            reservation,
+            use_delta_mode(streamMode, accept),
         ),
-        media_type="text/event-stream",
-        status_code=200,
     )
+    return sse_response(stream.subscribe())
 
 
 @router.post(
@@ -895,11 +1131,13 @@ async def _(
     responses={
         200: {
             "description": """
-消息类型type有4种<br/>
-humanMessageAdd -- 问题内容 <br/>
+SSE格式，同/talk<br/>
 <br/>
+消息类型type有4种<br/>
 botMessageAdd -- 回答内容 <br/>
 <br/>
+botMessageDelta -- 回答新增的内容，只有增量模式才有 <br/>
+<br/>
 chatTitleUpdated -- 会话标题，只有新会话才有 <br/>
 <br/>
 talkError -- 回答出错 <br/>
@@ -917,32 +1155,66 @@ async def _(
             }
         ],
     ),
+    streamMode: str = Query(
+        "full", description="full 每次发完整回答，delta 只发新增的文本"
+    ),
+    accept: str | None = Header(None, description="带上mode=delta也是增量模式"),
     user_data: dict = Depends(verify_token),
 ):
     user = user_data["user"]
     messageId = body.messageId
     # price = body.price # todo
-    remain_points = await User.get_remain_points(user)
+    # 重新回答不需要bot信息
+    ctx = await Talk_Context.load(user, "", chatCode)
+    if ctx is None or not ctx.chat_exist:
+        return response_400(2001, "会话不存在")
+    # 不预扣，收到花费时再扣，没收到花费就按bot价格扣
+    reservation = Points_Reservation(user, ctx.chat_bot_handle)
     # # 预检查
-    # if json_response := await reply_pre_check(user, chatCode, remain_points, price):
+    # if json_response := reply_pre_check(ctx, chatCode, price):
     #     return json_response
 
-    bot_name, bot_handle, chat_id, title = await Chat.get_chat_info(user, chatCode)
+    bot_name, bot_handle, chat_id, account = (
+        ctx.chat_bot_name,
+        ctx.chat_bot_handle,
+        ctx.chat_id,
+        ctx.chat_account,
+    )
 
+    try:
+        client = poe.get_client(account)
+    except Exception as e:
+        return response_500(repr(e))
+    try:
+        # 自定义bot的名称查不到，用handle查
+        reservation.price = await client.get_bot_price(bot_handle)
+    except Exception as e:
+        logger.warning(f"获取{bot_handle}所需积分出错 {repr(e)}")
+
+    # 发请求前就开始监听回答
+    queue = client.answer_queues.open(chat_id)
     # 发起重新回答的请求
     try:
-        await poe.client.answer_again(bot_handle, chatCode, messageId)
+        await client.answer_again(bot_handle, chatCode, messageId)
     except Exception as e:
+        client.answer_queues.close(chat_id, queue)
         return response_500(repr(e))
+    # 旧的回答会被替换掉
+    await Message.delete_bot_messages(chatCode, messageId)
 
     # 更新最后对话时间
-    await Chat.update_last_talk_time(user, chatCode)
+    Chat.update_last_talk_time(user, chatCode)
 
     #################
     ### 回答环节
     #################
-    return StreamingResponse(
+    stream = answer_streams.create(
+        user,
+        chatCode,
+        messageId,
         ai_reply(
+            client,
+            queue,
             user,
             chatCode,
             chat_id,
@@ -951,11 +1223,42 @@ async def _(
             messageId,
             {},
             False,
-            remain_points,
+            reservation,
+            use_delta_mode(streamMode, accept),
         ),
-        media_type="text/event-stream",
-        status_code=200,
     )
+    return sse_response(stream.subscribe())
+
+
+@router.get(
+    "/talk/{chatCode}/stream",
+    summary="断线重连，继续拉取进行中的回答",
+    description="带上最后收到的消息id（Last-Event-ID头或lastEventId参数），补发之后的消息；回答结束后保留一段时间。"
+    "本进程没有回答流时（多进程部署时重连到了别的进程）旁听进行中的回答，从当前回答的第一条开始发，花费由发起回答的请求结算",
+    responses={
+        200: {
+            "description": "SSE格式，同/talk",
+            "model": resp_models.BasicRespBody[resp_models.TalkRespBody],
+        }
+    },
+)
+async def _(
+    chatCode: str = Path(description="chat code", examples=["XXXYYY"]),
+    lastEventId: str | None = Query(None, description="最后收到的消息id"),
+    last_event_id: str | None = Header(None, alias="Last-Event-ID"),
+    user_data: dict = Depends(verify_token),
+):
+    user = user_data["user"]
+    stream = answer_streams.get(user, chatCode) or await watch_answer(user, chatCode)
+    if stream is None:
+        return response_400(2001, "没有进行中的回答，请重新拉取会话记录")
+
+    message_id, seq = parse_last_event_id(last_event_id or lastEventId)
+    # 不是这次回答的id就从头发
+    if message_id != stream.message_id:
+        seq = -1
+
+    return sse_response(stream.subscribe(seq))
 
 
 @router.post(
@@ -977,8 +1280,14 @@ async def _(
     ),
     user_data: dict = Depends(verify_token),
 ):
+    user = user_data["user"]
+    if not await Chat.chat_exist(user, chatCode):
+        return response_400(2001, "会话不存在")
+    bot_name, bot_handle, chat_id, title, account = await Chat.get_chat_info(
+        user, chatCode
+    )
     try:
-        await poe.client.talk_stop(chatCode, body.messageId)
+        await poe.get_client(account).talk_stop(chatCode, body.messageId)
     except Exception as e:
         return response_500(repr(e))
 
@@ -1000,12 +1309,17 @@ async def _(
     user_data: dict = Depends(verify_token),
 ):
     user = user_data["user"]
-    bot_name, bot_handle, chat_id, title = await Chat.get_chat_info(user, chatCode)
+    if not await Chat.chat_exist(user, chatCode):
+        return response_400(2001, "会话不存在")
+    bot_name, bot_handle, chat_id, title, account = await Chat.get_chat_info(
+        user, chatCode
+    )
 
     try:
-        data = await poe.client.send_chat_break(chatCode, chat_id)
+        data = await poe.get_client(account).send_chat_break(chatCode, chat_id)
     except Exception as e:
         return response_500(repr(e))
+    await Message.save_messages(user, chatCode, [data])
 
     return response_200(data)
 
@@ -1022,9 +1336,11 @@ async def _(
     user_data: dict = Depends(verify_token),
 ):
     user = user_data["user"]
-    bot_name, bot_handle, chat_id, title = await Chat.get_chat_info(user, chatCode)
+    bot_name, bot_handle, chat_id, title, account = await Chat.get_chat_info(
+        user, chatCode
+    )
     try:
-        await poe.client.delete_chat(chatCode, chat_id)
+        await poe.get_client(account).delete_chat(chatCode, chat_id)
     except Exception as e:
         return response_500(repr(e))
 
@@ -0,0 +1,183 @@
+from asyncio import Event, Task, TimeoutError, create_task, wait_for
+from collections import deque
+from time import monotonic
+from typing import AsyncIterable, AsyncIterator
+
+from ujson import dumps
+from utils.env_util import gv
+from utils.tool_util import logger
+
+
+def encode_sse(data_type: str, data: dict, event_id: str | None = None) -> bytes:
+    """按SSE格式编码一条消息，data还是原来的响应结构"""
+    text = ""
+    if event_id is not None:
+        text += f"id: {event_id}\n"
+    text += f"event: {data_type}\n"
+    text += (
+        "data: "
+        + dumps(
+            {
+                "code": 0,
+                "msg": "success",
+                "data": {"dataType": data_type, "dataContent": data},
+            }
+        )
+        + "\n\n"
+    )
+    return text.encode("utf-8")
+
+
+class _Stream_Event:
+    """缓存的一条消息"""
+
+    __slots__ = ("seq", "data_type", "data")
+
+    def __init__(self, seq: int, data_type: str, data: dict):
+        self.seq = seq
+        self.data_type = data_type
+        self.data = data
+
+
+class Answer_Stream:
+    """
+    一次回答的事件流
+
+    - 回答在后台任务里拉取，前端断开也会拉完（积分照扣、记录照存）
+    - 最近的消息放在环形缓冲里，断线重连时带上Last-Event-ID补发
+    - 事件id为 {messageId}-{序号}
+    """
+
+    def __init__(self, message_id: int, maxlen: int):
+        self.message_id = message_id
+        self.events: deque[_Stream_Event] = deque(maxlen=maxlen)
+        self.next_seq = 0
+        # 各条回答的最新完整内容，缓冲被覆盖时用来补发
+        self.snapshots: dict[int, dict] = {}
+        self.finished = False
+        self.finish_time = 0.0
+        self.task: Task | None = None
+        self._changed = Event()
+
+    def start(self, source: AsyncIterable[tuple[str, dict]]):
+        """在后台拉取回答"""
+        self.task = create_task(self._run(source))
+
+    async def _run(self, source: AsyncIterable[tuple[str, dict]]):
+        try:
+            async for data_type, data in source:
+                self.publish(data_type, data)
+        except Exception as e:
+            logger.error(f"回答{self.message_id}出错: {repr(e)}")
+            self.publish("talkError", {"errMsg": repr(e)})
+        finally:
+            self.finished = True
+            self.finish_time = monotonic()
+            self._notify()
+
+    def publish(self, data_type: str, data: dict):
+        """放入一条消息"""
+        self.events.append(_Stream_Event(self.next_seq, data_type, data))
+        self.next_seq += 1
+
+        if data_type == "botMessageAdd":
+            self.snapshots[data["messageId"]] = dict(data)
+        elif data_type == "botMessageDelta" and (
+            snapshot := self.snapshots.get(data["messageId"])
+        ):
+            snapshot["text"] = snapshot["text"][: data["offset"]] + data["delta"]
+            snapshot["state"] = data["state"]
+            snapshot["attachments"] = data["attachments"]
+
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = Event()
+
+    def event_id(self, seq: int) -> str:
+        return f"{self.message_id}-{seq}"
+
+    async def subscribe(self, last_seq: int = -1) -> AsyncIterator[bytes]:
+        """
+        输出SSE数据，先补发last_seq之后缓存的消息，再等新消息，空闲时发心跳
+
+        参数:
+        - last_seq  前端收到的最后一条消息序号，-1为从头开始
+        """
+        yield b"retry: 3000\n\n"
+
+        # 要补发的已经被覆盖了，先发一次完整回答
+        if self.events and last_seq + 1 < self.events[0].seq:
+            for snapshot in self.snapshots.values():
+                yield encode_sse("botMessageAdd", snapshot)
+
+        while True:
+            changed = self._changed
+            for event in [event for event in self.events if event.seq > last_seq]:
+                yield encode_sse(event.data_type, event.data, self.event_id(event.seq))
+                last_seq = event.seq
+
+            if self.finished:
+                return
+
+            try:
+                await wait_for(changed.wait(), gv.SSE_HEARTBEAT)
+            except TimeoutError:
+                # 心跳，避免代理断开空闲连接
+                yield b": ping\n\n"
+
+
+class Answer_Stream_Registry:
+    """
+    进行中的回答流，按用户和会话登记，回答结束后保留一段时间用于断线重连
+
+    只在发起回答的进程里，多进程部署时重连到别的进程就旁听回答（见/talk/{chatCode}/stream）
+    """
+
+    def __init__(self, maxlen: int = 512, retention: int = 120):
+        self.maxlen = maxlen
+        self.retention = retention
+        self.streams: dict[tuple[str, str], Answer_Stream] = {}
+
+    def create(
+        self,
+        user: str,
+        chat_code: str,
+        message_id: int,
+        source: AsyncIterable[tuple[str, dict]],
+    ) -> Answer_Stream:
+        """创建回答流并开始在后台拉取回答"""
+        self.evict()
+        stream = self.streams[(user, chat_code)] = Answer_Stream(
+            message_id, self.maxlen
+        )
+        stream.start(source)
+        return stream
+
+    def get(self, user: str, chat_code: str) -> Answer_Stream | None:
+        self.evict()
+        return self.streams.get((user, chat_code))
+
+    def evict(self):
+        """清理结束太久的回答流"""
+        now = monotonic()
+        expired = [
+            key
+            for key, stream in self.streams.items()
+            if stream.finished and now - stream.finish_time > self.retention
+        ]
+        for key in expired:
+            del self.streams[key]
+
+
+def parse_last_event_id(last_event_id: str | None) -> tuple[int, int]:
+    """解析Last-Event-ID，返回(messageId, 序号)，解析不了返回(0, -1)"""
+    try:
+        message_id, seq = (last_event_id or "").split("-")
+        return int(message_id), int(seq)
+    except ValueError:
+        return 0, -1
+
+
+answer_streams = Answer_Stream_Registry()
@@ -0,0 +1,166 @@
+from database.chat_db import Chat
+from database.message_db import Message
+from utils.cache_util import TTL_LRU_Cache
+from utils.env_util import gv
+
+from .poe_lib.client import Poe_Client
+
+# 每页消息数量，和Poe一致
+PAGE_SIZE = 25
+# 同步缺失的消息时最多往前拉多少页，还没接上本地记录就从拉到的地方重新开始
+MAX_SYNC_PAGES = 8
+
+# 第一页附带的bot信息，key为bot handle
+bot_info_cache = TTL_LRU_Cache(1024, gv.PRICE_CACHE_TTL)
+
+
+async def get_chat_history(
+    client: Poe_Client,
+    user: str,
+    chat_code: str,
+    chat_id: int,
+    bot_handle: str,
+    cursor: str,
+) -> dict:
+    """
+    获取聊天记录
+
+    - 本地同步过且没有缺消息（回答都存下来了）就直接用本地的，包括第一页
+    - 第一页本地缺了消息就从Poe拉最新的，往前拉到缺失的消息之前为止（增量同步）
+    - 之后的页，本地记录连续且够一页就直接用本地的，否则从Poe拉取并保存
+
+    参数:
+    - client  会话所属的Poe账号
+    - user
+    - chat_code
+    - chat_id
+    - bot_handle  第一页要带上bot信息
+    - cursor  翻页指针，初始为0，之后是上一页第一条消息的id
+    """
+    history_start, history_complete, history_dirty = await Chat.get_history_range(
+        user, chat_code
+    )
+
+    if cursor == "0":
+        if history_start and not history_dirty:
+            chat_info = await _local_page(
+                chat_code,
+                await Message.get_last_message_id(chat_code) + 1,
+                history_start,
+                history_complete,
+            )
+        else:
+            chat_info = await _sync_latest(
+                client,
+                user,
+                chat_code,
+                chat_id,
+                history_start,
+                history_complete,
+                history_dirty,
+            )
+        chat_info["botInfo"] = await _get_bot_info(client, bot_handle, chat_info)
+        return chat_info
+
+    try:
+        before_id = int(cursor)
+    except ValueError:
+        before_id = 0
+    if history_start and before_id > history_start:
+        count = await Message.count_between(chat_code, history_start, before_id)
+        if count >= PAGE_SIZE or history_complete:
+            return await _local_page(
+                chat_code, before_id, history_start, history_complete
+            )
+
+    chat_info = await client.get_chat_info(chat_code, chat_id, cursor)
+    nodes: list[dict] = chat_info["historyNodes"]
+    has_previous = chat_info["pageInfo"]["hasPreviousPage"]
+    if not nodes:
+        if not has_previous:
+            await Chat.update_history_range(user, chat_code, history_start, 1)
+        return chat_info
+
+    await Message.save_messages(user, chat_code, nodes)
+    oldest_id = nodes[0]["messageId"]
+    # 拉回来的这页和本地连续的记录接上了就延长，否则从这页重新开始
+    if not history_start or before_id < history_start or oldest_id < history_start:
+        history_start, history_complete = oldest_id, int(not has_previous)
+    await Chat.update_history_range(user, chat_code, history_start, history_complete)
+
+    return chat_info
+
+
+async def _sync_latest(
+    client: Poe_Client,
+    user: str,
+    chat_code: str,
+    chat_id: int,
+    history_start: int,
+    history_complete: int,
+    history_dirty: int,
+) -> dict:
+    """
+    从Poe拉最新的消息并保存，返回第一页
+
+    本地有连续记录时往前拉到缺失的消息之前为止，没有就只拉第一页
+    """
+    first_page = chat_info = await client.get_chat_info(chat_code, chat_id, "0")
+    if not first_page["historyNodes"]:
+        await Chat.update_history_range(user, chat_code, history_start, 1, True)
+        return first_page
+
+    for page in range(MAX_SYNC_PAGES):
+        if page:
+            chat_info = await client.get_chat_info(
+                chat_code, chat_id, chat_info["pageInfo"]["startCursor"]
+            )
+        nodes: list[dict] = chat_info["historyNodes"]
+        has_previous = chat_info["pageInfo"]["hasPreviousPage"]
+        if nodes:
+            await Message.save_messages(user, chat_code, nodes)
+        oldest_id = nodes[0]["messageId"] if nodes else history_start
+
+        # 拉到第一条消息了
+        if not has_previous:
+            history_start, history_complete = oldest_id, 1
+            break
+        # 缺失的都拉回来了，接上本地的连续记录
+        if history_start and oldest_id < history_dirty:
+            break
+        # 本地没有连续记录，只拉第一页；或者拉了太多页还没接上，中间缺的以后翻页再拉
+        if not history_start or page == MAX_SYNC_PAGES - 1:
+            history_start, history_complete = oldest_id, 0
+            break
+
+    await Chat.update_history_range(
+        user, chat_code, history_start, history_complete, True
+    )
+    return first_page
+
+
+async def _get_bot_info(client: Poe_Client, bot_handle: str, chat_info: dict) -> dict:
+    """第一页的bot信息，Poe返回了就更新缓存，否则用缓存，都没有再查"""
+    if bot_info := chat_info.get("botInfo"):
+        bot_info_cache.set(bot_handle, bot_info)
+    elif (bot_info := bot_info_cache.get(bot_handle)) is None:
+        bot_info = await client.get_bot_info(bot_handle)
+        bot_info_cache.set(bot_handle, bot_info)
+    # 调用方会按用户修改bot名称，不能改到缓存里的
+    return dict(bot_info)
+
+
+async def _local_page(
+    chat_code: str, before_id: int, history_start: int, history_complete: int
+) -> dict:
+    """从本地记录取一页"""
+    nodes = await Message.get_history(chat_code, before_id, PAGE_SIZE)
+    start_id = nodes[0]["messageId"] if nodes else history_start
+    return {
+        "botInfo": {},
+        "historyNodes": nodes,
+        "pageInfo": {
+            "hasPreviousPage": start_id > history_start or not history_complete,
+            "startCursor": str(start_id),
+        },
+    }
@@ -0,0 +1,118 @@
+from asyncio import Queue, QueueFull, Task, create_task, to_thread
+from os import listdir, makedirs, path, remove
+from random import random
+from time import strftime
+
+from ujson import dump
+from utils.tool_util import logger
+
+from .event_broker import broker
+
+
+class Debug_Capture:
+    """
+    调试抓包，按采样率把请求和响应数据写到目录里
+
+    - 默认关闭，管理员接口运行时开关
+    - 只是放进队列，在后台任务里写文件，不阻塞事件循环，队列满了就丢弃
+    - 一条数据一个文件，超过max_files就删最旧的
+    - 多进程部署时开关会通知其他进程，统计数据只是本进程的
+    """
+
+    def __init__(
+        self, directory: str = "debug_capture", max_files: int = 200, maxsize: int = 100
+    ):
+        self.directory = directory
+        self.max_files = max_files
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.queue: Queue[tuple[str, dict]] = Queue(maxsize)
+        self.writer_task: Task | None = None
+        self.seq = 0
+        self.written_times = 0
+        self.dropped_times = 0
+
+    def configure(
+        self, enabled: bool, sample_rate: float, max_files: int, notify: bool = True
+    ):
+        """
+        修改开关和采样率
+
+        参数:
+        - notify  是否通知其他进程，收到其他进程的通知时为False
+        """
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.max_files = max_files
+        if notify:
+            broker.broadcast(
+                "debugCapture",
+                {"enabled": enabled, "sampleRate": sample_rate, "maxFiles": max_files},
+            )
+
+    def capture(self, name: str, data: dict):
+        """
+        抓一条数据，没开启或没抽中就忽略
+
+        参数:
+        - name  数据名称，会放进文件名
+        - data  要保存的数据，放进来之后不要再修改
+        """
+        if not self.enabled or random() >= self.sample_rate:
+            return
+
+        if self.writer_task is None or self.writer_task.done():
+            self.writer_task = create_task(self._writer())
+        try:
+            self.queue.put_nowait((name, data))
+        except QueueFull:
+            self.dropped_times += 1
+
+    async def _writer(self):
+        while True:
+            name, data = await self.queue.get()
+            self.seq += 1
+            try:
+                await to_thread(self._write, f"{self.seq:06d}_{name}", data)
+                self.written_times += 1
+            except Exception as e:
+                logger.warning(f"保存调试数据出错 {repr(e)}")
+
+    def _write(self, name: str, data: dict):
+        makedirs(self.directory, exist_ok=True)
+        file_path = path.join(
+            self.directory, f"{strftime('%Y%m%d_%H%M%S')}_{name}.json"
+        )
+        with open(file_path, "w", encoding="utf-8") as w:
+            dump(data, w, ensure_ascii=False)
+
+        # 文件名以时间开头，排序后前面的就是最旧的
+        files = sorted(listdir(self.directory))
+        for file in files[: max(len(files) - self.max_files, 0)]:
+            remove(path.join(self.directory, file))
+
+    async def close(self):
+        if self.writer_task:
+            self.writer_task.cancel()
+            self.writer_task = None
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "sampleRate": self.sample_rate,
+            "maxFiles": self.max_files,
+            "pending": self.queue.qsize(),
+            "writtenTimes": self.written_times,
+            "droppedTimes": self.dropped_times,
+        }
+
+
+debug_capture = Debug_Capture()
+
+
+broker.on(
+    "debugCapture",
+    lambda data: debug_capture.configure(
+        data["enabled"], data["sampleRate"], data["maxFiles"], notify=False
+    ),
+)
@@ -0,0 +1,326 @@
+from asyncio import (
+    CancelledError,
+    StreamReader,
+    StreamWriter,
+    Task,
+    create_task,
+    open_unix_connection,
+    sleep,
+    start_unix_server,
+)
+from inspect import isawaitable
+from os import O_CREAT, O_RDWR, getpid, path, remove
+from os import close as close_fd
+from os import open as open_fd
+from typing import Callable
+
+from database.user_db import User, auth_cache, auth_hooks
+from ujson import dumps, loads
+from utils.env_util import gv
+from utils.tool_util import logger
+
+from .poe_lib.client import Poe_Client
+from .poe_lib.type import BotMessageAdd, ChatTitleUpdated, PriceCost
+
+try:
+    from fcntl import LOCK_EX, LOCK_NB, flock
+except ImportError:
+    # windows不支持多进程部署
+    flock = None
+
+# 订阅者写缓冲超过这么多字节就断开，避免拖垮owner
+MAX_WRITE_BUFFER = 4 * 1024 * 1024
+# 和owner断开后多久重连（秒）
+RECONNECT_DELAY = 1
+
+
+def encode_event(account: str, chat_id: int, data) -> bytes:
+    """回答事件编码成一行json"""
+    if isinstance(data, BotMessageAdd):
+        content = {
+            "state": data.state,
+            "messageStateText": data.messageStateText,
+            "messageId": data.messageId,
+            "creationTime": data.creationTime,
+            "text": data.text,
+            "attachments": data.attachments,
+        }
+    elif isinstance(data, PriceCost):
+        content = {"price": data.price, "messageId": data.messageId}
+    else:
+        content = data.model_dump()
+    return encode_message(
+        {
+            "op": "event",
+            "account": account,
+            "chatId": chat_id,
+            "type": type(data).__name__,
+            "data": content,
+        }
+    )
+
+
+def encode_message(message: dict) -> bytes:
+    """一条消息一行json"""
+    return (dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def decode_event(event_type: str, content: dict):
+    if event_type == "BotMessageAdd":
+        return BotMessageAdd(**content)
+    if event_type == "PriceCost":
+        return PriceCost(**content)
+    return ChatTitleUpdated(**content)
+
+
+class Event_Broker:
+    """
+    多进程部署时的回答事件中转
+
+    - 抢到锁文件的进程是channel owner，只有它连Poe的ws，
+      把解析好的回答事件通过unix socket发给订阅了该会话的其他进程
+    - 其他进程不连ws，有请求开始拉取回答时按会话向owner订阅
+    - owner退出后，其他进程重新抢锁，抢到的接管ws
+    - 凭证缓存失效、Poe账号变更等要所有进程一致的状态用broadcast通知，
+      订阅者发给owner，owner转发给其他订阅者，各进程按类型调用on注册的处理函数
+    - 单进程时不启用，所有进程都当作owner
+    """
+
+    def __init__(self, socket_path: str = "eop_broker.sock"):
+        self.socket_path = socket_path
+        self.lock_path = socket_path + ".lock"
+        self.enabled = False
+        self.is_owner = True
+        # 账号池，由poe_client绑定
+        self.clients: dict[str, Poe_Client] = {}
+        self._lock_fd: int | None = None
+        self._task: Task | None = None
+        self._server = None
+        # owner: 各订阅者订阅的(账号, 会话id)
+        self._subscribers: dict[StreamWriter, set[tuple[str, int]]] = {}
+        # 订阅者: 到owner的连接
+        self._writer: StreamWriter | None = None
+        # 广播类型 -> 处理函数，可以是协程函数
+        self.handlers: dict[str, Callable[[dict], object]] = {}
+        self.forwarded_times = 0
+        self.received_times = 0
+        self.broadcast_times = 0
+
+    async def start(self):
+        """启用多进程模式，决定当owner还是订阅者"""
+        if flock is None:
+            raise Exception("多进程部署需要unix系统")
+
+        self.enabled = True
+        auth_hooks.append(lambda user: self.broadcast("auth", {"user": user}))
+        if self._try_lock():
+            await self._become_owner()
+        else:
+            self.is_owner = False
+            self._task = create_task(self._follow())
+
+    def _try_lock(self) -> bool:
+        fd = open_fd(self.lock_path, O_RDWR | O_CREAT)
+        try:
+            flock(fd, LOCK_EX | LOCK_NB)
+        except OSError:
+            close_fd(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    async def _become_owner(self):
+        self.is_owner = True
+        if path.exists(self.socket_path):
+            remove(self.socket_path)
+        self._server = await start_unix_server(self._serve, self.socket_path)
+        for account, client in self.clients.items():
+            self._attach_owner(account, client)
+            if client.login_success and not client.ws_enabled:
+                client.enable_ws()
+        logger.info(f"进程{getpid()}成为channel owner")
+
+    def attach(self, account: str, client: Poe_Client):
+        """设置Poe账号的事件转发方式，登陆前调用"""
+        if not self.enabled:
+            return
+        if self.is_owner:
+            self._attach_owner(account, client)
+        else:
+            client.ws_enabled = False
+            client.answer_queues.listen_hook = (
+                lambda chat_id, listening: self._send_subscribe(
+                    account, chat_id, listening
+                )
+            )
+
+    def on(self, kind: str, handler: Callable[[dict], object]):
+        """注册广播的处理函数"""
+        self.handlers[kind] = handler
+
+    def broadcast(self, kind: str, data: dict):
+        """通知其他进程，单进程时什么都不做"""
+        if not self.enabled:
+            return
+        line = encode_message({"op": "broadcast", "kind": kind, "data": data})
+        if self.is_owner:
+            self._relay(line)
+        elif self._writer:
+            self._writer.write(line)
+        else:
+            logger.warning(f"和channel owner断开，广播{kind}没发出去")
+        self.broadcast_times += 1
+
+    def _dispatch(self, kind: str, data: dict):
+        """处理收到的广播"""
+        if (handler := self.handlers.get(kind)) is None:
+            return
+        try:
+            result = handler(data)
+            if isawaitable(result):
+                create_task(result)
+        except Exception as e:
+            logger.error(f"处理广播{kind}出错 {repr(e)}")
+
+    def _attach_owner(self, account: str, client: Poe_Client):
+        client.answer_queues.listen_hook = None
+        client.answer_queues.publish_hook = lambda chat_id, data: self._forward(
+            account, chat_id, data
+        )
+
+    ###############
+    ### owner
+    ###############
+    async def _serve(self, reader: StreamReader, writer: StreamWriter):
+        subscriptions: set[tuple[str, int]] = set()
+        self._subscribers[writer] = subscriptions
+        try:
+            while line := await reader.readline():
+                message = loads(line)
+                if message["op"] == "broadcast":
+                    self._dispatch(message["kind"], message["data"])
+                    self._relay(line, writer)
+                    continue
+
+                key = (message["account"], message["chatId"])
+                if message["op"] == "unsub":
+                    subscriptions.discard(key)
+                    continue
+
+                subscriptions.add(key)
+                # 补发订阅前就收到的数据，新会话拿到chatId前回答可能已经开始了，
+                # 断线重连到别的进程时要从当前回答开头旁听
+                if client := self.clients.get(key[0]):
+                    for data in client.answer_queues.replay_items(key[1]):
+                        writer.write(encode_event(key[0], key[1], data))
+        except (ConnectionError, CancelledError):
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"订阅者发来的数据有误，断开连接 {repr(e)}")
+        finally:
+            self._subscribers.pop(writer, None)
+            writer.close()
+
+    def _relay(self, line: bytes, sender: StreamWriter | None = None):
+        """广播发给除了发送者以外的订阅者"""
+        for writer in list(self._subscribers):
+            if writer is not sender:
+                writer.write(line)
+
+    def _forward(self, account: str, chat_id: int, data):
+        line = b""
+        for writer, subscriptions in list(self._subscribers.items()):
+            if (account, chat_id) not in subscriptions:
+                continue
+            if writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER:
+                logger.warning("订阅者太慢，断开连接")
+                self._subscribers.pop(writer, None)
+                writer.close()
+                continue
+            line = line or encode_event(account, chat_id, data)
+            writer.write(line)
+            self.forwarded_times += 1
+
+    ###############
+    ### 订阅者
+    ###############
+    async def _follow(self):
+        while True:
+            try:
+                reader, writer = await open_unix_connection(self.socket_path)
+            except OSError:
+                # owner不在了就抢锁接管
+                if self._try_lock():
+                    await self._become_owner()
+                    return
+                await sleep(RECONNECT_DELAY)
+                continue
+
+            self._writer = writer
+            # 断开期间可能漏了失效通知
+            auth_cache.clear()
+            # 重连后重新订阅正在监听的会话
+            for account, client in self.clients.items():
+                for chat_id, log in client.answer_queues.logs.items():
+                    if log.listeners:
+                        self._send_subscribe(account, chat_id, True)
+            try:
+                while line := await reader.readline():
+                    message = loads(line)
+                    if message["op"] == "broadcast":
+                        self._dispatch(message["kind"], message["data"])
+                    elif client := self.clients.get(message["account"]):
+                        client.answer_queues.publish(
+                            message["chatId"],
+                            decode_event(message["type"], message["data"]),
+                        )
+                        self.received_times += 1
+            except ConnectionError:
+                pass
+            except (ValueError, KeyError, TypeError) as e:
+                # 数据有误也重连，不能让这个任务退出，否则再也收不到回答
+                logger.warning(f"channel owner发来的数据有误 {repr(e)}")
+            finally:
+                self._writer = None
+                writer.close()
+            logger.warning("和channel owner断开，重连中")
+            await sleep(RECONNECT_DELAY)
+
+    def _send_subscribe(self, account: str, chat_id: int, listening: bool):
+        if self._writer is None:
+            return
+        self._writer.write(
+            encode_message(
+                {
+                    "op": "sub" if listening else "unsub",
+                    "account": account,
+                    "chatId": chat_id,
+                }
+            )
+        )
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+        if self._server:
+            self._server.close()
+        for writer in list(self._subscribers):
+            writer.close()
+        if self._lock_fd is not None:
+            close_fd(self._lock_fd)
+            self._lock_fd = None
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "isOwner": self.is_owner,
+            "pid": getpid(),
+            "subscribers": len(self._subscribers),
+            "forwardedTimes": self.forwarded_times,
+            "receivedTimes": self.received_times,
+            "broadcastTimes": self.broadcast_times,
+        }
+
+
+broker = Event_Broker(gv.BROKER_SOCKET)
+broker.on("auth", lambda data: User.clear_auth_cache(data["user"], notify=False))
@@ -25,7 +25,7 @@ async def verify_token(
     token = credentials.credentials
     try:
         jwt_data = jwtDecode(token, gv.SECRET_KEY, algorithms=[gv.ALGORITHM])
-        if not await User.auth_user(jwt_data["user"], jwt_data["passwd"]):
+        if not await User.get_auth(jwt_data["user"], jwt_data["passwd"]):
             raise AuthFailed("凭证无效")
 
         return jwt_data
@@ -40,10 +40,9 @@ async def verify_admin(
     token = credentials.credentials
     try:
         jwt_data = jwtDecode(token, gv.SECRET_KEY, algorithms=[gv.ALGORITHM])
-        if not await User.auth_user(jwt_data["user"], jwt_data["passwd"]):
-            raise AuthFailed("凭证无效")
-
-        if not await User.is_admin(jwt_data["user"]):
+        auth = await User.get_auth(jwt_data["user"], jwt_data["passwd"])
+        # 是否为管理员
+        if not auth or not auth[0]:
             raise AuthFailed("凭证无效")
 
         return jwt_data
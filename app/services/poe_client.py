@@ -1,25 +1,75 @@
-from asyncio import create_task
+from asyncio import gather
 from time import time
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from database.account_db import DEFAULT_ACCOUNT, Account
 from database.config_db import Config
+from database.points_db import Points_Ledger
 from database.user_db import User
+from utils.cache_util import SWR_Cache, TTL_LRU_Cache
+from utils.env_util import gv
 from utils.tool_util import logger, user_action
 
+from .event_broker import broker
 from .poe_lib.client import Poe_Client
 
 
 class Poe:
-    client = Poe_Client("", "", "")
+    """
+    Poe账号池
+
+    - 会话固定使用创建它的账号
+    - 新会话按负载最低或积分最多分配账号
+    - 不涉及会话的请求（探索、搜索、bot信息等）用默认账号
+    """
+
+    def __init__(self):
+        self.clients: dict[str, Poe_Client] = {DEFAULT_ACCOUNT: Poe_Client("", "", "")}
+
+    @property
+    def client(self) -> Poe_Client:
+        """默认账号"""
+        return self.clients[DEFAULT_ACCOUNT]
+
+    def get_client(self, account: str) -> Poe_Client:
+        """获取指定账号"""
+        try:
+            return self.clients[account]
+        except KeyError:
+            raise Exception(f"Poe账号【{account}】不存在")
+
+    def pick_account(self) -> str:
+        """给新会话分配账号"""
+        candidates = [
+            (name, client)
+            for name, client in self.clients.items()
+            if client.login_success
+        ]
+        if not candidates:
+            return DEFAULT_ACCOUNT
+
+        if gv.ACCOUNT_ROUTING == "points":
+            # 积分最多优先
+            name, _ = max(candidates, key=lambda x: x[1].remain_points)
+        else:
+            # 负载最低优先，一样就积分多的优先
+            name, _ = min(
+                candidates, key=lambda x: (x[1].get_load(), -x[1].remain_points)
+            )
+        return name
 
 
 poe = Poe()
+broker.clients = poe.clients
 scheduler = AsyncIOScheduler(timezone="Asia/Shanghai")
 
 
 @scheduler.scheduled_job("cron", hour=0, minute=0, second=10)
 async def _():
     """每日0点10秒时检查重置时间"""
+    # 多进程部署时只在一个进程里执行
+    if not broker.is_owner:
+        return
     now = int(time() * 1000)
     _users = await User.list_user()
     for _user in _users:
@@ -49,33 +99,167 @@ async def _():
     # except Exception as e:
     #     logger.error(f"更新hash出错 {repr(e)}")
 
-    # 取消之前的ws任务
-    if poe.client.ws_client_task:
-        poe.client.ws_client_task.cancel()
-    # 创建ws任务
-    poe.client.ws_client_task = create_task(poe.client.connect_to_channel())
+    clients = [client for client in poe.clients.values() if client.login_success]
+    for client in clients:
+        # 积分缓存都标记为快过期，常用的bot下次用到时在后台刷新
+        client.invalidate_bot_prices()
 
-    # 清空积分缓存
-    poe.client.bot_price_cache.clear()
+    # 先连新的ws channel再断开旧的
+    results = await gather(
+        *[client.rotate_channel() for client in clients], return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"轮换ws channel出错 {repr(result)}")
+
+
+@scheduler.scheduled_job("interval", seconds=30)
+async def _():
+    """清理没人认领和长时间没动静的回答队列"""
+    for client in poe.clients.values():
+        client.answer_queues.evict_idle()
+
+
+@scheduler.scheduled_job("interval", hours=1)
+async def _():
+    """每小时退回预扣太久还没结算的积分，进程异常退出时进行中的回答会丢下预扣"""
+    # 多进程部署时只在一个进程里执行
+    if not broker.is_owner:
+        return
+    await Points_Ledger.release_stale()
 
 
-# 每日5点时清理队列内存
-@scheduler.scheduled_job("cron", hour=5)
+@scheduler.scheduled_job("interval", minutes=10)
 async def _():
-    if poe.client.ws_client_task is None:
-        poe.client.ws_data_queue.clear()
+    """每10分钟刷新账号积分余额，用于分配账号"""
+    for name, client in poe.clients.items():
+        if not client.login_success:
+            continue
+        try:
+            await client.get_account_info()
+        except Exception as e:
+            logger.warning(f"刷新账号【{name}】积分出错 {repr(e)}")
+
+
+async def login_account(
+    name: str, p_b: str, p_lat: str, formkey: str, proxy: str | None
+) -> str:
+    client = Poe_Client(
+        p_b,
+        p_lat,
+        formkey,
+        proxy,
+        gv.SEND_CONCURRENCY,
+        gv.ANSWER_TIMEOUT,
+        gv.PRICE_CACHE_TTL,
+    )
+    broker.attach(name, client)
+    try:
+        await client.login()
+    except Exception as e:
+        await client.close()
+        err_msg = f"账号【{name}】执行登陆流程出错，" + repr(e)
+        logger.error(err_msg)
+        return err_msg
+
+    # 关闭旧的ws任务和连接池
+    if name in poe.clients:
+        await poe.clients[name].close()
+    poe.clients[name] = client
+    return ""
+
+
+# 探索和搜索bot的结果，所有用户共用，key为(类型, 分类或关键字, 翻页指针)
+bot_list_cache = SWR_Cache(1024, gv.BOT_LIST_CACHE_TTL, gv.BOT_LIST_CACHE_TTL * 4)
+# 探索bot的分类列表，变化很少，单独缓存更久
+category_cache = TTL_LRU_Cache(1, gv.CATEGORY_CACHE_TTL)
+# Poe没返回分类列表时空列表缓存多久（秒），不用每次都重新拉
+EMPTY_CATEGORY_TTL = 60
+
+
+async def explore_bot(category: str, cursor: str) -> dict:
+    """探索bot列表，带缓存"""
+
+    async def _load() -> dict:
+        data = await poe.client.explore_bot(category, cursor)
+        # 只有第一页带分类列表，空的不能覆盖已缓存的
+        if cursor == "0" and (
+            data["categoryList"] or category_cache.ttl_left("categoryList") is None
+        ):
+            category_cache.set(
+                "categoryList",
+                data["categoryList"],
+                None if data["categoryList"] else EMPTY_CATEGORY_TTL,
+            )
+        return {"bots": data["bots"], "pageInfo": data["pageInfo"]}
+
+    key = ("explore", category, cursor)
+    data = await bot_list_cache.get(key, _load)
+    if cursor != "0":
+        return {"categoryList": [], **data}
+
+    # 分类列表过期了，第一页要重新拉一次
+    if (category_list := category_cache.get("categoryList")) is None:
+        bot_list_cache.pop(key)
+        data = await bot_list_cache.get(key, _load)
+        category_list = category_cache.get("categoryList", [])
+    return {"categoryList": category_list, **data}
+
+
+async def search_bot(key_word: str, cursor: str) -> dict:
+    """搜索bot，带缓存"""
+    return await bot_list_cache.get(
+        ("search", key_word, cursor), lambda: poe.client.search_bot(key_word, cursor)
+    )
+
+
+async def get_proxy() -> str | None:
+    p_b, p_lat, formkey, proxy = await Config.get_setting()
+    return proxy if proxy else None
 
 
 async def login_poe() -> str:
+    """登陆默认账号"""
     p_b, p_lat, formkey, proxy = await Config.get_setting()
     if proxy:
         logger.info(f"使用代理连接Poe {proxy}")
     else:
         proxy = None
-    try:
-        poe.client = await Poe_Client(p_b, p_lat, formkey, proxy).login()
-        return ""
-    except Exception as e:
-        err_msg = "执行登陆流程出错，" + repr(e)
-        logger.error(err_msg)
-        return err_msg
+    return await login_account(DEFAULT_ACCOUNT, p_b, p_lat, formkey, proxy)
+
+
+async def login_pool():
+    """登陆账号池中的所有账号"""
+    # 先登陆默认账号，hashes文件不存在时只拉取一次
+    await login_poe()
+    proxy = await get_proxy()
+    await gather(
+        *[
+            login_account(name, p_b, p_lat, formkey, proxy)
+            for name, p_b, p_lat, formkey in await Account.list_account()
+        ]
+    )
+
+
+async def remove_account(name: str):
+    """从账号池移除账号"""
+    if client := poe.clients.pop(name, None):
+        await client.close()
+
+
+async def reload_account(name: str):
+    """按数据库重新登陆或移除账号，多进程部署时其他进程改了账号后调用"""
+    if name == DEFAULT_ACCOUNT:
+        await login_poe()
+    elif account := await Account.get_account(name):
+        await login_account(name, *account, await get_proxy())
+    else:
+        await remove_account(name)
+
+
+broker.on("account", lambda data: reload_account(data["name"]))
+
+
+async def close_poe():
+    for client in poe.clients.values():
+        await client.close()
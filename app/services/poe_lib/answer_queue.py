@@ -0,0 +1,279 @@
+from asyncio import Future, TimeoutError, get_running_loop, wait_for
+from collections import deque
+from time import monotonic
+from typing import Callable
+
+from .type import BotMessageAdd
+
+
+class Answer_Event_Log:
+    """
+    单个会话的回答事件日志，所有监听者共用，每条事件带递增序号
+
+    - 有长度上限，满了优先丢弃最早的未完成回答
+    - 同一条消息连续的未完成回答只保留最新的（文本是累积的，旧的没用）
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        # (序号, 数据)
+        self.items: deque[tuple[int, object]] = deque()
+        self.next_seq = 0
+        self.listeners = 0
+        self.last_active = monotonic()
+        self.coalesced_times = 0
+        self.dropped_times = 0
+        self._waiters: list[Future] = []
+
+    def put(self, data):
+        self.last_active = monotonic()
+
+        if (
+            isinstance(data, BotMessageAdd)
+            and data.state == "incomplete"
+            and self.items
+            and isinstance(last := self.items[-1][1], BotMessageAdd)
+            and last.state == "incomplete"
+            and last.messageId == data.messageId
+        ):
+            # 换成新序号，已经读过旧的监听者也能读到新的
+            self.items.pop()
+            self.coalesced_times += 1
+        elif len(self.items) >= self.maxsize:
+            for index, (_, item) in enumerate(self.items):
+                if isinstance(item, BotMessageAdd) and item.state == "incomplete":
+                    del self.items[index]
+                    break
+            else:
+                self.items.popleft()
+            self.dropped_times += 1
+
+        self.items.append((self.next_seq, data))
+        self.next_seq += 1
+
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def read(self, cursor: int) -> tuple[int, object] | None:
+        """读取序号不小于cursor的第一条事件，没有返回None"""
+        found = None
+        # 监听者一般只落后几条，从后往前找
+        for item in reversed(self.items):
+            if item[0] < cursor:
+                break
+            found = item
+        return found
+
+    def answer_start(self) -> int:
+        """当前回答（最后一条回答消息）第一条事件的序号，没有回答返回next_seq"""
+        start = self.next_seq
+        message_id = None
+        for seq, item in reversed(self.items):
+            if not isinstance(item, BotMessageAdd):
+                continue
+            if message_id is None:
+                message_id = item.messageId
+            elif item.messageId != message_id:
+                break
+            start = seq
+        return start
+
+    async def wait(self):
+        waiter = get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def qsize(self) -> int:
+        return len(self.items)
+
+    def text_size(self) -> int:
+        return sum(
+            len(item.text)
+            for _, item in self.items
+            if isinstance(item, BotMessageAdd)
+        )
+
+
+class Answer_Queue:
+    """
+    一个监听者的回答队列，就是事件日志上的读取位置
+
+    多个监听者（多个标签页、重新回答时还在拉取的旧回答）各自读完整的事件
+    """
+
+    def __init__(self, log: Answer_Event_Log, cursor: int):
+        self.log = log
+        self.cursor = cursor
+
+    async def get(self):
+        while (item := self.log.read(self.cursor)) is None:
+            await self.log.wait()
+
+        self.log.last_active = monotonic()
+        self.cursor = item[0] + 1
+        return item[1]
+
+    async def peek(self, timeout: float):
+        """等到有可读的事件，返回但不取走，超时返回None"""
+        try:
+            while (item := self.log.read(self.cursor)) is None:
+                await wait_for(self.log.wait(), timeout)
+        except TimeoutError:
+            return None
+        return item[1]
+
+
+class Answer_Queue_Registry:
+    """
+    会话回答事件的发布订阅
+
+    - 拉取回答的一方（get_answer）订阅会话，拉取结束后取消，没人订阅了就删除事件日志
+    - 还没人订阅的会话（刚发出问题，还没开始拉取回答）先暂存到小日志，第一个订阅者认领，
+      超时没人认领就清掉
+    - 后来的订阅者默认只读新事件，旁听进行中的回答（/talk/{chatCode}/stream
+      重连时本进程没有回答流）用replay从当前回答的第一条开始读
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        pending_maxsize: int = 32,
+        pending_ttl: int = 30,
+        idle_ttl: int = 600,
+    ):
+        self.maxsize = maxsize
+        self.pending_maxsize = pending_maxsize
+        self.pending_ttl = pending_ttl
+        self.idle_ttl = idle_ttl
+        self.logs: dict[int, Answer_Event_Log] = {}
+        # 多进程部署时转发事件用
+        # publish_hook(会话id, 数据)  listen_hook(会话id, 开始或结束监听)
+        self.publish_hook: Callable[[int, object], None] | None = None
+        self.listen_hook: Callable[[int, bool], None] | None = None
+        self.evicted_times = 0
+        # 已删除日志的累计数据
+        self.coalesced_times = 0
+        self.dropped_times = 0
+
+    def open(self, chat_id: int, replay: bool = False) -> Answer_Queue:
+        """
+        订阅会话，返回自己的回答队列
+
+        参数:
+        - chat_id
+        - replay  是否从当前回答的第一条开始读，否则只读新事件（认领暂存日志时总是从头读）
+        """
+        claimed = False
+        log = self.logs.get(chat_id)
+        if log is None:
+            log = self.logs[chat_id] = Answer_Event_Log(self.maxsize)
+        elif not log.listeners:
+            # 认领暂存日志，从头读
+            log.maxsize = self.maxsize
+            log.last_active = monotonic()
+            claimed = True
+        log.listeners += 1
+        if log.listeners == 1 and self.listen_hook:
+            self.listen_hook(chat_id, True)
+        if claimed and log.items:
+            cursor = log.items[0][0]
+        elif replay:
+            cursor = log.answer_start()
+        else:
+            cursor = log.next_seq
+        return Answer_Queue(log, cursor)
+
+    def close(self, chat_id: int, queue: Answer_Queue):
+        """取消订阅，没有订阅者了就删除日志"""
+        # 日志可能已经因为超时被清理掉了
+        if self.logs.get(chat_id) is not queue.log:
+            return
+        queue.log.listeners -= 1
+        if queue.log.listeners <= 0:
+            self._remove(chat_id)
+            if self.listen_hook:
+                self.listen_hook(chat_id, False)
+
+    def _remove(self, chat_id: int):
+        log = self.logs.pop(chat_id)
+        self.coalesced_times += log.coalesced_times
+        self.dropped_times += log.dropped_times
+        if log.listeners and self.listen_hook:
+            self.listen_hook(chat_id, False)
+
+    def publish(self, chat_id: int, data):
+        """放入ws收到的数据"""
+        log = self.logs.get(chat_id)
+        if log is None:
+            log = self.logs[chat_id] = Answer_Event_Log(self.pending_maxsize)
+        log.put(data)
+        if self.publish_hook:
+            self.publish_hook(chat_id, data)
+
+    def replay_items(self, chat_id: int) -> list:
+        """
+        多进程部署时补发给新订阅进程的数据
+
+        没人认领的暂存数据全部补发，有人订阅的从当前回答的第一条开始（在别的进程旁听）
+        """
+        log = self.logs.get(chat_id)
+        if log is None:
+            return []
+        start = log.answer_start() if log.listeners else 0
+        return [item for seq, item in log.items if seq >= start]
+
+    def pending_items(self, chat_id: int) -> list:
+        """还没人认领的暂存数据"""
+        log = self.logs.get(chat_id)
+        if log is None or log.listeners:
+            return []
+        return [item for _, item in log.items]
+
+    def evict_idle(self) -> int:
+        """清理没人认领和长时间没动静的日志，返回清理数量"""
+        now = monotonic()
+        expired = [
+            chat_id
+            for chat_id, log in self.logs.items()
+            if now - log.last_active
+            > (self.idle_ttl if log.listeners else self.pending_ttl)
+        ]
+        for chat_id in expired:
+            self._remove(chat_id)
+        self.evicted_times += len(expired)
+        return len(expired)
+
+    @property
+    def listening_count(self) -> int:
+        return sum(1 for log in self.logs.values() if log.listeners)
+
+    def get_stats(self) -> dict:
+        """
+        获取队列状态，时间单位为秒
+        """
+        now = monotonic()
+        return {
+            "queues": len(self.logs),
+            "listeningQueues": self.listening_count,
+            "listeners": sum(log.listeners for log in self.logs.values()),
+            "bufferedItems": sum(log.qsize() for log in self.logs.values()),
+            "bufferedTextSize": sum(log.text_size() for log in self.logs.values()),
+            "maxIdleTime": round(
+                max(
+                    (now - log.last_active for log in self.logs.values()),
+                    default=0.0,
+                ),
+                2,
+            ),
+            "coalescedTimes": self.coalesced_times
+            + sum(log.coalesced_times for log in self.logs.values()),
+            "droppedTimes": self.dropped_times
+            + sum(log.dropped_times for log in self.logs.values()),
+            "evictedTimes": self.evicted_times,
+        }
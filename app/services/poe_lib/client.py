@@ -1,16 +1,22 @@
 from asyncio import (
-    Lock,
-    Queue,
+    Event,
+    Semaphore,
+    Task,
     TimeoutError,
     create_task,
+    gather,
     sleep,
+    to_thread,
     wait_for,
 )
 from hashlib import md5
+from logging import DEBUG
 from os import path
-from random import randint
+from random import randint, random
+from re import compile as compile_regex
 from re import findall
 from secrets import token_hex
+from time import monotonic
 from traceback import format_exc
 from typing import AsyncGenerator
 from uuid import UUID, uuid5
@@ -19,12 +25,16 @@ from aiohttp import (
     ClientSession,
     ClientTimeout,
     FormData,
+    TCPConnector,
+    TraceConfig,
     WSMsgType,
-    request,
 )
 from ujson import dump, load, loads
+from utils.cache_util import TTL_LRU_Cache
 from utils.tool_util import debug_logger, logger
 
+from .answer_queue import Answer_Queue, Answer_Queue_Registry
+from .dispatch import Send_Scheduler
 from .type import (
     BotMessageAdd,
     ChatTitleUpdated,
@@ -44,18 +54,58 @@ from .util import (
     SETTING_URL,
     base64_decode,
     base64_encode,
+    extract_hashes,
     filter_basic_bot_info,
     filter_bot_result,
     filter_files_info,
     generate_data,
     generate_random_handle,
     get_img_url,
+    read_chunk_hashes,
+    save_chunk_hashes,
     str_time,
 )
 
+# 拉取回答时连续主动查询的最大次数
+MAX_CATCH_UP_TIMES = 20
+# 需要处理的ws订阅，回答创建、生成、标题更新、花费
+WANTED_SUBSCRIPTIONS = {"messageAdded", "chatTitleUpdated", "jobCostUpdated"}
+# 不完整解析就拿到订阅名称
+SUBSCRIPTION_NAME_REGEX = compile_regex(r'"subscription_name"\s*:\s*"(\w+)"')
+# ws原始数据每多少帧记录一次debug日志
+WS_LOG_SAMPLE = 20
+# ws重连的退避时间（秒），每次失败翻倍，加上随机抖动，每次重连至少等WS_BACKOFF_BASE
+WS_BACKOFF_BASE = 1
+WS_BACKOFF_MAX = 60
+# ws连上后稳定这么久（秒）才清零失败次数
+WS_STABLE_TIME = 30
+# 统计每秒帧数的窗口（秒）
+WS_RATE_WINDOW = 10
+# 连续失败多少次算不可用
+WS_DOWN_ERROR_TIMES = 5
+# 轮换ws channel时等新channel连上的最长时间（秒）
+CHANNEL_CONNECT_TIMEOUT = 10
+# 轮换ws channel时新旧channel同时接收的时间（秒），期间收到的数据去重
+CHANNEL_OVERLAP = 10
+# 同时拉取js文件的数量
+HASHES_CONCURRENCY = 8
+# 每拉取多少个js文件保存一次进度
+HASHES_SAVE_INTERVAL = 20
+# 最多缓存多少个bot的所需积分
+PRICE_CACHE_SIZE = 2048
+
 
 class Poe_Client:
-    def __init__(self, p_b: str, p_lat: str, formkey: str, proxy: str | None = None):
+    def __init__(
+        self,
+        p_b: str,
+        p_lat: str,
+        formkey: str,
+        proxy: str | None = None,
+        send_concurrency: int = 4,
+        answer_timeout: int = 15,
+        price_cache_ttl: int = 3600,
+    ):
         self.formkey = formkey
         self.p_b = p_b
         self.p_lat = p_lat
@@ -81,13 +131,124 @@ class Poe_Client:
         }
         self.channel_url = ""
         self.ws_client_task = None
+        # ws连上后置位，断开时清除，发问题前等它连上
+        self.ws_connected = Event()
+        # 已连上的ws数量，轮换channel时新旧两个同时在线
+        self.live_channels = 0
+        # 没连上时的状态 connecting degraded down，见channel_state
+        self.ws_state = "connecting"
+        self.ws_reconnect_times = 0
+        self.ws_frame_times = 0
+        self.ws_parse_time = 0.0
+        self.ws_max_parse_time = 0.0
+        self.ws_last_frame_time = 0.0
+        self.ws_last_seq = 0
+        # 当前统计窗口的开始时间和帧数，窗口结束时算出每秒帧数
+        self.ws_rate_start = monotonic()
+        self.ws_rate_frames = 0
+        self.ws_frames_per_sec = 0.0
+        # 轮换channel的交替期截止时间，期间两个channel收到的数据去重
+        self.dedup_until = 0.0
+        self.recent_ws_data: set[tuple] = set()
         self.last_min_seq = 0
-        self.ws_data_queue: dict[int, Queue] = {}
+        # 各会话的回答队列
+        self.answer_queues = Answer_Queue_Registry()
+        # 拉取回答时多久没收到数据就主动查一次
+        self.answer_timeout = answer_timeout
         self.get_chat_code: dict[str, int] = {}
         self.hashes: dict[str, str] = {}
         self.login_success: bool = False
-        self.send_question_lock: Lock = Lock()
-        self.bot_price_cache: dict[str, int] = {}
+        # 多进程部署时只有channel owner连ws，其他进程的回答由owner转发
+        self.ws_enabled = True
+        # 发送问题的调度器，同一会话串行，不同会话并发
+        self.send_scheduler = Send_Scheduler(send_concurrency)
+        # bot handle -> 所需积分
+        self.bot_price_cache = TTL_LRU_Cache(PRICE_CACHE_SIZE, price_cache_ttl)
+        # 剩余时间不到这么多秒的积分缓存，用到时在后台刷新
+        self.price_refresh_ahead = price_cache_ttl / 5
+        self.price_refresh_tasks: dict[str, Task] = {}
+        # 账号积分余额，登陆和定时任务时刷新，每次花费时扣减
+        self.remain_points = 0
+        # 共用的http会话，login时创建，程序退出时关闭
+        self.session: ClientSession | None = None
+        self.conn_created_times = 0
+        self.conn_reused_times = 0
+
+    async def create_session(self):
+        """
+        创建长连接的http会话，所有请求共用一个连接池，省掉每次请求的TCP+TLS握手
+        """
+        await self.close_session()
+
+        async def _on_conn_create(session, ctx, params):
+            self.conn_created_times += 1
+
+        async def _on_conn_reuse(session, ctx, params):
+            self.conn_reused_times += 1
+
+        trace_config = TraceConfig()
+        trace_config.on_connection_create_end.append(_on_conn_create)
+        trace_config.on_connection_reuseconn.append(_on_conn_reuse)
+
+        self.session = ClientSession(
+            connector=TCPConnector(
+                limit=100,
+                limit_per_host=30,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+            ),
+            timeout=ClientTimeout(15),
+            trace_configs=[trace_config],
+        )
+
+    async def close_session(self):
+        """
+        关闭http会话
+        """
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def close(self):
+        """
+        关闭ws任务和http会话，程序退出或替换登陆凭证时用
+        """
+        if self.ws_client_task:
+            self.ws_client_task.cancel()
+            self.ws_client_task = None
+        for task in list(self.price_refresh_tasks.values()):
+            task.cancel()
+        await self.close_session()
+
+    def get_pool_stats(self) -> dict:
+        """
+        获取http连接池状态
+        """
+        idle_conns = 0
+        using_conns = 0
+        if self.session and not self.session.closed:
+            connector = self.session.connector
+            idle_conns = sum(len(conns) for conns in connector._conns.values())
+            using_conns = len(connector._acquired)
+
+        total = self.conn_created_times + self.conn_reused_times
+        return {
+            "openConnections": idle_conns + using_conns,
+            "idleConnections": idle_conns,
+            "createdConnections": self.conn_created_times,
+            "reusedConnections": self.conn_reused_times,
+            "reuseRatio": round(self.conn_reused_times / total, 4) if total else 0,
+        }
+
+    def get_load(self) -> int:
+        """
+        账号当前负载，正在发送、排队和正在拉取回答的问题数量
+        """
+        return (
+            self.send_scheduler.running
+            + self.send_scheduler.queue_depth
+            + self.answer_queues.listening_count
+        )
 
     async def login(self):
         """
@@ -98,6 +259,7 @@ class Poe_Client:
 
         self.login_success = False
         logger.info("Poe登陆中。。。。。。")
+        await self.create_session()
         await self.read_hashes()
 
         user_info = await self.get_account_info()
@@ -107,14 +269,20 @@ class Poe_Client:
         logger.info(text)
         self.login_success = True
 
+        if self.ws_enabled:
+            self.enable_ws()
+
+        return self
+
+    def enable_ws(self):
+        """连接ws channel，多进程部署时接管channel owner也用这个"""
+        self.ws_enabled = True
         # 取消之前的ws任务
         if self.ws_client_task:
             self.ws_client_task.cancel()
         # 创建ws任务
         self.ws_client_task = create_task(self.connect_to_channel())
 
-        return self
-
     async def read_hashes(self):
         """
         读取hashes
@@ -123,7 +291,7 @@ class Poe_Client:
             with open(HASHES_PATH, "r", encoding="utf-8") as r:
                 self.hashes = load(r)
         else:
-            logger.warning("未发现hashes.json文件，正在拉取，大概需要1~2分钟")
+            logger.warning("未发现hashes.json文件，正在拉取")
             await self.update_hashes()
 
     async def update_hashes(self):
@@ -173,54 +341,70 @@ class Poe_Client:
                 urls.append(base_url + resource)
             urls = list(set(urls + chunks))
 
-            queries = {}
-            for url in urls:
-                if not url.endswith(".js"):
-                    continue
-
-                max_retries = 2
-                con = False
-                for attempt in range(max_retries):
-                    try:
-                        async with session.get(
-                            url,
-                            proxy=self.proxy,
-                        ) as response:
-                            if response.status != 200:
-                                if response.status == 403:
-                                    logger.error(await response.text())
-                                    con = True
-                                    break
-
-                                raise Exception(f"HTTP status: {response.status}")
-                            text = await response.text()
-                            # 处理文本内容
-                            break  # 请求成功，退出重试循环
-                    except Exception as e:
-                        logger.warning(f"重试第{attempt + 1}次，URL：{url}，错误：{e}")
-                        await sleep(5)  # 等待一段时间后重试
-
+            urls = [url for url in urls if url.endswith(".js")]
+            chunk_hashes = await to_thread(read_chunk_hashes)
+            todo_urls = [url for url in urls if url not in chunk_hashes]
+            logger.info(f"共{len(urls)}个js文件，需要拉取{len(todo_urls)}个")
+
+            semaphore = Semaphore(HASHES_CONCURRENCY)
+            done_times = 0
+
+            async def _fetch(url: str):
+                nonlocal done_times
+                async with semaphore:
+                    text = await self._fetch_chunk(session, url)
+                # 403的也记下来（没有hash），文件名带内容hash，下次再拉也一样
+                if text is None:
+                    chunk_hashes[url] = {}
                 else:
-                    raise Exception("error")
-            
-                if con:
-                    logger.info("pass")
-                    continue
-
-                hashes_regex = r'params:{id:"([0-9a-zA-Z]{64})".+?name:"(\S+?)"'
-                hashes_list = findall(hashes_regex, text)
+                    chunk_hashes[url] = await to_thread(extract_hashes, text)
+                # 定时保存进度，中途出错下次接着拉
+                done_times += 1
+                if done_times % HASHES_SAVE_INTERVAL == 0:
+                    await to_thread(save_chunk_hashes, dict(chunk_hashes))
+
+            results = await gather(
+                *[_fetch(url) for url in todo_urls], return_exceptions=True
+            )
+            # 只保留当前还在用的js文件
+            chunk_hashes = {url: chunk_hashes[url] for url in urls if url in chunk_hashes}
+            await to_thread(save_chunk_hashes, chunk_hashes)
+            for result in results:
+                if isinstance(result, Exception):
+                    raise result
 
-                for query_hash, query_name in hashes_list:
-                    if "_" in query_name:
-                        query_name = query_name.split("_")[1]
-                    query_name = query_name[0].upper() + query_name[1:]
-                    queries[query_name] = query_hash
+        queries = {}
+        for url in urls:
+            queries.update(chunk_hashes.get(url, {}))
 
         with open(HASHES_PATH, "w", encoding="utf-8") as w:
             dump(queries, w, indent=4, sort_keys=True)
         self.hashes = queries
         logger.info("更新hashes文件完毕")
 
+    async def _fetch_chunk(self, session: ClientSession, url: str) -> str | None:
+        """拉取js文件内容，403返回None"""
+        max_retries = 2
+        for attempt in range(max_retries):
+            try:
+                async with session.get(
+                    url,
+                    proxy=self.proxy,
+                ) as response:
+                    if response.status != 200:
+                        if response.status == 403:
+                            logger.error(await response.text())
+                            logger.info("pass")
+                            return None
+
+                        raise Exception(f"HTTP status: {response.status}")
+                    return await response.text()
+            except Exception as e:
+                logger.warning(f"重试第{attempt + 1}次，URL：{url}，错误：{e}")
+                await sleep(5)  # 等待一段时间后重试
+
+        raise Exception(f"拉取{url}失败")
+
     async def send_query(
         self,
         query_name: str,
@@ -242,11 +426,9 @@ class Poe_Client:
         status_code = 0
         try:
             if query_name == "get_edit_bot_info":
-                async with request(
-                    "GET",
+                async with self.session.get(
                     f"https://poe.com/edit_bot?bot={variables['botName']}",
                     headers={"Cookie": f"p-b={self.p_b}; p-lat={self.p_lat}"},
-                    timeout=ClientTimeout(15),
                     proxy=self.proxy,
                 ) as response:
                     text = await response.text()
@@ -271,11 +453,9 @@ class Poe_Client:
                 raise Exception("获取自定义bot编辑信息失败")
 
             if query_name == "setting":
-                async with request(
-                    "GET",
+                async with self.session.get(
                     SETTING_URL,
                     headers=self.headers,
-                    timeout=ClientTimeout(15),
                     proxy=self.proxy,
                 ) as response:
                     return loads(await response.text())
@@ -290,8 +470,7 @@ class Poe_Client:
                     form.add_field(
                         file[0], file[1], content_type=file[2], filename=file[3]
                     )
-                async with request(
-                    "POST",
+                async with self.session.post(
                     GQL_URL_FILE,
                     data=form,
                     headers={
@@ -301,7 +480,6 @@ class Poe_Client:
                             "poe-tag-id": md5(base_string.encode()).hexdigest(),
                         },
                     },
-                    timeout=ClientTimeout(15),
                     proxy=self.proxy,
                 ) as response:
                     status_code = response.status
@@ -312,8 +490,7 @@ class Poe_Client:
             else:
                 data = generate_data(query_name, variables, hash)
                 base_string = data + self.formkey + "4LxgHM6KpFqokX0Ox"
-                async with request(
-                    "POST",
+                async with self.session.post(
                     GQL_URL,
                     data=data,
                     headers={
@@ -324,7 +501,6 @@ class Poe_Client:
                             "poe-tag-id": md5(base_string.encode()).hexdigest(),
                         },
                     },
-                    timeout=ClientTimeout(15),
                     proxy=self.proxy,
                 ) as response:
                     status_code = response.status
@@ -382,6 +558,8 @@ class Poe_Client:
                 / 1000,
             }
 
+            self.remain_points = data["remainPoints"]
+
             if data["subscriptionActivated"]:
                 data["planType"] = (
                     f"{_v['subscription']['subscriptionProduct']['displayName']} ({_v['subscription']['subscriptionProduct']['paidSubscriptionPeriod']})"
@@ -500,35 +678,79 @@ class Poe_Client:
 
         raise Exception("bot不存在（可能被删除了）")
 
-    async def get_lastest_historyNode(self, chat_id: int, messageId: int) -> dict:
+    async def get_bot_price(self, botHandle: str, botName: str = "") -> int:
+        """
+        获取bot所需积分，优先用缓存，快过期的缓存照常返回并在后台刷新
+
+        参数:
+        - botHandle
+        - botName  查询用的名称，不传就用botHandle
+        """
+        price = self.bot_price_cache.get(botHandle)
+        if price is None:
+            return (await self.get_bot_info(botName or botHandle))["price"]
+
+        ttl_left = self.bot_price_cache.ttl_left(botHandle) or 0
+        if (
+            ttl_left < self.price_refresh_ahead
+            and botHandle not in self.price_refresh_tasks
+        ):
+            self.price_refresh_tasks[botHandle] = create_task(
+                self._refresh_bot_price(botHandle, botName or botHandle)
+            )
+        return price
+
+    async def _refresh_bot_price(self, botHandle: str, botName: str):
+        try:
+            await self.get_bot_info(botName)
+        except Exception as e:
+            logger.warning(f"刷新{botHandle}所需积分出错 {repr(e)}")
+        finally:
+            self.price_refresh_tasks.pop(botHandle, None)
+
+    def invalidate_bot_prices(self):
+        """积分缓存都缩短到快过期，常用的bot下次用到时在后台刷新，不用的自然过期"""
+        self.bot_price_cache.expire_within(self.price_refresh_ahead)
+
+    async def get_latest_message(
+        self, chat_id: int, messageId: int
+    ) -> BotMessageAdd | None:
         """
-        获取最后一个消息记录，用户拉取回答超时的时候用
+        只拉取会话最后一条消息，拉取回答超时的时候用
+
+        参数:
+        - chat_id
+        - messageId  问题的id，比它旧的或者不是bot的消息返回None
         """
         try:
             result = await self.send_query(
                 "ChatListPaginationQuery",
                 {
-                    "count": 25,
+                    "count": 1,
                     "cursor": "0",
                     "id": base64_encode(f"Chat:{chat_id}"),
                 },
                 self.hashes["ChatListPaginationQuery"],
             )
         except Exception as e:
-            raise Exception(f"获取chat详细信息失败: {repr(e)}")
-
-        edge = result["data"]["node"]["messagesConnection"]["edges"][-1]
-        historyNode = {
-            "messageId": edge["node"]["messageId"],
-            "creationTime": edge["node"]["creationTime"],
-            "text": edge["node"]["text"],
-            "attachments": filter_files_info(edge["node"]["attachments"]),
-        }
-
-        if historyNode["messageId"] < messageId:
-            return {}
-
-        return historyNode
+            raise Exception(f"获取最后一条消息失败: {repr(e)}")
+
+        edges = result["data"]["node"]["messagesConnection"]["edges"]
+        if not edges:
+            return None
+
+        node = edges[-1]["node"]
+        if node["messageId"] < messageId or node["author"] in ["human", "chat_break"]:
+            return None
+
+        return BotMessageAdd(
+            state=node.get("state", "complete"),
+            messageStateText=node.get("messageStateText"),
+            messageId=node["messageId"],
+            creationTime=node["creationTime"],
+            text=node["text"],
+            attachments=filter_files_info(node["attachments"]),
+        )
 
     async def get_chat_info(self, chat_code: str, chat_id: int, cursor: str) -> dict:
         """
@@ -591,9 +813,9 @@ class Poe_Client:
             "pageInfo": pageInfo,
         }
 
-    async def get_new_channel(self):
+    async def get_new_channel(self) -> str:
         """
-        此函数从设置_URL获取通道数据，更新ws地址，对话用的
+        此函数从设置_URL获取通道数据，更新ws地址，对话用的，返回ws地址
         """
         result = await self.send_query("setting", {}, "")
 
@@ -855,6 +1077,25 @@ class Poe_Client:
             # },
             self.hashes["SubscriptionsMutation"],
         )
+        return self.channel_url
+
+    def is_duplicate_ws_data(self, chat_id: int, data) -> bool:
+        """轮换channel的交替期内，判断是不是另一个channel已经收到过的数据"""
+        if self.dedup_until < monotonic():
+            self.recent_ws_data.clear()
+            return False
+
+        if isinstance(data, BotMessageAdd):
+            content = (data.messageId, data.state, data.text)
+        elif isinstance(data, PriceCost):
+            content = (data.messageId, data.price)
+        else:
+            content = (data.title,)
+        key = (chat_id, type(data).__name__, content)
+        if key in self.recent_ws_data:
+            return True
+        self.recent_ws_data.add(key)
+        return False
 
     async def handle_ws_data(self, ws_data: dict):
         """
@@ -865,10 +1106,14 @@ class Poe_Client:
             logger.warning(f"get {ws_data}")
             raise RefetchChannel("error")
 
-        messages: list[dict] = [
-            loads(msg_str) for msg_str in ws_data.get("messages", "{}")
-        ]
-        for message in messages:
+        for msg_str in ws_data.get("messages", []):
+            # 不需要的订阅在完整解析前就跳过
+            if (
+                match := SUBSCRIPTION_NAME_REGEX.search(msg_str)
+            ) and match.group(1) not in WANTED_SUBSCRIPTIONS:
+                continue
+
+            message: dict = loads(msg_str)
             message_type = message.get("message_type")
             if message_type == "refetchChannel":
                 raise RefetchChannel("refetch")
@@ -876,11 +1121,7 @@ class Poe_Client:
             payload: dict = message["payload"]
             subscription_name = payload["subscription_name"]
             # 只要回答创建、生成、标题更新
-            if subscription_name not in [
-                "messageAdded",
-                "chatTitleUpdated",
-                "jobCostUpdated",
-            ]:
+            if subscription_name not in WANTED_SUBSCRIPTIONS:
                 continue
 
             _data = payload["data"][subscription_name]
@@ -890,14 +1131,12 @@ class Poe_Client:
                 if payload["data"]["messageAdded"]["author"] in ["human", "chat_break"]:
                     continue
                 data = BotMessageAdd(
-                    state=_data["state"],
-                    messageStateText=_data["messageStateText"]
-                    if "messageStateText" in _data
-                    else None,
-                    messageId=_data["messageId"],
-                    creationTime=_data["creationTime"],
-                    text=_data["text"],
-                    attachments=filter_files_info(_data["attachments"]),
+                    _data["state"],
+                    _data.get("messageStateText"),
+                    _data["messageId"],
+                    _data["creationTime"],
+                    _data["text"],
+                    filter_files_info(_data["attachments"]),
                 )
                 chat_id = int(payload["unique_id"][13:])
 
@@ -909,28 +1148,36 @@ class Poe_Client:
                 chat_id = int(payload["unique_id"][17:])
             # 花费更新
             else:
-                data = PriceCost(price=_data["totalCostPoints"])
-                chat_id = int(
-                    _data["createdMessagesConnection"]["edges"][0]["node"]["chat"][
-                        "chatId"
-                    ]
-                )
+                node = _data["createdMessagesConnection"]["edges"][0]["node"]
+                data = PriceCost(_data["totalCostPoints"], node.get("messageId"))
+                chat_id = int(node["chat"]["chatId"])
 
-            # 创建接收回答的队列
-            if chat_id not in self.ws_data_queue:
-                self.ws_data_queue[chat_id] = Queue()
+            if self.is_duplicate_ws_data(chat_id, data):
+                continue
+            if isinstance(data, PriceCost):
+                self.remain_points -= data.price
 
-            await self.ws_data_queue[chat_id].put(data)
+            self.answer_queues.publish(chat_id, data)
 
-    async def connect_to_channel(self):
+    async def connect_to_channel(
+        self, channel_url: str = "", connected: Event | None = None
+    ):
         """
-        连接到poe的websocket，用于拉取回答
+        连接到poe的websocket，用于拉取回答，断开后按指数退避一直重连
+
+        参数:
+        - channel_url  已经拿到的ws地址，不传就重新获取，重连时都会重新获取
+        - connected  连上后置位，轮换channel时用
         """
         error_times = 0
-        while error_times < 3:
+        self.ws_state = "connecting"
+        while True:
+            connected_time = 0.0
+            failed = False
             try:
                 """获取ws地址"""
-                await self.get_new_channel()
+                if not channel_url:
+                    channel_url = await self.get_new_channel()
                 """创建ws连接"""
                 async with ClientSession(
                     headers={
@@ -944,34 +1191,176 @@ class Poe_Client:
                         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36 Edg/128.0.0.0",
                     }
                 ) as session:
-                    logger.info("ws channel connected")
                     async with session.ws_connect(
-                        self.channel_url, proxy=self.proxy, autoping=True, heartbeat=30
+                        channel_url, proxy=self.proxy, autoping=True, heartbeat=30
                     ) as ws:
+                        logger.info("ws channel connected")
+                        connected_time = monotonic()
+                        self.live_channels += 1
+                        self.ws_connected.set()
+                        if connected:
+                            connected.set()
                         try:
                             async for msg in ws:
-                                debug_logger.debug(msg.data)
                                 if msg.type == WSMsgType.TEXT:
-                                    await self.handle_ws_data(loads(msg.data))
+                                    await self.handle_ws_frame(msg.data)
                                 else:
                                     logger.warning(f"get unknown ws type: {msg.type}")
                                     break
                         finally:
+                            self.live_channels -= 1
+                            if not self.live_channels:
+                                self.ws_connected.clear()
                             await ws.close()
 
-                error_times = 0
-
             except RefetchChannel as e:
                 logger.warning({repr(e)})
-                error_times = 0
 
             except Exception as e:
                 logger.error(f"ws channel连接出错: {repr(e)}")
                 logger.error(format_exc())
-                error_times += 1
+                failed = True
 
-        logger.warning("ws channel disconnected")
-        self.ws_client_task = None
+            # 连上就断的不算恢复，否则会一直快速重连
+            if connected_time and monotonic() - connected_time >= WS_STABLE_TIME:
+                error_times = 0
+            error_times += failed
+
+            channel_url = ""
+            self.ws_reconnect_times += 1
+            # 连续出错就退避，避免一直请求settings，正常断开也至少等WS_BACKOFF_BASE
+            delay = min(WS_BACKOFF_BASE * 2 ** max(error_times - 1, 0), WS_BACKOFF_MAX)
+            delay *= 1 + random() / 2
+            if not error_times:
+                self.ws_state = "connecting"
+                logger.info(f"ws channel断开，{delay:.1f}秒后重连")
+            else:
+                self.ws_state = (
+                    "down" if error_times >= WS_DOWN_ERROR_TIMES else "degraded"
+                )
+                logger.warning(
+                    f"ws channel第{error_times}次连接失败，{delay:.1f}秒后重连"
+                )
+            await sleep(delay)
+
+    @property
+    def channel_state(self) -> str:
+        """
+        ws channel状态 connecting 连接中  live 已连上  degraded 重连中  down 连续失败
+        remote 由其他进程连接
+        """
+        if not self.ws_enabled:
+            return "remote"
+        if self.live_channels:
+            return "live"
+        if self.ws_client_task is None or self.ws_client_task.done():
+            return "down"
+        return self.ws_state
+
+    async def handle_ws_frame(self, frame: str):
+        """解析并处理一帧ws数据，顺便统计"""
+        start_time = monotonic()
+        # 原始数据抽样记录，日志等级不够就不处理
+        if (
+            debug_logger.isEnabledFor(DEBUG)
+            and self.ws_frame_times % WS_LOG_SAMPLE == 0
+        ):
+            debug_logger.debug(frame)
+        ws_data = loads(frame)
+        try:
+            await self.handle_ws_data(ws_data)
+        finally:
+            parse_time = monotonic() - start_time
+            self.ws_frame_times += 1
+            self.ws_parse_time += parse_time
+            self.ws_max_parse_time = max(self.ws_max_parse_time, parse_time)
+            self.ws_last_frame_time = monotonic()
+            self.ws_rate_frames += 1
+            elapsed = self.ws_last_frame_time - self.ws_rate_start
+            if elapsed >= WS_RATE_WINDOW:
+                self.ws_frames_per_sec = self.ws_rate_frames / elapsed
+                self.ws_rate_start, self.ws_rate_frames = self.ws_last_frame_time, 0
+            if "min_seq" in ws_data:
+                self.ws_last_seq = int(ws_data["min_seq"])
+
+    def get_ws_stats(self) -> dict:
+        """获取ws channel的状态和统计，只读不改"""
+        now = monotonic()
+        # 上一个窗口算出的每秒帧数，之后一直没有帧就是0
+        if now - self.ws_rate_start < WS_RATE_WINDOW * 2:
+            frames_per_sec = self.ws_frames_per_sec
+        else:
+            frames_per_sec = 0
+        return {
+            "state": self.channel_state,
+            "liveChannels": self.live_channels,
+            "reconnectTimes": self.ws_reconnect_times,
+            "frameTimes": self.ws_frame_times,
+            "framesPerSec": round(frames_per_sec, 2),
+            "avgParseMs": round(self.ws_parse_time / self.ws_frame_times * 1000, 3)
+            if self.ws_frame_times
+            else 0,
+            "maxParseMs": round(self.ws_max_parse_time * 1000, 3),
+            "subscribedSeq": self.last_min_seq,
+            "lastSeq": self.ws_last_seq,
+            "seqLag": max(self.ws_last_seq - self.last_min_seq, 0),
+            "lastFrameAge": round(now - self.ws_last_frame_time, 1)
+            if self.ws_last_frame_time
+            else -1,
+        }
+
+    async def rotate_channel(self):
+        """
+        轮换ws channel，先连上新的再断开旧的，交替期内两边收到的数据去重，
+        正在拉取的回答不会中断
+        """
+        if not self.ws_enabled:
+            return
+
+        old_task = self.ws_client_task
+        if old_task is None or old_task.done():
+            self.ws_client_task = create_task(self.connect_to_channel())
+            return
+
+        connected = Event()
+        new_task = create_task(
+            self.connect_to_channel(await self.get_new_channel(), connected)
+        )
+        try:
+            await wait_for(connected.wait(), CHANNEL_CONNECT_TIMEOUT)
+        except TimeoutError:
+            logger.warning("新ws channel连接超时，继续使用旧的")
+            new_task.cancel()
+            return
+
+        self.ws_client_task = new_task
+        self.dedup_until = monotonic() + CHANNEL_OVERLAP
+        await sleep(CHANNEL_OVERLAP)
+        old_task.cancel()
+        logger.info("ws channel轮换完成")
+
+    async def wait_ws_connected(self, timeout: float = 5):
+        """
+        确保ws任务在运行，并等它连上，超时也继续（拉取回答时会主动查）
+        """
+        if not self.ws_enabled:
+            return
+
+        if self.ws_client_task is None or self.ws_client_task.done():
+            # 创建ws任务
+            self.ws_client_task = create_task(self.connect_to_channel())
+
+        if self.ws_connected.is_set():
+            return
+        # 连续连不上就不等了，直接靠主动查询拉回答
+        if self.channel_state == "down":
+            logger.warning("ws channel不可用")
+            return
+
+        try:
+            await wait_for(self.ws_connected.wait(), timeout)
+        except TimeoutError:
+            logger.warning("等待ws连接超时")
 
     async def send_question(
         self,
@@ -990,10 +1379,7 @@ class Poe_Client:
         - price
         - files  附件
         """
-        if self.ws_client_task is None:
-            # 创建ws任务
-            self.ws_client_task = create_task(self.connect_to_channel())
-            await sleep(1)
+        await self.wait_ws_connected()
 
         try:
             result = await self.send_query(
@@ -1058,65 +1444,138 @@ class Poe_Client:
         }
 
     async def get_answer(
-        self, chatId: int, questionMessageId: int, new_chat: bool
+        self, queue: Answer_Queue, chatId: int, questionMessageId: int, new_chat: bool
     ) -> AsyncGenerator:
         """
-        拉取回答
+        拉取回答，结束后停止监听
 
         参数:
+        - queue  回答队列，发问题前用answer_queues.open监听（新会话拿到chatId后马上监听）
         - chatId
         - questionMessageId  问题的id
         - new_chat  是否为新会话
         """
-        timeout = 15
-        # 创建接收回答的队列
+        try:
+            async for data in self._get_answer(
+                queue, chatId, questionMessageId, new_chat
+            ):
+                yield data
+        finally:
+            self.answer_queues.close(chatId, queue)
+
+    async def _get_answer(
+        self,
+        queue: Answer_Queue,
+        chatId: int,
+        questionMessageId: int,
+        new_chat: bool,
+    ) -> AsyncGenerator:
+        # 回答状态 waiting 还没开始回答  streaming 回答中  finished 回答完了，等花费和标题
+        state = "waiting"
+        # 这次问题的回答id，同一会话可能有多个回答同时在进行（重新回答、多个标签页），
+        # 只认问题之后的第一条回答，其他回答的内容和花费都忽略
+        answer_id: int | None = None
+        # 连续主动查询的次数，收到ws数据就清零
+        catch_up_times = 0
         while True:
             # 从队列拉取回复
             try:
-                data = await wait_for(self.ws_data_queue[chatId].get(), timeout)
-            except KeyError:
-                self.ws_data_queue[chatId] = Queue()
-                await sleep(1)
-                continue
+                data = await wait_for(queue.get(), self.answer_timeout)
             except TimeoutError:
-                if _data := await self.get_lastest_historyNode(
-                    chatId, questionMessageId
-                ):
+                if state == "finished":
+                    logger.warning(f"会话{chatId}等待花费信息超时")
+                    return
+
+                catch_up_times += 1
+                if catch_up_times > MAX_CATCH_UP_TIMES:
+                    yield TalkError(errMsg="获取回答超时")
+                    return
+
+                # ws可能断了或漏了，主动查一次最后一条消息
+                try:
+                    data = await self.get_latest_message(chatId, questionMessageId)
+                except Exception as e:
+                    logger.warning(repr(e))
+                    continue
+
+                if data is None or data.messageId <= questionMessageId:
+                    continue
+                if answer_id is None:
+                    answer_id = data.messageId
+                elif data.messageId != answer_id:
+                    continue
+
+                yield data
+                # 查到完整回答就结束，否则继续等
+                if data.state != "incomplete":
                     logger.warning("获取回答超时，但拉了回来")
-                    data = BotMessageAdd(
-                        state="complete",
-                        messageStateText=_data["messageStateText"]
-                        if "messageStateText" in _data
-                        else None,
-                        messageId=_data["messageId"],
-                        creationTime=_data["creationTime"],
-                        text=_data["text"],
-                        attachments=filter_files_info(_data["attachments"]),
-                    )
-                    yield data
                     return
+                state = "streaming"
+                continue
 
-                yield TalkError(errMsg="获取回答超时")
-                return
+            catch_up_times = 0
 
             if isinstance(data, BotMessageAdd):
-                # 如果是旧的也忽略
-                if data.messageId < questionMessageId:
+                # 问题之前的、别的回答的都忽略
+                if data.messageId <= questionMessageId:
                     continue
+                if answer_id is None:
+                    answer_id = data.messageId
+                elif data.messageId != answer_id:
+                    continue
+                state = "streaming" if data.state == "incomplete" else "finished"
                 yield data
 
             # 消费更新
-            if isinstance(data, PriceCost):
+            elif isinstance(data, PriceCost):
+                if data.messageId is not None:
+                    if answer_id is None and data.messageId > questionMessageId:
+                        answer_id = data.messageId
+                    if data.messageId != answer_id:
+                        continue
                 yield data
                 # 如果不是新会话，直接返回
                 if not new_chat:
                     return
 
             # 如果新会话要更新title，在最后
-            if isinstance(data, ChatTitleUpdated):
+            elif isinstance(data, ChatTitleUpdated):
                 yield data
                 return
 
+    async def watch_answer(self, queue: Answer_Queue, chatId: int) -> AsyncGenerator:
+        """
+        旁听进行中的回答，只转发回答内容和标题，回答结束后停止监听
+
+        不主动查询，花费和聊天记录由发起回答的请求处理
+
+        参数:
+        - queue  回答队列，用answer_queues.open(chatId, replay=True)从当前回答开始读
+        - chatId
+        """
+        answer_id: int | None = None
+        try:
+            while True:
+                try:
+                    data = await wait_for(queue.get(), self.answer_timeout)
+                except TimeoutError:
+                    yield TalkError(errMsg="获取回答超时")
+                    return
+
+                if isinstance(data, BotMessageAdd):
+                    if answer_id is None:
+                        answer_id = data.messageId
+                    elif data.messageId != answer_id:
+                        continue
+                    yield data
+                    if data.state != "incomplete":
+                        return
+
+                elif isinstance(data, ChatTitleUpdated):
+                    yield data
+        finally:
+            self.answer_queues.close(chatId, queue)
+
     async def answer_again(self, handle: str, chatCode: str, messageId: int):
         """
         重新生成回复
@@ -1342,11 +1801,9 @@ class Poe_Client:
             except Exception as e:
                 raise Exception(f"创建bot失败: {repr(e)}")
             try:
-                async with request(
-                    "GET",
+                async with self.session.get(
                     f"https://poe.com/_next/data/w4diyMjOxdjD6IZZxDJDt/{handle}.json?handle={handle}",
                     headers=self.headers,
-                    timeout=ClientTimeout(15),
                     proxy=self.proxy,
                 ) as response:
                     status_code = response.status
@@ -1607,26 +2064,22 @@ class Poe_Client:
 
         img_url = get_img_url(_bot_info["displayName"], _bot_info["picture"])
 
+        bot_handle = _bot_info["nickname"]
         try:
             _x = _bot_info["botPricing"]["botPricingLabel"].split()
-            if len(_x) == 2:
-                self.bot_price_cache["botHandle"] = int(_x[0].replace("+", ""))
-            else:
-                self.bot_price_cache["botHandle"] = 500
-
             # "可变积分"
             # "4700+ 积分"
+            price = int(_x[0].replace("+", "")) if len(_x) == 2 else 500
+            self.bot_price_cache.set(bot_handle, price)
         except KeyError:
-            try:
-                price = self.bot_price_cache["botHandle"]
-            except KeyError:
+            price = self.bot_price_cache.get(bot_handle)
+            if price is None:
                 if keyerror is True:
                     raise Exception(f"拉取{_bot_info['displayName']}所需积分信息出错")
 
                 logger.warning(f"拉取{_bot_info['displayName']}所需积分信息")
-                await self.get_bot_info(_bot_info["displayName"], keyerror=True)
+                price = (await self.get_bot_info(bot_handle, keyerror=True))["price"]
 
-        price = self.bot_price_cache["botHandle"]
         if not price:
             price = 200
 
@@ -0,0 +1,154 @@
+from asyncio import CancelledError, Future, get_running_loop
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from time import monotonic
+from typing import AsyncIterator, Hashable
+
+
+class _Waiter:
+    """排队中的发送请求"""
+
+    __slots__ = ("user", "chat_key", "future", "enqueue_time")
+
+    def __init__(self, user: str, chat_key: Hashable | None, future: Future):
+        self.user = user
+        self.chat_key = chat_key
+        self.future = future
+        self.enqueue_time = monotonic()
+
+
+class Send_Scheduler:
+    """
+    发送问题的调度器
+
+    - 同一个会话内串行发送，不同会话最多同时发送max_concurrency个
+    - 排队时按用户轮流放行，避免某个用户刷屏把别人堵住
+    - 只管本进程，多进程部署时每个进程各自最多同时发送max_concurrency个
+    """
+
+    def __init__(self, max_concurrency: int = 4):
+        self.max_concurrency = max(1, max_concurrency)
+        self.running = 0
+        self.busy_chats: set[Hashable] = set()
+        # 用户 -> 正在发送的数量
+        self.user_running: dict[str, int] = {}
+        # 用户 -> 该用户排队中的请求，字典顺序就是轮流的顺序
+        self.waiters: OrderedDict[str, deque[_Waiter]] = OrderedDict()
+        self.dispatched_times = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @asynccontextmanager
+    async def slot(
+        self, user: str, chat_key: Hashable | None = None
+    ) -> AsyncIterator[None]:
+        """
+        获取发送名额，退出上下文时归还
+
+        参数:
+        - user 用户名，用于轮流放行
+        - chat_key 会话标识，同一个会话串行，None（新会话）则不限制
+        """
+        waiter = _Waiter(user, chat_key, get_running_loop().create_future())
+        self.waiters.setdefault(user, deque()).append(waiter)
+        self._dispatch()
+
+        try:
+            await waiter.future
+        except CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # 已经拿到名额才被取消，要归还
+                self._release(waiter)
+            else:
+                self._remove(waiter)
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(waiter)
+
+    def _next_waiter(self) -> _Waiter | None:
+        """按用户轮流，正在发送数量少的用户优先，取出第一个会话空闲的请求"""
+        for user in sorted(self.waiters, key=lambda u: self.user_running.get(u, 0)):
+            queue = self.waiters[user]
+            for waiter in queue:
+                if waiter.future.done():
+                    continue
+                if waiter.chat_key is not None and waiter.chat_key in self.busy_chats:
+                    continue
+
+                queue.remove(waiter)
+                # 放行后该用户排到最后
+                if queue:
+                    self.waiters.move_to_end(user)
+                else:
+                    del self.waiters[user]
+                return waiter
+
+        return None
+
+    def _dispatch(self):
+        """有空闲名额就放行"""
+        while self.running < self.max_concurrency:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+
+            self.running += 1
+            self.user_running[waiter.user] = self.user_running.get(waiter.user, 0) + 1
+            if waiter.chat_key is not None:
+                self.busy_chats.add(waiter.chat_key)
+
+            wait_time = monotonic() - waiter.enqueue_time
+            self.dispatched_times += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            waiter.future.set_result(None)
+
+    def _release(self, waiter: _Waiter):
+        self.running -= 1
+        if self.user_running[waiter.user] > 1:
+            self.user_running[waiter.user] -= 1
+        else:
+            del self.user_running[waiter.user]
+        if waiter.chat_key is not None:
+            self.busy_chats.discard(waiter.chat_key)
+        self._dispatch()
+
+    def _remove(self, waiter: _Waiter):
+        queue = self.waiters.get(waiter.user)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            pass
+        if not queue:
+            del self.waiters[waiter.user]
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self.waiters.values())
+
+    def get_stats(self) -> dict:
+        """
+        获取调度状态，时间单位为毫秒
+        """
+        now = monotonic()
+        oldest_wait = max(
+            (now - queue[0].enqueue_time for queue in self.waiters.values() if queue),
+            default=0.0,
+        )
+        return {
+            "maxConcurrency": self.max_concurrency,
+            "running": self.running,
+            "queueDepth": self.queue_depth,
+            "waitingUsers": len(self.waiters),
+            "dispatchedTimes": self.dispatched_times,
+            "avgWaitTime": round(self.total_wait_time / self.dispatched_times * 1000, 2)
+            if self.dispatched_times
+            else 0,
+            "maxWaitTime": round(self.max_wait_time * 1000, 2),
+            "oldestWaitTime": round(oldest_wait * 1000, 2),
+        }
@@ -37,35 +37,44 @@ class Attachments(BaseModel):
     )
 
 
-class BotMessageAdd(BaseModel):
-    """回答的内容"""
-
-    state: str = Field(
-        title="回答状态",
-        examples=["incomplete", "complete", "cancelled"],
-    )
-    messageStateText: str | None = Field(
-        title="异常状态文本",
-        examples=[
-            "信息或附件过大。请缩短信息或上传较小的附件，或考虑使用其他支持更大信息的机器人。"
-        ],
-    )
-    messageId: int = Field(
-        title="消息id",
-        examples=[2692997857],
-    )
-    creationTime: int = Field(
-        title="创建时间",
-        examples=[1692964266475260],
-    )
-    text: str = Field(
-        title="消息内容",
-        examples=["这是回答内容"],
-    )
-    attachments: list[Attachments] = Field(
-        title="附件列表",
+class BotMessageAdd:
+    """
+    回答的内容
+
+    ws每秒可能来很多条，不用pydantic校验，字段含义:
+    - state  回答状态 incomplete complete cancelled
+    - messageStateText  异常状态文本
+    - messageId  消息id
+    - creationTime  创建时间
+    - text  消息内容
+    - attachments  附件列表，字段同Attachments
+    """
+
+    __slots__ = (
+        "state",
+        "messageStateText",
+        "messageId",
+        "creationTime",
+        "text",
+        "attachments",
     )
 
+    def __init__(
+        self,
+        state: str,
+        messageStateText: str | None,
+        messageId: int,
+        creationTime: int,
+        text: str,
+        attachments: list[dict],
+    ):
+        self.state = state
+        self.messageStateText = messageStateText
+        self.messageId = messageId
+        self.creationTime = creationTime
+        self.text = text
+        self.attachments = attachments
+
 
 class ChatTitleUpdated(BaseModel):
     """新会话标题更新"""
@@ -75,12 +84,14 @@ class ChatTitleUpdated(BaseModel):
     )
 
 
-class PriceCost(BaseModel):
-    """花费信息"""
+class PriceCost:
+    """花费信息，price为消耗点数，messageId为花费对应的回答id（拿不到为None）"""
 
-    price: int = Field(
-        title="消耗点数",
-    )
+    __slots__ = ("price", "messageId")
+
+    def __init__(self, price: int, messageId: int | None = None):
+        self.price = price
+        self.messageId = messageId
 
 
 class TalkError(BaseModel):
@@ -1,15 +1,19 @@
 from base64 import b64decode, b64encode
-from os import path
+from os import path, replace
 from random import choice
+from re import findall
 from string import ascii_letters, digits
 from time import localtime, strftime
 
-from ujson import dumps
+from ujson import dump, dumps, load
 from utils.tool_util import logger
 
-from .type import Attachments
 
 HASHES_PATH = path.join(path.dirname(path.abspath(__file__)), "hashes.json")
+# 各个js文件提取出的hash，文件名带内容hash，没变的下次直接跳过，403的记为空
+CHUNK_HASHES_PATH = path.join(
+    path.dirname(path.abspath(__file__)), "chunk_hashes.json"
+)
 GQL_URL = "https://poe.com/api/gql_POST"
 GQL_URL_FILE = "https://poe.com/api/gql_upload_POST"
 SETTING_URL = "https://poe.com/api/settings"
@@ -42,6 +46,35 @@ def generate_random_handle(c) -> str:
     return "".join(choice(letters) for _ in range(c))
 
 
+def extract_hashes(text: str) -> dict[str, str]:
+    """从js文件内容提取query的hash，返回{query名称: hash}"""
+    queries = {}
+    hashes_regex = r'params:{id:"([0-9a-zA-Z]{64})".+?name:"(\S+?)"'
+    for query_hash, query_name in findall(hashes_regex, text):
+        if "_" in query_name:
+            query_name = query_name.split("_")[1]
+        query_name = query_name[0].upper() + query_name[1:]
+        queries[query_name] = query_hash
+    return queries
+
+
+def read_chunk_hashes() -> dict[str, dict[str, str]]:
+    """读取各个js文件提取出的hash，文件不存在或损坏返回空"""
+    try:
+        with open(CHUNK_HASHES_PATH, "r", encoding="utf-8") as r:
+            return load(r)
+    except Exception:
+        return {}
+
+
+def save_chunk_hashes(chunk_hashes: dict[str, dict[str, str]]):
+    """保存各个js文件提取出的hash，先写临时文件再替换，中途崩溃不会写坏"""
+    tmp_path = CHUNK_HASHES_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as w:
+        dump(chunk_hashes, w, indent=4, sort_keys=True)
+    replace(tmp_path, CHUNK_HASHES_PATH)
+
+
 def base64_encode(text: str) -> str:
     return b64encode(text.encode("utf-8")).decode("utf-8")
 
@@ -122,17 +155,16 @@ def filter_basic_bot_info(_bot_list: list) -> list[dict]:
     return bot_list
 
 
-def filter_files_info(_files: list) -> list[Attachments]:
-    _file_list = []
-    for _f in _files:
-        _file_list.append(
-            Attachments(
-                name=_f["name"],
-                url=_f["url"],
-                mimeType=_f["file"]["mimeType"],
-                width=_f["file"]["width"],
-                height=_f["file"]["height"],
-                size=_f["file"]["size"],
-            ).model_dump()
-        )
-    return _file_list
+def filter_files_info(_files: list) -> list[dict]:
+    """提取附件信息，字段同Attachments，回答时频繁调用，不用pydantic校验"""
+    return [
+        {
+            "name": _f["name"],
+            "url": _f["url"],
+            "mimeType": _f["file"]["mimeType"],
+            "width": _f["file"]["width"],
+            "height": _f["file"]["height"],
+            "size": _f["file"]["size"],
+        }
+        for _f in _files
+    ]
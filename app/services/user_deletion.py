@@ -0,0 +1,197 @@
+from asyncio import Semaphore, Task, create_task, gather, sleep
+from random import random
+from time import time
+from typing import Awaitable, Callable
+
+from database.bot_db import Bot
+from database.chat_db import Chat
+from database.user_db import User
+from utils.tool_util import logger, user_action
+
+from .event_broker import broker
+from .poe_client import poe
+from .poe_lib.client import Poe_Client
+
+# 同时向Poe发送删除请求的数量
+DELETE_CONCURRENCY = 4
+# 每确认删除这么多个就删掉本地记录
+DELETE_BATCH_SIZE = 50
+# 单个删除请求的重试次数和首次重试等待（秒），之后每次翻倍
+RETRY_TIMES = 3
+RETRY_DELAY = 1
+# 删完后又查到新的会话或bot时最多再删几轮
+DELETE_ROUNDS = 3
+
+
+class User_Deletion:
+    """
+    删除用户的后台任务
+
+    - 先禁止用户登陆并清掉凭证缓存，删除期间不能再新建会话和bot
+    - 删Poe上的会话和bot，并发受限，出错按指数退避重试，Poe账号不存在或没登陆的不重试
+    - Poe确认删除后，本地记录按批在一个事务里删掉，中途失败也不会出现两边不一致
+    - 删完再查一遍，禁止登陆前已在进行的请求可能又建了会话或bot，确认没有了才删除用户
+    - 有失败的就停在failed，用户和剩下的记录还在，可以再次删除重试
+    - 进度变化时广播给其他进程，多进程部署时哪个进程都能查到
+    """
+
+    def __init__(self, user: str):
+        self.user = user
+        self.state = "running"
+        self.total_chats = 0
+        self.deleted_chats = 0
+        self.total_bots = 0
+        self.deleted_bots = 0
+        self.errors: list[str] = []
+        self.start_time = int(time() * 1000)
+        self.finish_time = 0
+        self.task: Task | None = None
+        self._semaphore = Semaphore(DELETE_CONCURRENCY)
+
+    async def run(self):
+        try:
+            await User.disable_user(self.user)
+            for _ in range(DELETE_ROUNDS):
+                found = await self._delete_chats() + await self._delete_bots()
+                if self.errors or not found:
+                    break
+
+            if self.errors or found:
+                self.state = "failed"
+            else:
+                await User.delete_user(self.user)
+                self.state = "done"
+                user_action.info(f"用户 {self.user} 已删除")
+        except Exception as e:
+            self.errors.append(repr(e))
+            self.state = "failed"
+        finally:
+            self.finish_time = int(time() * 1000)
+            self.publish()
+            if self.errors:
+                logger.error(f"删除用户{self.user}出错 {self.errors[0]}")
+
+    async def _retry(
+        self, account: str, func: Callable[[Poe_Client], Awaitable]
+    ) -> bool:
+        """限制并发，失败按退避重试，返回是否成功"""
+        # 账号不存在或没登陆，重试也不会成功
+        try:
+            client = poe.get_client(account)
+        except Exception as e:
+            self.errors.append(repr(e))
+            return False
+        if not client.login_success:
+            self.errors.append(f"Poe账号【{account}】未登陆")
+            return False
+
+        async with self._semaphore:
+            for times in range(RETRY_TIMES + 1):
+                try:
+                    await func(client)
+                    return True
+                except Exception as e:
+                    if times == RETRY_TIMES:
+                        self.errors.append(repr(e))
+                        return False
+                    await sleep(RETRY_DELAY * 2**times * (0.5 + random()))
+        return False
+
+    async def _delete_chats(self) -> int:
+        """删除用户的会话，返回这次查到的数量"""
+        _rows = await Chat.get_user_chat(self.user)
+        self.total_chats += len(_rows)
+        for start in range(0, len(_rows), DELETE_BATCH_SIZE):
+            batch = _rows[start : start + DELETE_BATCH_SIZE]
+            results = await gather(
+                *[
+                    self._retry(
+                        row[8],
+                        lambda client, row=row: client.delete_chat(row[0], row[7]),
+                    )
+                    for row in batch
+                ]
+            )
+            codes = [row[0] for row, ok in zip(batch, results) if ok]
+            if codes:
+                await Chat.delete_chats(self.user, codes)
+                self.deleted_chats += len(codes)
+            self.publish()
+        return len(_rows)
+
+    async def _delete_bots(self) -> int:
+        """删除用户的bot，返回这次查到的数量"""
+
+        async def _delete(client: Poe_Client, row: tuple):
+            if row[2] == "自定义":
+                await client.delete_bot(row[4], row[3])
+            if row[2] == "第三方":
+                await client.remove_bot(row[0], row[3])
+
+        _rows = await Bot.get_user_bot(self.user)
+        self.total_bots += len(_rows)
+        results = await gather(
+            *[
+                self._retry(row[5], lambda client, row=row: _delete(client, row))
+                for row in _rows
+            ]
+        )
+        bot_handles = [row[4] for row, ok in zip(_rows, results) if ok]
+        if bot_handles:
+            await Bot.remove_bots(self.user, bot_handles)
+            self.deleted_bots += len(bot_handles)
+            self.publish()
+        return len(_rows)
+
+    def publish(self):
+        broker.broadcast("userDeletion", self.get_stats())
+
+    def get_stats(self) -> dict:
+        return {
+            "user": self.user,
+            "state": self.state,
+            "totalChats": self.total_chats,
+            "deletedChats": self.deleted_chats,
+            "totalBots": self.total_bots,
+            "deletedBots": self.deleted_bots,
+            "errors": self.errors[-10:],
+            "startTime": self.start_time,
+            "finishTime": self.finish_time,
+        }
+
+
+# 用户名 -> 本进程最近一次删除任务
+user_deletions: dict[str, User_Deletion] = {}
+# 用户名 -> 其他进程广播过来的删除进度
+remote_deletions: dict[str, dict] = {}
+
+
+def get_user_deletion(user: str) -> dict | None:
+    """获取删除进度，没有删除任务返回None"""
+    if job := user_deletions.get(user):
+        return job.get_stats()
+    return remote_deletions.get(user)
+
+
+def start_user_deletion(user: str) -> dict:
+    """开始删除用户，已经在删除的直接返回进度"""
+    stats = get_user_deletion(user)
+    if stats and stats["state"] == "running":
+        return stats
+
+    remote_deletions.pop(user, None)
+    job = user_deletions[user] = User_Deletion(user)
+    job.task = create_task(job.run())
+    job.publish()
+    return job.get_stats()
+
+
+def _on_remote_deletion(stats: dict):
+    # 其他进程开始删除，本进程已结束的旧任务记录就作废了
+    if (job := user_deletions.get(stats["user"])) and job.state == "running":
+        return
+    user_deletions.pop(stats["user"], None)
+    remote_deletions[stats["user"]] = stats
+
+
+broker.on("userDeletion", _on_remote_deletion)
@@ -0,0 +1,148 @@
+from asyncio import Task, create_task, shield
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Awaitable, Callable, Hashable
+
+from utils.tool_util import logger
+
+
+class TTL_LRU_Cache:
+    """
+    带过期时间的LRU缓存，满了淘汰最久没用的
+
+    - 只在单个事件循环里用，不加锁
+    - get未命中或已过期返回default
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # key -> (过期时间, value)
+        self.data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default=None):
+        item = self.data.get(key)
+        if item is None or item[0] < monotonic():
+            if item is not None:
+                del self.data[key]
+            self.misses += 1
+            return default
+
+        self.data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: Hashable, value, ttl: float | None = None):
+        self.data[key] = (monotonic() + (self.ttl if ttl is None else ttl), value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def ttl_left(self, key: Hashable) -> float | None:
+        """剩余有效时间（秒），不存在或已过期返回None，不计入命中统计"""
+        item = self.data.get(key)
+        if item is None:
+            return None
+        left = item[0] - monotonic()
+        return left if left > 0 else None
+
+    def expire_within(self, ttl: float) -> int:
+        """把剩余时间超过ttl的缓存缩短到ttl，返回修改数量"""
+        expire_time = monotonic() + ttl
+        changed = 0
+        for key, item in self.data.items():
+            if item[0] > expire_time:
+                self.data[key] = (expire_time, item[1])
+                changed += 1
+        return changed
+
+    def pop(self, key: Hashable, default=None):
+        item = self.data.pop(key, None)
+        return default if item is None else item[1]
+
+    def discard_if(self, predicate: Callable[[Hashable], bool]) -> int:
+        """删除key满足条件的缓存，返回删除数量"""
+        keys = [key for key in self.data if predicate(key)]
+        for key in keys:
+            del self.data[key]
+        return len(keys)
+
+    def clear(self):
+        self.data.clear()
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self.data),
+            "maxSize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": round(self.hits / total, 4) if total else 0,
+        }
+
+
+class SWR_Cache:
+    """
+    stale-while-revalidate缓存，同一个key同时只加载一次（single-flight）
+
+    - 新鲜期内直接返回
+    - 过了新鲜期还在stale期内，返回旧数据并在后台刷新
+    - 都过了就等加载，并发的相同请求共用一次加载
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60, stale_ttl: float = 300):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # key -> (新鲜期截止时间, value)
+        self.cache = TTL_LRU_Cache(maxsize, ttl + stale_ttl)
+        # 正在加载的key
+        self.loading: dict[Hashable, Task] = {}
+        self.stale_hits = 0
+        self.coalesced_times = 0
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        item = self.cache.get(key)
+        if item is None:
+            # 请求被取消也不影响其他在等同一次加载的请求
+            return await shield(self._load(key, loader))
+
+        fresh_until, value = item
+        if fresh_until < monotonic():
+            self.stale_hits += 1
+            self._load(key, loader).add_done_callback(self._log_refresh_error)
+        return value
+
+    def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Task:
+        task = self.loading.get(key)
+        if task is None:
+            task = self.loading[key] = create_task(self._run(key, loader))
+        else:
+            self.coalesced_times += 1
+        return task
+
+    async def _run(self, key: Hashable, loader: Callable[[], Awaitable[Any]]):
+        try:
+            value = await loader()
+            self.cache.set(key, (monotonic() + self.ttl, value))
+            return value
+        finally:
+            self.loading.pop(key, None)
+
+    @staticmethod
+    def _log_refresh_error(task: Task):
+        if not task.cancelled() and (e := task.exception()):
+            logger.warning(f"后台刷新缓存出错 {repr(e)}")
+
+    def pop(self, key: Hashable):
+        self.cache.pop(key)
+
+    def get_stats(self) -> dict:
+        return self.cache.get_stats() | {
+            "staleHits": self.stale_hits,
+            "coalescedTimes": self.coalesced_times,
+        }
@@ -16,6 +16,23 @@ class Global_env(BaseSettings):
     SECRET_KEY: str = token_urlsafe(32)
     ALGORITHM: str = "HS256"
     UPLOAD_KEY: str = "ABCABCabcabc*&*&"
+    SEND_CONCURRENCY: int = 4
+    ACCOUNT_ROUTING: str = "load"
+    ANSWER_TIMEOUT: int = 15
+    SSE_HEARTBEAT: int = 15
+    AUTH_CACHE_TTL: int = 300
+    PRICE_CACHE_TTL: int = 3600
+    BOT_LIST_CACHE_TTL: int = 300
+    CATEGORY_CACHE_TTL: int = 86400
+    WORKERS: int = 1
+    BROKER_SOCKET: str = "eop_broker.sock"
+    DB_URL: str = "sqlite://data.db"
+    DB_POOL_MIN: int = 1
+    DB_POOL_MAX: int = 10
+    DB_STATEMENT_CACHE: int = 100
+    DB_PROFILE: str = "performance"
+    SQLITE_CACHE_MB: int = 64
+    SQLITE_MMAP_MB: int = 256
 
 
 gv = Global_env()
@@ -0,0 +1,10 @@
+import pytest
+from database.db import raw_sql
+from tortoise.backends.base.executor import EXECUTOR_CACHE
+
+
+@pytest.fixture(autouse=True)
+def clear_sql_cache():
+    """sqlite和postgres的测试在同一个进程里跑，按连接名缓存的sql要清掉"""
+    raw_sql.cache_clear()
+    EXECUTOR_CACHE.clear()
@@ -0,0 +1,142 @@
+from asyncio import create_task, run, sleep, wait_for
+
+from services.poe_lib import answer_queue
+from services.poe_lib.answer_queue import Answer_Event_Log, Answer_Queue_Registry
+from services.poe_lib.type import BotMessageAdd, ChatTitleUpdated, PriceCost
+
+
+def answer(message_id: int, text: str, state: str = "incomplete") -> BotMessageAdd:
+    return BotMessageAdd(state, None, message_id, 0, text, [])
+
+
+def test_log_coalesce_incomplete():
+    log = Answer_Event_Log(10)
+    log.put(answer(1, "a"))
+    log.put(answer(1, "ab"))
+    log.put(answer(1, "abc", "complete"))
+    # 同一条消息连续的未完成回答只留最新的
+    assert [item.text for _, item in log.items] == ["ab", "abc"]
+    assert log.coalesced_times == 1
+
+
+def test_log_drop_incomplete_first():
+    log = Answer_Event_Log(2)
+    log.put(ChatTitleUpdated(title="标题"))
+    log.put(answer(1, "a"))
+    log.put(PriceCost(10, 1))
+    # 满了先丢未完成的回答，标题和花费留着
+    assert [type(item).__name__ for _, item in log.items] == [
+        "ChatTitleUpdated",
+        "PriceCost",
+    ]
+    assert log.dropped_times == 1
+
+
+def test_listeners_read_all_events():
+    async def _test():
+        registry = Answer_Queue_Registry()
+        first = registry.open(1)
+        second = registry.open(1)
+        registry.publish(1, answer(2, "a"))
+        registry.publish(1, answer(2, "ab", "complete"))
+
+        # 每个监听者都能读到完整的事件
+        for queue in (first, second):
+            assert (await queue.get()).text == "a"
+            assert (await queue.get()).text == "ab"
+
+        # 等待中的监听者收到新事件就醒
+        waiting = create_task(first.get())
+        await sleep(0)
+        registry.publish(1, ChatTitleUpdated(title="标题"))
+        assert (await wait_for(waiting, 1)).title == "标题"
+
+        registry.close(1, first)
+        assert 1 in registry.logs
+        registry.close(1, second)
+        assert 1 not in registry.logs
+
+    run(_test())
+
+
+def test_claim_pending_log():
+    async def _test():
+        registry = Answer_Queue_Registry(pending_maxsize=2)
+        # 还没人订阅时收到的先暂存，第一个订阅者从头读
+        registry.publish(1, ChatTitleUpdated(title="标题"))
+        registry.publish(1, answer(2, "a"))
+        assert len(registry.pending_items(1)) == 2
+
+        queue = registry.open(1)
+        assert (await queue.get()).title == "标题"
+        assert (await queue.get()).text == "a"
+        assert registry.pending_items(1) == []
+        # 认领后上限换成正常的
+        assert queue.log.maxsize == registry.maxsize
+
+    run(_test())
+
+
+def test_replay_current_answer():
+    async def _test():
+        registry = Answer_Queue_Registry()
+        first = registry.open(1)
+        registry.publish(1, answer(2, "a", "complete"))
+        registry.publish(1, PriceCost(10, 2))
+        registry.publish(1, answer(3, "b"))
+        registry.publish(1, ChatTitleUpdated(title="标题"))
+        registry.publish(1, answer(3, "bc"))
+
+        # 后来的默认只读新事件
+        late = registry.open(1)
+        assert await late.peek(0) is None
+        # 旁听的从当前回答的第一条开始读，之前的回答跳过
+        watcher = registry.open(1, replay=True)
+        assert (await watcher.peek(0)).text == "b"
+        assert (await watcher.get()).text == "b"
+        assert (await watcher.get()).title == "标题"
+        assert (await watcher.get()).text == "bc"
+        assert (await first.get()).text == "a"
+
+        for queue in (first, late, watcher):
+            registry.close(1, queue)
+        assert 1 not in registry.logs
+
+    run(_test())
+
+
+def test_listen_and_publish_hooks():
+    registry = Answer_Queue_Registry()
+    listens, published = [], []
+    registry.listen_hook = lambda chat_id, listening: listens.append(
+        (chat_id, listening)
+    )
+    registry.publish_hook = lambda chat_id, data: published.append(chat_id)
+
+    first = registry.open(1)
+    second = registry.open(1)
+    registry.publish(1, answer(2, "a"))
+    registry.close(1, first)
+    registry.close(1, second)
+    # 只在第一个订阅和最后一个取消时通知
+    assert listens == [(1, True), (1, False)]
+    assert published == [1]
+
+
+def test_evict_idle(monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(answer_queue, "monotonic", lambda: now)
+    registry = Answer_Queue_Registry(pending_ttl=30, idle_ttl=600)
+    registry.publish(1, answer(2, "a"))
+    queue = registry.open(3)
+
+    now += 60
+    # 没人认领的超时清掉，有订阅者的还在
+    assert registry.evict_idle() == 1
+    assert 1 not in registry.logs and 3 in registry.logs
+
+    now += 600
+    assert registry.evict_idle() == 1
+    # 已经被清掉的再取消订阅不出错
+    registry.close(3, queue)
+    assert registry.get_stats()["evictedTimes"] == 2
@@ -0,0 +1,176 @@
+from asyncio import Event, create_task, run, sleep
+
+from services import answer_stream
+from services.answer_stream import (
+    Answer_Stream,
+    Answer_Stream_Registry,
+    parse_last_event_id,
+)
+from ujson import loads
+from utils.env_util import gv
+
+
+def parse(chunks: list[bytes]) -> list[tuple[str | None, str, dict]]:
+    """把SSE数据拆成(id, event, dataContent)，跳过retry和心跳"""
+    events = []
+    for chunk in chunks:
+        fields = dict(
+            line.split(": ", 1)
+            for line in chunk.decode("utf-8").strip().split("\n")
+            if ": " in line and not line.startswith(":")
+        )
+        if "event" in fields:
+            events.append(
+                (
+                    fields.get("id"),
+                    fields["event"],
+                    loads(fields["data"])["data"]["dataContent"],
+                )
+            )
+    return events
+
+
+async def collect(stream: Answer_Stream, last_seq: int = -1) -> list[bytes]:
+    return [chunk async for chunk in stream.subscribe(last_seq)]
+
+
+async def source(items: list[tuple[str, dict]], gate: Event | None = None):
+    for item in items:
+        if gate:
+            await gate.wait()
+        yield item
+
+
+def test_parse_last_event_id():
+    assert parse_last_event_id("123-4") == (123, 4)
+    assert parse_last_event_id(None) == (0, -1)
+    assert parse_last_event_id("") == (0, -1)
+    assert parse_last_event_id("123") == (0, -1)
+    assert parse_last_event_id("a-b") == (0, -1)
+
+
+def test_subscribe_and_resume():
+    async def _test():
+        stream = Answer_Stream(7, 16)
+        stream.start(
+            source(
+                [
+                    (
+                        "botMessageAdd",
+                        {"messageId": 8, "text": "a", "state": "incomplete"},
+                    ),
+                    ("chatTitleUpdated", {"title": "标题"}),
+                    ("chatPriceCost", {"price": 10}),
+                ]
+            )
+        )
+        chunks = await collect(stream)
+        assert chunks[0] == b"retry: 3000\n\n"
+        events = parse(chunks)
+        assert [(event_id, event) for event_id, event, _ in events] == [
+            ("7-0", "botMessageAdd"),
+            ("7-1", "chatTitleUpdated"),
+            ("7-2", "chatPriceCost"),
+        ]
+
+        # 带上最后收到的序号只补发之后的
+        events = parse(await collect(stream, 0))
+        assert [event_id for event_id, _, _ in events] == ["7-1", "7-2"]
+
+    run(_test())
+
+
+def delta(offset: int, text: str, state: str = "incomplete") -> tuple[str, dict]:
+    return (
+        "botMessageDelta",
+        {
+            "messageId": 8,
+            "offset": offset,
+            "delta": text,
+            "state": state,
+            "attachments": [],
+        },
+    )
+
+
+def test_snapshot_when_buffer_overwritten():
+    async def _test():
+        stream = Answer_Stream(7, 2)
+        first = {"messageId": 8, "text": "a", "state": "incomplete", "attachments": []}
+        stream.start(
+            source(
+                [
+                    ("botMessageAdd", first),
+                    delta(1, "b"),
+                    delta(2, "c"),
+                    delta(3, "d", "complete"),
+                ]
+            )
+        )
+        await stream.task
+
+        # 第0条已经被覆盖，先补一次拼好的完整回答
+        events = parse(await collect(stream, 0))
+        assert events[0][0] is None
+        assert events[0][1] == "botMessageAdd"
+        assert events[0][2]["text"] == "abcd"
+        assert events[0][2]["state"] == "complete"
+        assert [event_id for event_id, _, _ in events[1:]] == ["7-2", "7-3"]
+
+    run(_test())
+
+
+def test_live_subscribe_and_heartbeat(monkeypatch):
+    async def _test():
+        monkeypatch.setattr(gv, "SSE_HEARTBEAT", 0.01)
+        gate = Event()
+        stream = Answer_Stream(7, 16)
+        stream.start(source([("chatTitleUpdated", {"title": "标题"})], gate))
+
+        chunks = []
+
+        async def _read():
+            async for chunk in stream.subscribe():
+                chunks.append(chunk)
+
+        reader = create_task(_read())
+        await sleep(0.05)
+        # 没有新消息时发心跳
+        assert b": ping\n\n" in chunks
+
+        gate.set()
+        await reader
+        assert parse(chunks)[0][1] == "chatTitleUpdated"
+
+    run(_test())
+
+
+def test_source_error():
+    async def _test():
+        async def broken():
+            yield ("chatTitleUpdated", {"title": "标题"})
+            raise ValueError("断了")
+
+        stream = Answer_Stream(7, 16)
+        stream.start(broken())
+        events = parse(await collect(stream))
+        assert events[-1][1] == "talkError"
+        assert stream.finished
+
+    run(_test())
+
+
+def test_registry_retention(monkeypatch):
+    async def _test():
+        now = 1000.0
+        monkeypatch.setattr(answer_stream, "monotonic", lambda: now)
+        registry = Answer_Stream_Registry(retention=120)
+        stream = registry.create("u", "code", 7, source([]))
+        await stream.task
+        assert registry.get("u", "code") is stream
+
+        now += 121
+        # 结束太久的回答流清掉
+        assert registry.get("u", "code") is None
+
+    run(_test())
@@ -0,0 +1,123 @@
+from asyncio import gather, run, sleep
+
+import pytest
+from utils import cache_util
+from utils.cache_util import SWR_Cache, TTL_LRU_Cache
+
+
+class Clock:
+    """替换cache_util里的monotonic，手动拨时间"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr(cache_util, "monotonic", clock)
+    return clock
+
+
+def test_ttl_expire(clock: Clock):
+    cache = TTL_LRU_Cache(10, ttl=5)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=20)
+    assert cache.get("a") == 1
+    assert cache.ttl_left("a") == 5
+
+    clock.now += 6
+    assert cache.get("a", "miss") == "miss"
+    assert cache.ttl_left("a") is None
+    assert cache.get("b") == 2
+    assert cache.get_stats()["hits"] == 2
+    assert cache.get_stats()["misses"] == 1
+
+
+def test_lru_evict():
+    cache = TTL_LRU_Cache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    # 用过的a变成最新，满了淘汰b
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert len(cache) == 2
+
+
+def test_expire_within_and_discard(clock: Clock):
+    cache = TTL_LRU_Cache(10, ttl=100)
+    cache.set(("u1", "p"), 1)
+    cache.set(("u2", "p"), 2)
+    cache.set(("u3", "p"), 3, ttl=1)
+    assert cache.expire_within(10) == 2
+    assert cache.ttl_left(("u1", "p")) == 10
+
+    assert cache.discard_if(lambda key: key[0] == "u1") == 1
+    assert cache.get(("u1", "p")) is None
+    assert cache.get(("u2", "p")) == 2
+
+
+def test_swr_single_flight():
+    async def _test():
+        cache = SWR_Cache(10, ttl=60, stale_ttl=60)
+        calls = 0
+
+        async def loader():
+            nonlocal calls
+            calls += 1
+            await sleep(0.01)
+            return calls
+
+        # 并发的相同请求只加载一次
+        assert await gather(*[cache.get("k", loader) for _ in range(5)]) == [1] * 5
+        assert calls == 1
+        assert cache.get_stats()["coalescedTimes"] == 4
+        assert await cache.get("k", loader) == 1
+
+    run(_test())
+
+
+def test_swr_stale_refresh(clock: Clock):
+    async def _test():
+        cache = SWR_Cache(10, ttl=10, stale_ttl=100)
+        values = iter(["old", "new"])
+
+        async def loader():
+            return next(values)
+
+        assert await cache.get("k", loader) == "old"
+
+        # 过了新鲜期，先返回旧的，后台刷新
+        clock.now += 20
+        assert await cache.get("k", loader) == "old"
+        assert cache.get_stats()["staleHits"] == 1
+        await sleep(0)
+        assert await cache.get("k", loader) == "new"
+
+        # stale期也过了就等加载
+        clock.now += 200
+        values = iter(["latest"])
+        assert await cache.get("k", loader) == "latest"
+
+    run(_test())
+
+
+def test_swr_load_error():
+    async def _test():
+        cache = SWR_Cache(10)
+
+        async def loader():
+            raise ValueError("upstream")
+
+        with pytest.raises(ValueError):
+            await cache.get("k", loader)
+        # 失败的不缓存，下次重新加载
+        assert not cache.loading
+        assert cache.cache.get("k") is None
+
+    run(_test())
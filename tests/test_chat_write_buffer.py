@@ -0,0 +1,123 @@
+from asyncio import run, sleep
+
+import pytest
+from database import (  # noqa: F401 导入后才会注册模型，迁移时要用到所有表
+    account_db,
+    bot_db,
+    chat_db,
+    config_db,
+    message_db,
+    points_db,
+    user_db,
+)
+from database.chat_db import Chat, Chat_Write_Buffer
+from database.db import db_close, db_init
+from utils.env_util import gv
+
+
+@pytest.fixture
+def sqlite_url(tmp_path, monkeypatch):
+    monkeypatch.setattr(gv, "DB_URL", f"sqlite://{tmp_path / 'data.db'}")
+
+
+async def new_chats(*codes: str):
+    for code in codes:
+        await Chat.new_chat(code, 1, "u", "", "bot", "bot", "", "default")
+
+
+async def last_contents() -> dict[str, str]:
+    return dict(await Chat.filter(user="u").values_list("code", "last_content"))
+
+
+def test_coalesce_and_flush(sqlite_url):
+    async def _test():
+        await db_init()
+        try:
+            await new_chats("a", "b")
+            buffer = Chat_Write_Buffer(60)
+            buffer.update("u", "a", last_content="1")
+            buffer.update("u", "a", last_content="2", last_talk_time=5)
+            buffer.update("u", "b", last_content="3")
+            # 同一会话只保留最新的值
+            assert buffer.pending[("u", "a")] == {
+                "last_content": "2",
+                "last_talk_time": 5,
+            }
+            assert buffer.coalesced_times == 1
+
+            await buffer.flush()
+            assert await last_contents() == {"a": "2", "b": "3"}
+            assert buffer.get_stats()["writtenRows"] == 2
+            assert buffer.get_stats()["flushedTimes"] == 1
+            await buffer.close()
+        finally:
+            await db_close()
+
+    run(_test())
+
+
+def test_delay_flush(sqlite_url):
+    async def _test():
+        await db_init()
+        try:
+            await new_chats("a")
+            buffer = Chat_Write_Buffer(0.01)
+            buffer.update("u", "a", last_content="1")
+            assert await last_contents() == {"a": ""}
+            await sleep(0.05)
+            assert await last_contents() == {"a": "1"}
+            await buffer.close()
+        finally:
+            await db_close()
+
+    run(_test())
+
+
+def test_retry_failed_flush(sqlite_url, monkeypatch):
+    async def _test():
+        await db_init()
+        try:
+            await new_chats("a")
+            buffer = Chat_Write_Buffer(0.01)
+            transaction = chat_db.in_transaction
+
+            def broken():
+                monkeypatch.setattr(chat_db, "in_transaction", transaction)
+                raise ConnectionError("database is locked")
+
+            monkeypatch.setattr(chat_db, "in_transaction", broken)
+            buffer.update("u", "a", last_content="1", last_talk_time=5)
+            await sleep(0.015)
+            # 写入失败放回去，期间新来的值优先
+            assert buffer.pending == {
+                ("u", "a"): {"last_content": "1", "last_talk_time": 5}
+            }
+            buffer.update("u", "a", last_content="2")
+
+            # 没有新的更新也会再试
+            await sleep(0.05)
+            assert not buffer.pending
+            chat = await Chat.get(code="a")
+            assert (chat.last_content, chat.last_talk_time) == ("2", 5)
+            await buffer.close()
+        finally:
+            await db_close()
+
+    run(_test())
+
+
+def test_close_writes_rest(sqlite_url):
+    async def _test():
+        await db_init()
+        try:
+            await new_chats("a")
+            buffer = Chat_Write_Buffer(60)
+            buffer.update("u", "a", last_content="1")
+            # 关闭时不等间隔，马上写入
+            await buffer.close()
+            assert await last_contents() == {"a": "1"}
+            assert buffer.flush_task.done()
+        finally:
+            await db_close()
+
+    run(_test())
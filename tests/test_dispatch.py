@@ -0,0 +1,104 @@
+from asyncio import CancelledError, Event, create_task, run, sleep
+
+import pytest
+from services.poe_lib.dispatch import Send_Scheduler
+
+
+async def hold(
+    scheduler: Send_Scheduler, user: str, chat_key, order: list, release: Event
+):
+    """拿到名额后记下顺序，等release再归还"""
+    async with scheduler.slot(user, chat_key):
+        order.append((user, chat_key))
+        await release.wait()
+
+
+def test_max_concurrency():
+    async def _test():
+        scheduler = Send_Scheduler(2)
+        order, release = [], Event()
+        tasks = [
+            create_task(hold(scheduler, "u", index, order, release))
+            for index in range(4)
+        ]
+        await sleep(0)
+        assert scheduler.running == 2
+        assert scheduler.queue_depth == 2
+
+        release.set()
+        for task in tasks:
+            await task
+        assert len(order) == 4
+        assert scheduler.running == 0
+        assert scheduler.get_stats()["dispatchedTimes"] == 4
+
+    run(_test())
+
+
+def test_same_chat_serial():
+    async def _test():
+        scheduler = Send_Scheduler(4)
+        order, first, second = [], Event(), Event()
+        task1 = create_task(hold(scheduler, "u", "chat", order, first))
+        task2 = create_task(hold(scheduler, "u", "chat", order, second))
+        # 新会话不受限制
+        task3 = create_task(hold(scheduler, "u", None, order, second))
+        await sleep(0)
+        assert order == [("u", "chat"), ("u", None)]
+
+        first.set()
+        await task1
+        await sleep(0)
+        assert order[-1] == ("u", "chat")
+        second.set()
+        await task2
+        await task3
+
+    run(_test())
+
+
+def test_round_robin_users():
+    async def _test():
+        scheduler = Send_Scheduler(1)
+        order, release, blocker = [], Event(), Event()
+        first = create_task(hold(scheduler, "a", 0, order, blocker))
+        await sleep(0)
+        # a连发三个，b只发一个，b不用等a的全部发完
+        tasks = [
+            create_task(hold(scheduler, "a", index, order, release))
+            for index in range(1, 4)
+        ]
+        tasks.append(create_task(hold(scheduler, "b", 10, order, release)))
+        await sleep(0)
+
+        release.set()
+        blocker.set()
+        await first
+        for task in tasks:
+            await task
+        # 排队的按用户轮流，a先排队先放行一个，接着就轮到b
+        assert [user for user, _ in order] == ["a", "a", "b", "a", "a"]
+
+    run(_test())
+
+
+def test_cancel_while_waiting():
+    async def _test():
+        scheduler = Send_Scheduler(1)
+        order, release = [], Event()
+        running = create_task(hold(scheduler, "u", 1, order, release))
+        waiting = create_task(hold(scheduler, "u", 2, order, release))
+        await sleep(0)
+        assert scheduler.queue_depth == 1
+
+        waiting.cancel()
+        with pytest.raises(CancelledError):
+            await waiting
+        # 排队中取消的不占名额，也不留在队列里
+        assert scheduler.queue_depth == 0
+        release.set()
+        await running
+        assert scheduler.running == 0
+        assert order == [("u", 1)]
+
+    run(_test())
@@ -0,0 +1,57 @@
+from asyncio import run, sleep, wait_for
+
+from services import event_broker
+from services.event_broker import Event_Broker
+from services.poe_lib.answer_queue import Answer_Queue_Registry
+from services.poe_lib.type import BotMessageAdd
+
+
+class Stub_Client:
+    """只有回答队列的Poe账号，不连ws"""
+
+    def __init__(self):
+        self.answer_queues = Answer_Queue_Registry()
+        self.login_success = False
+        self.ws_enabled = True
+
+
+def answer(message_id: int, text: str, state: str = "incomplete") -> BotMessageAdd:
+    return BotMessageAdd(state, None, message_id, 0, text, [])
+
+
+def test_follower_replays_current_answer(tmp_path, monkeypatch):
+    monkeypatch.setattr(event_broker, "auth_hooks", [])
+
+    async def _test():
+        socket_path = str(tmp_path / "broker.sock")
+        owner, follower = Event_Broker(socket_path), Event_Broker(socket_path)
+        owner_client, follower_client = Stub_Client(), Stub_Client()
+        owner.clients["a"] = owner_client
+        follower.clients["a"] = follower_client
+        await owner.start()
+        await follower.start()
+        follower.attach("a", follower_client)
+        assert owner.is_owner and not follower.is_owner
+        while follower._writer is None:
+            await sleep(0.01)
+
+        try:
+            # owner正在拉取回答，上一次的回答还在日志里
+            fetching = owner_client.answer_queues.open(1)
+            owner_client.answer_queues.publish(1, answer(2, "a", "complete"))
+            owner_client.answer_queues.publish(1, answer(3, "b"))
+
+            # 重连到了订阅进程，从当前回答的开头旁听
+            watcher = follower_client.answer_queues.open(1, replay=True)
+            assert (await watcher.peek(1)).text == "b"
+            assert (await watcher.get()).text == "b"
+            owner_client.answer_queues.publish(1, answer(3, "bc", "complete"))
+            assert (await wait_for(watcher.get(), 1)).text == "bc"
+
+            follower_client.answer_queues.close(1, watcher)
+            owner_client.answer_queues.close(1, fetching)
+        finally:
+            await follower.close()
+            await owner.close()
+
+    run(_test())
@@ -0,0 +1,70 @@
+from asyncio import run
+
+import pytest
+from services import poe_client
+from services.poe_client import bot_list_cache, category_cache, explore_bot
+
+
+class Stub_Client:
+    """只返回探索bot数据的假Poe账号，第一页带分类列表"""
+
+    def __init__(self, category_list: list):
+        self.category_list = category_list
+        self.calls: list[tuple[str, str]] = []
+
+    async def explore_bot(self, category: str, cursor: str) -> dict:
+        self.calls.append((category, cursor))
+        return {
+            "categoryList": self.category_list if cursor == "0" else [],
+            "bots": [f"{category}-{cursor}"],
+            "pageInfo": {"endCursor": cursor + "1", "hasNextPage": True},
+        }
+
+
+class Stub_Pool:
+    def __init__(self, client: Stub_Client):
+        self.client = client
+
+
+@pytest.fixture
+def stub(monkeypatch) -> Stub_Client:
+    client = Stub_Client(["Official", "Image"])
+    monkeypatch.setattr(poe_client, "poe", Stub_Pool(client))
+    bot_list_cache.cache.clear()
+    category_cache.clear()
+    yield client
+    bot_list_cache.cache.clear()
+    category_cache.clear()
+
+
+def test_explore_bot_keeps_category_list(stub: Stub_Client):
+    async def _test():
+        first = await explore_bot("Official", "0")
+        assert first["categoryList"] == ["Official", "Image"]
+
+        # 后面的页没有分类列表，不能把缓存的覆盖掉
+        second = await explore_bot("Official", "abc")
+        assert second["categoryList"] == []
+        assert second["bots"] == ["Official-abc"]
+
+        again = await explore_bot("Official", "0")
+        assert again["categoryList"] == ["Official", "Image"]
+        assert stub.calls == [("Official", "0"), ("Official", "abc")]
+
+    run(_test())
+
+
+def test_explore_bot_caches_empty_category_list(stub: Stub_Client):
+    async def _test():
+        stub.category_list = []
+        await explore_bot("Official", "0")
+        await explore_bot("Official", "0")
+        # 空的分类列表也缓存，第二次不再请求
+        assert stub.calls == [("Official", "0")]
+
+        # 之后拿到了分类列表要替换掉空的
+        stub.category_list = ["Official"]
+        result = await explore_bot("Image", "0")
+        assert result["categoryList"] == ["Official"]
+
+    run(_test())
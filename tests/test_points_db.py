@@ -0,0 +1,128 @@
+from asyncio import run
+
+import pytest
+from database import (  # noqa: F401 导入后才会注册模型，迁移时要用到所有表
+    account_db,
+    bot_db,
+    chat_db,
+    config_db,
+    message_db,
+    points_db,
+    user_db,
+)
+from database.db import db_close, db_init
+from database.points_db import Points_Ledger, Points_Reservation, Points_Usage
+from database.user_db import User
+from utils.env_util import gv
+
+
+@pytest.fixture
+def sqlite_url(tmp_path, monkeypatch):
+    monkeypatch.setattr(gv, "DB_URL", f"sqlite://{tmp_path / 'data.db'}")
+
+
+def with_db(test):
+    """在新的sqlite数据库里跑，带一个有100积分的用户u"""
+
+    async def _test():
+        await db_init()
+        try:
+            await User.create_user("u", "", 100, 0, 1)
+            await test()
+        finally:
+            await db_close()
+
+    run(_test())
+
+
+async def ledger_rows() -> list[tuple[int, int, str]]:
+    return (
+        await Points_Ledger.all().order_by("id").values_list("points", "price", "state")
+    )
+
+
+def test_take_and_settle(sqlite_url):
+    async def _test():
+        reservation = await Points_Reservation.take("u", "bot", 10)
+        assert await User.get_remain_points("u") == 90
+        assert await ledger_rows() == [(10, 0, "open")]
+
+        # 多退少补，再收到花费直接扣
+        await reservation.settle(7)
+        await reservation.settle(3)
+        assert await User.get_remain_points("u") == 90
+        assert await ledger_rows() == [(10, 10, "settled")]
+        assert await Points_Usage.all().values_list("points", "times") == [(10, 2)]
+        # 结算后不会再退回
+        await reservation.release()
+        assert await User.get_remain_points("u") == 90
+
+    with_db(_test)
+
+
+def test_take_not_enough(sqlite_url):
+    async def _test():
+        assert await Points_Reservation.take("u", "bot", 101) is None
+        assert await ledger_rows() == []
+
+    with_db(_test)
+
+
+def test_release(sqlite_url):
+    async def _test():
+        reservation = await Points_Reservation.take("u", "bot", 10)
+        await reservation.release()
+        await reservation.release()
+        assert await User.get_remain_points("u") == 100
+        assert await ledger_rows() == [(10, 0, "released")]
+
+    with_db(_test)
+
+
+def test_settle_without_reservation(sqlite_url):
+    async def _test():
+        # 重新回答不预扣，结算时才记流水
+        reservation = Points_Reservation("u", "bot", price=5)
+        await reservation.settle_default()
+        assert await User.get_remain_points("u") == 95
+        assert await ledger_rows() == [(0, 5, "settled")]
+
+    with_db(_test)
+
+
+def test_release_stale(sqlite_url):
+    async def _test():
+        stale = await Points_Reservation.take("u", "bot", 10)
+        fresh = await Points_Reservation.take("u", "bot", 20)
+        await Points_Ledger.filter(id=stale.ledger_id).update(create_time=0)
+
+        # 只退回太久的，退过的不会再退
+        assert await Points_Ledger.release_stale() == 1
+        assert await Points_Ledger.release_stale() == 0
+        assert await User.get_remain_points("u") == 80
+
+        # 退回后才收到花费，按没预扣扣除
+        await stale.settle(7)
+        await fresh.release()
+        assert await User.get_remain_points("u") == 93
+        assert await ledger_rows() == [
+            (10, 0, "released"),
+            (20, 0, "released"),
+            (0, 7, "settled"),
+        ]
+
+    with_db(_test)
+
+
+def test_take_rollback(sqlite_url, monkeypatch):
+    async def _test():
+        async def broken(*args):
+            raise ConnectionError("database is locked")
+
+        monkeypatch.setattr(Points_Ledger, "add", broken)
+        # 记流水失败，预扣的积分也不扣
+        with pytest.raises(ConnectionError):
+            await Points_Reservation.take("u", "bot", 10)
+        assert await User.get_remain_points("u") == 100
+
+    with_db(_test)
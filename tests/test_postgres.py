@@ -0,0 +1,232 @@
+"""
+postgres相关的测试，需要一个能建表的UTF8数据库，没有设置EOP_TEST_PG_URL时全部跳过
+
+用法: EOP_TEST_PG_URL=postgres://用户名:密码@127.0.0.1:5432/eop_test python -m pytest tests
+"""
+
+from asyncio import gather, run
+from os import environ
+from typing import Awaitable, Callable
+from uuid import uuid4
+
+import pytest
+
+PG_URL = environ.get("EOP_TEST_PG_URL", "")
+if not PG_URL:
+    pytest.skip("没有设置EOP_TEST_PG_URL", allow_module_level=True)
+
+from database import (  # noqa: E402, F401 导入后才会注册模型
+    account_db,
+    bot_db,
+    chat_db,
+    config_db,
+    message_db,
+    points_db,
+    user_db,
+)
+from database.bot_db import Bot  # noqa: E402
+from database.chat_db import PREVIEW_LENGTH, Chat  # noqa: E402
+from database.context_db import Talk_Context  # noqa: E402
+from database.db import (  # noqa: E402
+    COLUMN_MIGRATIONS,
+    INDEX_MIGRATIONS,
+    db_close,
+    db_init,
+    db_migrate,
+    is_postgres,
+)
+from database.points_db import (  # noqa: E402
+    Points_Ledger,
+    Points_Reservation,
+    Points_Usage,
+)
+from database.user_db import User  # noqa: E402
+from tortoise.connection import connections  # noqa: E402
+from utils.env_util import gv  # noqa: E402
+
+gv.DB_URL = PG_URL
+
+
+def run_db(func: Callable[[], Awaitable]):
+    """每个测试用自己的事件循环，连上数据库执行完再断开"""
+
+    async def _run():
+        await db_init()
+        try:
+            await func()
+        finally:
+            await db_close()
+
+    run(_run())
+
+
+async def new_user(points: int = 100) -> str:
+    """建一个不会和其他数据冲突的用户"""
+    user = f"test_{uuid4().hex[:12]}"
+    await User.create_user(user, "passwd", points, 0, 1)
+    await User.update_remain_points(user, points)
+    return user
+
+
+async def remove_user(user: str):
+    await Chat.filter(user=user).delete()
+    await Bot.filter(user=user).delete()
+    await Points_Usage.filter(user=user).delete()
+    await Points_Ledger.filter(user=user).delete()
+    await User.filter(user=user).delete()
+
+
+def test_db_init_idempotent():
+    async def _test():
+        assert is_postgres()
+        # 已经建好表的库再补一次字段和索引也不能出错
+        await db_migrate()
+
+        conn = connections.get("default")
+        for table, column, _ in COLUMN_MIGRATIONS:
+            rows = await conn.execute_query_dict(
+                "SELECT 1 FROM information_schema.columns "
+                "WHERE table_name = $1 AND column_name = $2",
+                [table, column],
+            )
+            assert rows, f"{table}.{column}"
+
+        rows = await conn.execute_query_dict(
+            "SELECT indexname, tablename FROM pg_indexes"
+        )
+        indexes = {(row["indexname"], row["tablename"]) for row in rows}
+        for name, table, _ in INDEX_MIGRATIONS:
+            assert (name, table) in indexes
+
+    # 第二次启动时表、字段和索引都已存在
+    run_db(_test)
+    run_db(_test)
+
+
+def test_talk_context_load():
+    async def _test():
+        user = await new_user(100)
+        try:
+            await Bot.add_bot(user, "我的bot", "", "自定义", "myBot", 123, "acc")
+            await Chat.new_chat(
+                "CODE" + user, 456, user, "标题", "会话bot", "chatBot", "", "acc2"
+            )
+
+            ctx = await Talk_Context.load(user, "myBot", "CODE" + user)
+            assert ctx is not None
+            assert ctx.remain_points == 100
+            assert (ctx.bot_type, ctx.bot_name, ctx.bot_id, ctx.bot_account) == (
+                "自定义",
+                "我的bot",
+                123,
+                "acc",
+            )
+            assert (ctx.chat_bot_handle, ctx.chat_id, ctx.chat_title) == (
+                "chatBot",
+                456,
+                "标题",
+            )
+            assert ctx.chat_account == "acc2"
+            assert not ctx.is_outdate
+
+            # bot和会话不存在
+            ctx = await Talk_Context.load(user, "otherBot")
+            assert ctx is not None
+            assert not ctx.bot_exist and not ctx.chat_exist
+
+            assert await Talk_Context.load(user + "_none", "myBot") is None
+        finally:
+            await remove_user(user)
+
+    run_db(_test)
+
+
+def test_reserve_points():
+    async def _test():
+        user = await new_user(100)
+        try:
+            assert await User.reserve_points(user, 60)
+            assert await User.get_remain_points(user) == 40
+            # 不够不扣
+            assert not await User.reserve_points(user, 60)
+            assert await User.get_remain_points(user) == 40
+
+            # 并发扣除不能超扣
+            results = await gather(*[User.reserve_points(user, 10) for _ in range(8)])
+            assert sum(results) == 4
+            assert await User.get_remain_points(user) == 0
+        finally:
+            await remove_user(user)
+
+    run_db(_test)
+
+
+def test_points_usage_upsert():
+    async def _test():
+        user = await new_user()
+        try:
+            await Points_Usage.add_usage(user, "bot", 10)
+            await Points_Usage.add_usage(user, "bot", 20)
+            await gather(*[Points_Usage.add_usage(user, "bot", 1) for _ in range(5)])
+            await Points_Usage.add_usage(user, "otherBot", 3)
+
+            usage = await Points_Usage.list_usage(user)
+            assert sorted((row[1], row[3], row[4]) for row in usage) == [
+                ("bot", 35, 7),
+                ("otherBot", 3, 1),
+            ]
+        finally:
+            await remove_user(user)
+
+    run_db(_test)
+
+
+def test_reservation_ledger():
+    async def _test():
+        user = await new_user(100)
+        try:
+            # 并发预扣，每次预扣和流水在同一个事务里
+            reservations = await gather(
+                *[Points_Reservation.take(user, "bot", 30) for _ in range(4)]
+            )
+            taken = [reservation for reservation in reservations if reservation]
+            assert len(taken) == 3
+            await gather(*[reservation.settle(20) for reservation in taken])
+
+            assert await User.get_remain_points(user) == 40
+            rows = await Points_Ledger.filter(user=user).values_list(
+                "points", "price", "state"
+            )
+            assert rows == [(30, 20, "settled")] * 3
+            usage = await Points_Usage.list_usage(user)
+            assert [(row[3], row[4]) for row in usage] == [(60, 3)]
+        finally:
+            await remove_user(user)
+
+    run_db(_test)
+
+
+def test_list_user_chat():
+    async def _test():
+        user = await new_user()
+        try:
+            for index in range(5):
+                await Chat.new_chat(
+                    f"C{index}{user}", index, user, "", "bot", "bot", "", "acc"
+                )
+                await Chat.filter(code=f"C{index}{user}").update(
+                    last_talk_time=1000 + index // 2, last_content="字" * 300
+                )
+
+            first = await Chat.list_user_chat(user, limit=3)
+            assert [row[0][:2] for row in first] == ["C4", "C3", "C2"]
+            # 最后对话内容在数据库里截取
+            assert first[0][6] == "字" * PREVIEW_LENGTH
+
+            # 最后对话时间相同的按code接着翻
+            rest = await Chat.list_user_chat(user, before=(first[-1][5], first[-1][0]))
+            assert [row[0][:2] for row in rest] == ["C1", "C0"]
+        finally:
+            await remove_user(user)
+
+    run_db(_test)